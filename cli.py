@@ -0,0 +1,213 @@
+"""
+Headless entry point: converts XML report templates without any dialog or prompt, e.g. on a server or from cron.
+
+Inputs are XML files, directories (searched recursively for *.xml), glob patterns, or a manifest file listing
+one of those per line (blank lines and lines starting with # are skipped, relative paths are relative to the
+manifest). Nobody is there to confirm the likelihoods, so by default the model's conclusions are taken as they are;
+--likelihood-policy rules|deferred corrects them with rules, or queues them for one bulk review after the run
+(see src.utils.likelihood_policies).
+
+Every file is converted independently (see src.pipeline.file_conversion): a file that fails is reported and the
+run goes on. With --workers N, N worker processes convert files in parallel (see src.pipeline.worker_pool), each
+with at most --concurrency LLM calls in flight and 1/N of the RPM / TPM quota. With --staged, the files go through
+the staged pipeline in this process instead (see src.pipeline.staged_pipeline), where extraction, classification
+and generation of different files overlap. The outcome of each file is appended to results.jsonl in the output
+directory as soon as it finishes.
+
+Each file's stage outputs are recorded in a run journal in the output directory as they complete (see
+src.utils.run_journal). If the run is interrupted, --resume <output dir> converts the same files again into the
+same directory, and each file picks up after its last recorded stage.
+
+Run from the project root:
+    python cli.py templates/ "more/**/*.xml" --manifest batch.txt --output-dir out/ --workers 8 --cache use
+    python cli.py --resume out/
+
+Exit codes:
+    0   every file was converted
+    1   some files failed
+    2   bad usage: no inputs, missing inputs, input files with the same name, or no run to resume
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from dataclasses import asdict
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+RESULTS_FILENAME = "results.jsonl"
+LIKELIHOOD_POLICY_CHOICES = ("auto", "rules", "deferred")
+GLOB_CHARACTERS = "*?["
+
+
+def read_manifest(path: str) -> List[str]:
+    """The inputs listed in a manifest file, relative paths resolved against the manifest's directory."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith("#")]
+
+
+def expand_inputs(inputs: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Expands files, directories and glob patterns into XML file paths.
+    Returns:
+        Tuple[List[str], List[str]]: (the XML files, sorted and without duplicates; the inputs that matched nothing)
+    """
+    file_paths, unmatched = [], []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            matches = glob.glob(os.path.join(entry, "**", "*.xml"), recursive=True)
+        elif any(character in entry for character in GLOB_CHARACTERS):
+            matches = [path for path in glob.glob(entry, recursive=True) if os.path.isfile(path)]
+        else:
+            matches = [entry] if os.path.isfile(entry) else []
+        if not matches:
+            unmatched.append(entry)
+        file_paths.extend(os.path.abspath(path) for path in matches)
+    return sorted(set(file_paths)), unmatched
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Convert XML report templates without any interaction.")
+    parser.add_argument("inputs", nargs="*", help="XML files, directories or glob patterns.")
+    parser.add_argument("--manifest", action="append", default=[],
+                        help="A file listing inputs, one per line. Can be given more than once.")
+    parser.add_argument("--output-dir", help="Where copies and reports are written (default: a new "
+                                             "artifacts/artifacts_<timestamp> directory).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes converting files in parallel (default 1: one file at a time).")
+    parser.add_argument("--staged", action="store_true",
+                        help="Run the files through the staged pipeline in this process (PIPELINE_* settings).")
+    parser.add_argument("--concurrency", type=int,
+                        help="Upper bound of concurrent LLM calls per worker (default: LLM_MAX_CONCURRENCY).")
+    parser.add_argument("--cache", choices=["use", "refresh", "bypass"],
+                        help="How the LLM response cache is used (default: LLM_CACHE_MODE, else use).")
+    parser.add_argument("--likelihood-policy", choices=LIKELIHOOD_POLICY_CHOICES,
+                        help="How the likelihood of each report type is confirmed: auto (default) accepts the "
+                             "model's conclusions, rules corrects them with LIKELIHOOD_RULES_FILE, deferred "
+                             "generates speculatively for a bulk review afterwards (see src.utils.likelihood_policies).")
+    parser.add_argument("--resume", metavar="OUTPUT_DIR",
+                        help="Resume the interrupted run of this output directory, from its run journal.")
+    return parser
+
+
+def resume_inputs(output_dir: str) -> Tuple[List[str], str]:
+    """
+    The files and likelihood policy of the run journaled in output_dir. A run started interactively (main.py)
+    goes on with the auto policy, for the files whose likelihoods were not confirmed yet.
+    Raises:
+        ValueError: If there is no run journal in output_dir.
+    """
+    from src.utils.run_journal import RunJournal, journal_path_for
+
+    path = journal_path_for(output_dir)
+    inputs = RunJournal(path).run_inputs() if os.path.exists(path) else None
+    if inputs is None:
+        raise ValueError(f"No run to resume in {output_dir}")
+    file_paths, likelihood_policy = inputs
+    return file_paths, likelihood_policy if likelihood_policy in LIKELIHOOD_POLICY_CHOICES else "auto"
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.resume:
+        if args.inputs or args.manifest or args.output_dir:
+            print("--resume converts the inputs of the run it resumes, into its directory; it takes no inputs "
+                  "or --output-dir.", file=sys.stderr)
+            return EXIT_USAGE
+        try:
+            resumed_paths, resumed_policy = resume_inputs(args.resume)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return EXIT_USAGE
+        args.inputs, args.output_dir = resumed_paths, args.resume
+        args.likelihood_policy = args.likelihood_policy or resumed_policy
+    args.likelihood_policy = args.likelihood_policy or "auto"
+    inputs = list(args.inputs)
+    try:
+        for manifest in args.manifest:
+            inputs.extend(read_manifest(manifest))
+    except OSError as error:
+        print(f"Cannot read manifest: {error}", file=sys.stderr)
+        return EXIT_USAGE
+    if not inputs:
+        print("No inputs given.", file=sys.stderr)
+        return EXIT_USAGE
+    if args.staged and args.workers > 1:
+        print("--staged runs in a single process; it cannot be combined with --workers.", file=sys.stderr)
+        return EXIT_USAGE
+    file_paths, unmatched = expand_inputs(inputs)
+    if unmatched:
+        print(f"No XML files found for: {', '.join(unmatched)}", file=sys.stderr)
+        return EXIT_USAGE
+
+    load_dotenv()
+    if args.concurrency is not None:
+        # Read when the rate limiters are created, on the first LLM call (in each worker, see convert_files)
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+    if args.cache is not None:
+        os.environ["LLM_CACHE_MODE"] = args.cache
+
+    # Imported once the environment is set, since the LLM settings are read on import and first use
+    from src.files_management.files_handler import get_artifacts_dir
+    from src.pipeline.file_conversion import FileResult, plan_subdir_names
+    from src.pipeline.staged_pipeline import run_staged_pipeline
+    from src.pipeline.worker_pool import WorkerPoolSettings, convert_files
+    from src.utils.likelihood_policies import REVIEW_QUEUE_FILENAME
+    from src.utils.run_journal import configure_run_journal, journal_path_for, load_run_journal_enabled
+    from src.utils.telemetry import TELEMETRY_FILENAME, configure_telemetry, get_telemetry_sink
+
+    try:
+        plan_subdir_names(file_paths)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return EXIT_USAGE
+
+    artifacts_dir = args.output_dir or get_artifacts_dir()
+    os.makedirs(artifacts_dir, exist_ok=True)
+    if get_telemetry_sink() is None:
+        configure_telemetry(os.path.join(artifacts_dir, TELEMETRY_FILENAME))
+    if args.resume or load_run_journal_enabled():
+        configure_run_journal(journal_path_for(artifacts_dir)).record_run(file_paths, args.likelihood_policy)
+    if args.likelihood_policy == "deferred":
+        # Set before workers start, so they all append to the queue the review command reads
+        os.environ.setdefault("LIKELIHOOD_REVIEW_QUEUE", os.path.join(artifacts_dir, REVIEW_QUEUE_FILENAME))
+    mode = "the staged pipeline" if args.staged else f"{args.workers} workers"
+    action = "Resuming" if args.resume else "Converting"
+    print(f"{action} {len(file_paths)} files into {artifacts_dir} with {mode}")
+
+    failures = 0
+    with open(os.path.join(artifacts_dir, RESULTS_FILENAME), "a", encoding="utf-8") as results_file:
+        def on_result(result: FileResult) -> None:
+            nonlocal failures
+            results_file.write(json.dumps(asdict(result)) + "\n")
+            results_file.flush()
+            if result.ok:
+                print(f"Done {result.filename}: {result.reports_saved} reports in {result.seconds:.1f}s")
+            else:
+                failures += 1
+                print(f"FAILED {result.filename}: {result.error}", file=sys.stderr)
+
+        if args.staged:
+            run_staged_pipeline(file_paths, artifacts_dir, likelihood_policy=args.likelihood_policy, on_result=on_result)
+        else:
+            convert_files(file_paths, artifacts_dir, WorkerPoolSettings(args.workers, args.concurrency),
+                          args.likelihood_policy, on_result)
+
+    print(f"\nDone: {len(file_paths) - failures} of {len(file_paths)} files converted, {failures} failed. "
+          f"Results in {os.path.join(artifacts_dir, RESULTS_FILENAME)}")
+    if args.likelihood_policy == "deferred":
+        print(f"Review the generated report types with: python -m src.utils.likelihood_policies review {artifacts_dir}")
+    return EXIT_FAILURES if failures else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# fin.
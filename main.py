@@ -1,20 +1,42 @@
-from typing import Any, Dict, List, Literal
+from typing import List, Optional
 import json
-from src.files_management.files_handler import (
-    get_artifacts_dir,
-    select_xml_file,
-    process_xml_file,
-    save_schema_as_json,
-)
-from src.utils.likely_report_types import get_likely_report_types
-from src.utils.report_template_envocation import generate_reports_from_likely_report_types
+import os
+from src.files_management.files_handler import get_artifacts_dir, select_xml_file
+from src.batch.batch_backends import get_batch_backend, load_batch_backend_name
+from src.batch.batch_pipeline import run_batch_pipeline
+from src.utils.azure_client_utils import get_connection_stats, get_pool
+from src.utils.hedging import get_hedge_policy
+from src.utils.llm_cache import get_llm_cache
+from src.pipeline.background_preprocessing import BackgroundPreprocessor, load_preprocessing_settings
+from src.pipeline.staged_pipeline import run_staged_pipeline
+from src.utils.run_journal import configure_run_journal, journal_path_for, load_run_journal_enabled
+from src.utils.telemetry import TELEMETRY_FILENAME, configure_telemetry, get_telemetry_sink, read_records
 
 # Constants
 EXIT_COMMAND = 'exit'
 
-def collect_xml_file_paths() -> List[str]:
+def selection_conflict(file_path: str, file_paths: List[str]) -> Optional[str]:
+    """
+    Checks whether a file can be added to the selection.
+    The copy, extracted data and reports of a file are named after its file name, so two files with the same name
+    cannot be converted in one run.
+    Returns:
+        Optional[str]: Why the file cannot be added, or None if it can
+    """
+    if file_path in file_paths:
+        return f"File already selected: {file_path}"
+    filename = os.path.basename(file_path)
+    for selected in file_paths:
+        if os.path.basename(selected) == filename:
+            return f"A file named {filename} is already selected ({selected}); file names must be unique in a run"
+    return None
+
+
+def collect_xml_file_paths(preprocessor: Optional[BackgroundPreprocessor] = None) -> List[str]:
     """
     Collects XML file paths from user selection.
+    Args:
+        preprocessor: Starts pre-processing each file as soon as it is selected, if given
     Returns:
         List[str]: List of selected file paths
     """
@@ -27,7 +49,15 @@ def collect_xml_file_paths() -> List[str]:
             # Empty path means user is done selecting
             break
         
+        # Rejected before pre-processing starts, which would already spend LLM calls on the file
+        conflict = selection_conflict(file_path, file_paths)
+        if conflict:
+            print(conflict)
+            continue
+        
         file_paths.append(file_path)
+        if preprocessor is not None:
+            preprocessor.add(file_path)
         print(f"Added: {file_path}")
     
     if not file_paths:
@@ -35,10 +65,10 @@ def collect_xml_file_paths() -> List[str]:
         return []
     
     # Present files and get user confirmation
-    return confirm_file_selection(file_paths)
+    return confirm_file_selection(file_paths, preprocessor)
 
 
-def confirm_file_selection(file_paths: List[str]) -> List[str]:
+def confirm_file_selection(file_paths: List[str], preprocessor: Optional[BackgroundPreprocessor] = None) -> List[str]:
     """
     Presents selected files to user and allows modification.
     Returns:
@@ -60,21 +90,23 @@ def confirm_file_selection(file_paths: List[str]) -> List[str]:
             # Empty input means proceed
             break
         elif choice.lower().startswith('r'):
-            file_paths = remove_files_by_numbers(file_paths, choice)
+            file_paths = remove_files_by_numbers(file_paths, choice, preprocessor)
         elif choice.lower() == 'a':
-            file_paths = add_more_files(file_paths)
+            file_paths = add_more_files(file_paths, preprocessor)
         else:
             print("Invalid option. Please use 'r' followed by numbers, 'a', or press Enter.")
     
     return file_paths
 
 
-def remove_files_by_numbers(file_paths: List[str], command: str) -> List[str]:
+def remove_files_by_numbers(file_paths: List[str], command: str,
+                            preprocessor: Optional[BackgroundPreprocessor] = None) -> List[str]:
     """
     Removes files from the list based on user-specified numbers.
     Args:
         file_paths: Current list of file paths
         command: Command string like "r 1 3"
+        preprocessor: Cancels the pre-processing of the removed files, if given
     Returns:
         List[str]: Updated list with specified files removed
     """
@@ -101,11 +133,13 @@ def remove_files_by_numbers(file_paths: List[str], command: str) -> List[str]:
         # Remove files
         for index in indices_to_remove:
             removed_file = file_paths.pop(index)
+            if preprocessor is not None and removed_file not in file_paths:
+                preprocessor.remove(removed_file)
             print(f"Removed: {removed_file}")
         
         if not file_paths:
             print("All files removed. Please add some files.")
-            return add_more_files([])
+            return add_more_files([], preprocessor)
         
         return file_paths
     
@@ -114,11 +148,12 @@ def remove_files_by_numbers(file_paths: List[str], command: str) -> List[str]:
         return file_paths
 
 
-def add_more_files(current_files: List[str]) -> List[str]:
+def add_more_files(current_files: List[str], preprocessor: Optional[BackgroundPreprocessor] = None) -> List[str]:
     """
     Allows user to add more files to the current selection.
     Args:
         current_files: Current list of file paths
+        preprocessor: Starts pre-processing each file as soon as it is selected, if given
     Returns:
         List[str]: Updated list with new files added
     """
@@ -130,103 +165,102 @@ def add_more_files(current_files: List[str]) -> List[str]:
             # Empty path means done adding
             break
         
-        if file_path in current_files:
-            print(f"File already selected: {file_path}")
+        conflict = selection_conflict(file_path, current_files)
+        if conflict:
+            print(conflict)
             continue
         
         current_files.append(file_path)
+        if preprocessor is not None:
+            preprocessor.add(file_path)
         print(f"Added: {file_path}")
     
     return current_files
 
 
-def calculate_min_unique_prefix_length(filenames: List[str]) -> int:
-    """
-    Find the minimum int n, such that taking the first n characters of each string in the list will produce a unique set of strings.
-    """
-    min_length = 5
-    while True:
-        seen = set()
-        for s in filenames:
-            if len(s) < min_length:
-                return min_length
-            prefix = s[:min_length]
-            if prefix in seen:
-                break
-            seen.add(prefix)
-        else:
-            return min_length
-        min_length += 1
-
-
-def process_files_and_generate_reports(file_paths: List[str], artifacts_dir: str) -> None:
+def process_files_and_generate_reports(file_paths: List[str], artifacts_dir: str, batch_backend: Optional[str] = None,
+                                       preprocessor: Optional[BackgroundPreprocessor] = None) -> None:
     """
     Processes all selected files and generates reports.
     Args:
         file_paths: List of file paths to process
         artifacts_dir: Directory to save artifacts
+        batch_backend: "azure" or "local" to run all requests through batch jobs instead (see src.batch.batch_pipeline)
+        preprocessor: Where the files were pre-processed while they were being selected, if anywhere
     """
-    processed_files = {}
-    
-    # Process all files
-    for file_path in file_paths:
-        print(f"Pre-Processing: {file_path}")
-        processed_file = process_xml_file(file_path, artifacts_dir)
-        processed_files[processed_file.filename] = processed_file
-    
-    # Calculate subdirectory names
-    filenames = list(processed_files.keys())
-    min_prefix_length = calculate_min_unique_prefix_length(filenames)
-    
-    for filename in filenames:
-        processed_files[filename].subdir_name = filename[:min(min_prefix_length, len(filename))]
-    
-    # Generate reports for all files
-    for filename, processed_file in processed_files.items():
-        print(f'\n{"#" * 50}')
-        print(f"Generating reports for: {filename}")
-        print(f'{"#" * 50}\n')
-        
-        likely_report_types: Dict[
-            Literal["LDAP", "DNS", "NonDNS"], Literal["yes", "no", "maybe"]
-        ] = get_likely_report_types(
-            quest_report_str=processed_file.content_with_event_names, 
-            extracted_data=processed_file.extracted_data
-        )
-
-        generated_reports: Dict[str, Dict[int, Any]] = generate_reports_from_likely_report_types(
-            report_type_to_likelihood=likely_report_types,
-            quest_report_str=processed_file.content_with_event_names,
-            extracted_data=processed_file.extracted_data
-        )
-        
-        for report_type, reports in generated_reports.items():
-            print(f"{report_type}: {len(reports)} reports generated")
-            for i, report_dict in enumerate(reports):
-                report_name = f"{filename}_as_{report_type}_{i + 1}"
-                save_schema_as_json(
-                    report_to_save=report_dict,
-                    report_name=report_name,
-                    subdir_name=processed_file.subdir_name,
-                    directory=artifacts_dir
-                )
+    if batch_backend:
+        run_batch_pipeline(file_paths, artifacts_dir, get_batch_backend(batch_backend))
+        return
+
+    # Each file goes on to likelihood and generation as soon as its own extraction is done, while the other files
+    # are still being extracted (see src.pipeline.staged_pipeline)
+    if preprocessor is not None:
+        results = preprocessor.run_pipeline(file_paths, likelihood_policy="interactive")
+    else:
+        results = run_staged_pipeline(file_paths, artifacts_dir, likelihood_policy="interactive")
+    for result in results:
+        if not result.ok:
+            print(f"Failed to convert {result.filename}: {result.error}")
 
 
 def main():
     """Main function to coordinate the file processing workflow."""
     artifacts_dir = get_artifacts_dir()
+    if get_telemetry_sink() is None:
+        # Unless LLM_TELEMETRY_PATH says otherwise, keep the run's telemetry next to its reports
+        configure_telemetry(os.path.join(artifacts_dir, TELEMETRY_FILENAME))
     
-    # Collect all file paths first
-    file_paths = collect_xml_file_paths()
-    
-    if not file_paths:
-        print("No files selected. Exiting.")
-        return
-    
-    print(f"\nProceeding with {len(file_paths)} files...")
-    
-    # Process all files and generate reports
-    process_files_and_generate_reports(file_paths, artifacts_dir)
+    # Batch mode extracts through batch jobs, so there is nothing to start while files are selected
+    batch_backend = load_batch_backend_name()
+    preprocessing_concurrency = None if batch_backend else load_preprocessing_settings()
+    preprocessor = BackgroundPreprocessor(artifacts_dir, preprocessing_concurrency) if preprocessing_concurrency else None
+    # Record each file's stage outputs, so that an interrupted run can be resumed (see src.utils.run_journal)
+    journal = configure_run_journal(journal_path_for(artifacts_dir)) if load_run_journal_enabled() and not batch_backend else None
+
+    try:
+        # Collect all file paths first
+        file_paths = collect_xml_file_paths(preprocessor)
+
+        if not file_paths:
+            print("No files selected. Exiting.")
+            return
+
+        print(f"\nProceeding with {len(file_paths)} files...")
+        if journal is not None:
+            journal.record_run(file_paths, likelihood_policy="interactive")
+            print(f"If the run is interrupted, resume it with: python cli.py --resume {artifacts_dir}")
+        if preprocessor is not None:
+            status = preprocessor.status()
+            print(f"Pre-processing: {status['done']} of {status['files']} files already extracted")
+
+        # Process all files and generate reports
+        process_files_and_generate_reports(file_paths, artifacts_dir, batch_backend, preprocessor)
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+
+    stats = get_connection_stats()
+    print(f"\nLLM connections: {stats['requests']} requests over {stats['new_connections']} connections "
+          f"({stats['tls_handshakes']} TLS handshakes, {stats['reused_connections']} reused)")
+    pool = get_pool()
+    if len(pool) > 1:
+        for endpoint in pool.stats():
+            print(f"  Endpoint {endpoint['name']}: {endpoint['calls']} calls, {endpoint['failures']} failures, "
+                  f"{endpoint['ejections']} ejections, EWMA latency {endpoint['ewma_latency_ms']} ms ({endpoint['state']})")
+    cache_stats = get_llm_cache().stats()
+    print(f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['writes']} writes")
+    hedge_policy = get_hedge_policy()
+    if hedge_policy.settings.enabled:
+        hedge_stats = hedge_policy.stats()
+        print(f"Hedging: {hedge_stats['hedges']} hedged calls, {hedge_stats['hedge_wins']} won by the hedge, "
+              f"~{hedge_stats['saved_seconds']}s saved")
+    sink = get_telemetry_sink()
+    if sink is not None and os.path.exists(sink.path):
+        records = read_records(sink.path)
+        prompt_tokens = sum(record.get("prompt_tokens") or 0 for record in records)
+        cached_tokens = sum(record.get("cached_tokens") or 0 for record in records)
+        print(f"Prompt cache: {cached_tokens} of {prompt_tokens} prompt tokens were served from the prompt cache")
+        print(f"LLM telemetry written to {sink.path} (summarize with: python -m src.utils.telemetry summary {sink.path})")
 
 if __name__ == "__main__":
     main()
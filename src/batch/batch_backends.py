@@ -0,0 +1,210 @@
+"""
+Backends that run JSONL batch job files of chat-completions requests.
+
+Each line of a job file is one request, in the Azure OpenAI / OpenAI batch format:
+    {"custom_id": "...", "method": "POST", "url": "/chat/completions", "body": {...chat-completions request...}}
+and each line of the results is:
+    {"custom_id": "...", "response": {"status_code": 200, "body": {...chat completion...}}, "error": null}
+
+AzureBatchBackend uploads the file to a Global-Batch deployment and downloads the results once the job is done.
+LocalBatchBackend runs job files on this machine, keeping each job in its own directory, so the whole batch flow
+can be tested offline: by default it answers with fake schema-valid replies (see src.stand_in.fake_replies), or it
+can send each request to the configured endpoint one by one.
+
+Configuration (environment / .env):
+    AZURE_BATCH_DEPLOYMENT_NAME     The Global-Batch deployment (default: the deployment used for live calls)
+    BATCH_LOCAL_DIR                 Where the local backend keeps its jobs (default: .batch_jobs)
+    BATCH_LOCAL_RESPONDER           "fake" (default) or "endpoint"
+    BATCH_POLL_SECONDS              Seconds between status checks of Azure batch jobs (default: 60)
+"""
+import json
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from src.stand_in.fake_replies import STAND_IN_DEPLOYMENT_NAME, fake_chat_completion
+from src.utils.azure_client_utils import create_completion, get_client, load_azure_settings
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+DEFAULT_LOCAL_DIR = ".batch_jobs"
+
+
+@dataclass
+class BatchJobStatus:
+    """Data class to hold the progress of a batch job."""
+    batch_id: str
+    status: str
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+
+class BatchBackend(ABC):
+    """Submits job files and collects their results. A backend missing any of the methods cannot be created."""
+    name = "base"
+    deployment_name: str
+    poll_interval: float = 60.0  # Seconds between status checks
+
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        """Submits a job file. Returns the batch ID."""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> BatchJobStatus:
+        """Returns the progress of a job."""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> List[dict]:
+        """Returns the result lines of a finished job, including the lines of requests that failed."""
+
+
+class AzureBatchBackend(BatchBackend):
+    """Runs job files with the Azure OpenAI Batch API."""
+    name = "azure"
+
+    def __init__(self, deployment_name: str, poll_interval: float = 60.0):
+        self.deployment_name = deployment_name
+        self.poll_interval = poll_interval
+
+    def submit(self, requests_path: str) -> str:
+        client = get_client()
+        with open(requests_path, "rb") as file:
+            uploaded = client.files.create(file=file, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> BatchJobStatus:
+        batch = get_client().batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return BatchJobStatus(
+            batch_id=batch_id,
+            status=batch.status,
+            total=counts.total if counts else 0,
+            completed=counts.completed if counts else 0,
+            failed=counts.failed if counts else 0,
+        )
+
+    def results(self, batch_id: str) -> List[dict]:
+        client = get_client()
+        batch = client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return lines
+
+
+class LocalBatchBackend(BatchBackend):
+    """Runs job files locally. Each job lives in <root>/<batch id>/ with its input, results and status."""
+    name = "local"
+
+    def __init__(self, root: str = DEFAULT_LOCAL_DIR, responder: str = "fake", deployment_name: Optional[str] = None):
+        if responder not in ("fake", "endpoint"):
+            raise ValueError(f"Invalid local batch responder: {responder}. Valid responders are: fake, endpoint")
+        self.root = root
+        self.responder = responder
+        self.deployment_name = deployment_name or STAND_IN_DEPLOYMENT_NAME
+        self.poll_interval = 0.0
+
+    def _job_path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.root, batch_id, name)
+
+    def _write_status(self, status: BatchJobStatus) -> None:
+        path = self._job_path(status.batch_id, "status.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(status.__dict__, file)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"local-batch-{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.root, batch_id))
+        shutil.copyfile(requests_path, self._job_path(batch_id, "input.jsonl"))
+        self._write_status(BatchJobStatus(batch_id=batch_id, status="validating"))
+        return batch_id
+
+    def _respond(self, request: dict) -> dict:
+        body = request["body"]
+        if self.responder == "fake":
+            return fake_chat_completion(body, seed=request["custom_id"])
+        return create_completion(**body).model_dump()
+
+    def _run(self, batch_id: str) -> BatchJobStatus:
+        with open(self._job_path(batch_id, "input.jsonl"), "r", encoding="utf-8") as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+
+        status = BatchJobStatus(batch_id=batch_id, status="completed", total=len(requests))
+        with open(self._job_path(batch_id, "output.jsonl"), "w", encoding="utf-8") as output:
+            for request in requests:
+                try:
+                    line = {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": self._respond(request)},
+                        "error": None,
+                    }
+                    status.completed += 1
+                except Exception as error:
+                    line = {
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"code": type(error).__name__, "message": str(error)},
+                    }
+                    status.failed += 1
+                output.write(json.dumps(line) + "\n")
+        self._write_status(status)
+        return status
+
+    def status(self, batch_id: str) -> BatchJobStatus:
+        with open(self._job_path(batch_id, "status.json"), "r", encoding="utf-8") as file:
+            status = BatchJobStatus(**json.load(file))
+        if not status.is_done:
+            # The job runs on its first poll, like a batch picked up by the service
+            status = self._run(batch_id)
+        return status
+
+    def results(self, batch_id: str) -> List[dict]:
+        with open(self._job_path(batch_id, "output.jsonl"), "r", encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+
+BATCH_BACKENDS = ("azure", "local")
+
+
+def load_batch_backend_name() -> Optional[str]:
+    """Returns BATCH_BACKEND from the environment: the backend main.py should use, or None for live calls."""
+    load_dotenv()
+    return os.getenv("BATCH_BACKEND", "").strip().lower() or None
+
+
+def get_batch_backend(name: str) -> BatchBackend:
+    """
+    Returns a backend configured from the environment.
+    Args:
+        name (str): "azure" or "local".
+    """
+    load_dotenv()
+    if name == "azure":
+        deployment_name = os.getenv("AZURE_BATCH_DEPLOYMENT_NAME") or load_azure_settings().deployment_name
+        return AzureBatchBackend(deployment_name, float(os.getenv("BATCH_POLL_SECONDS", 60)))
+    if name == "local":
+        responder = os.getenv("BATCH_LOCAL_RESPONDER", "fake").strip().lower()
+        deployment_name = None
+        if responder == "endpoint":
+            deployment_name = load_azure_settings().deployment_name
+        return LocalBatchBackend(os.getenv("BATCH_LOCAL_DIR", DEFAULT_LOCAL_DIR), responder, deployment_name)
+    raise ValueError(f"Invalid batch backend: {name}. Valid backends are: {', '.join(BATCH_BACKENDS)}")
+
+# fin.
@@ -0,0 +1,534 @@
+"""
+Batch mode of the pipeline, for large offline conversions where cost and quota matter more than latency.
+
+Instead of calling the model request by request, every pending chat-completions request of a stage is written into
+JSONL job files, submitted to a batch backend (see src.batch.batch_backends), polled until done, and the replies
+are fanned back into the files they belong to. The stages depend on each other, so they run as successive waves:
+
+    1. extraction     one free-text summary per file
+    2. likelihood     how likely each file is to be an LDAP / DNS / NonDNS report
+    3. ldap_query     one LDAP query per LDAP variant
+    4. content        the content of every variant
+    5. metadata       the metadata of every variant
+
+The finished reports go through the same post-processing and save_generated_reports() as the interactive run.
+Nobody is there to confirm the likelihoods, so the model's conclusions go through the same non-interactive
+policies as headless runs (see src.utils.likelihood_policies): by default "auto" takes them as they are, "rules"
+and "deferred" correct or queue them like cli.py does. Replies already in the response cache are not submitted
+again, and requests that fail are resubmitted in the next job of their wave.
+
+Each wave is sent to the deployment and temperature of its stage, as in the interactive run (LLM_MODEL_<STAGE> and
+LLM_TEMPERATURE_<STAGE>, see src.utils.model_tiers), with the backend's deployment as the default. With the azure
+backend, a stage's deployment must be a Global-Batch deployment too. Escalation (LLM_ESCALATE_<STAGE>) does not
+apply: a wave has no second round for replies that fail schema validation, which are used or rejected according to
+LLM_SCHEMA_VALIDATION (see src.utils.schema_registry).
+
+Run from the project root:
+    python -m src.batch.batch_pipeline --backend local|azure [--likelihood-policy auto|rules|deferred] <file.xml> [...]
+or set BATCH_BACKEND=local|azure to make main.py use batch mode.
+
+Configuration (environment / .env):
+    BATCH_MAX_REQUESTS_PER_FILE     Requests per job file (default 50000)
+    BATCH_MAX_FILE_MB               Size of a job file in MB (default 180)
+    BATCH_MAX_ATTEMPTS              Submissions of a request before it counts as failed (default 2)
+"""
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from openai.types.chat import ChatCompletion
+
+from src.batch.batch_backends import BATCH_BACKENDS, BatchBackend, BatchJobStatus, get_batch_backend
+from src.files_management.files_handler import (
+    ProcessedXMLFile,
+    assign_subdir_names,
+    build_extraction_prompt,
+    extracted_data_path,
+    get_artifacts_dir,
+    prepare_xml_file,
+    save_generated_reports,
+)
+from src.reports_generators.DNS import DNSContentSchema, build_dns_content_prompt, build_dns_meta_prompt
+from src.reports_generators.LDAP import LDAPContentSchema, build_ldap_content_prompt, build_ldap_meta_prompt
+from src.reports_generators.NonDNS import NonDNSContentSchema, build_nondns_content_prompt, build_nondns_meta_prompt
+from src.schemas.rat_report_schema.MetaData.Meta_schema import MetaDataSchema
+from src.utils.azure_client_utils import (
+    build_completion_arguments,
+    cache_key_for,
+    resolve_stage_tier,
+    tool_arguments_of,
+)
+from src.utils.likelihood_policies import REVIEW_QUEUE_FILENAME
+from src.utils.likely_report_types import (
+    ReportTypeHints,
+    apply_likelihood_policy,
+    check_likelihood_policy,
+    get_prompt_about_likely_report_types,
+)
+from src.utils.llm_cache import get_llm_cache
+from src.utils.prompt_builder import PromptLayout
+from src.utils.report_template_envocation import (
+    TEMPERATURES_BY_LIKELIHOOD,
+    LDAPQueryAnsweringFormat,
+    describe_desired_report_properties,
+    generate_ldap_request_prompt,
+    post_process_report,
+)
+from src.utils.schema_registry import validate_reply
+from src.utils.telemetry import TELEMETRY_FILENAME, LLMCallRecord, configure_telemetry, get_telemetry_sink, telemetry_context
+
+DEFAULT_TEMPERATURE = 0.25  # The temperature the interactive run uses for extraction, likelihood and LDAP queries
+BATCH_DIRNAME = "batch"  # Job files and results are kept in this subdirectory of the artifacts directory
+
+
+@dataclass
+class BatchSettings:
+    """Data class to hold how requests are split into job files and retried."""
+    max_requests_per_file: int = 50000
+    max_file_bytes: int = 180 * 1024 * 1024
+    max_attempts: int = 2
+
+
+def load_batch_settings() -> BatchSettings:
+    load_dotenv()
+    return BatchSettings(
+        max_requests_per_file=int(os.getenv("BATCH_MAX_REQUESTS_PER_FILE", BatchSettings.max_requests_per_file)),
+        max_file_bytes=int(float(os.getenv("BATCH_MAX_FILE_MB", 180)) * 1024 * 1024),
+        max_attempts=int(os.getenv("BATCH_MAX_ATTEMPTS", BatchSettings.max_attempts)),
+    )
+
+
+@dataclass
+class BatchRequest:
+    """Data class to hold one chat-completions request of a wave."""
+    custom_id: str
+    stage: str
+    file: str
+    temperature: float
+    body: dict
+    schema: Optional[type] = None
+    report_type: Optional[str] = None
+    cache_key: Optional[str] = None
+
+    def to_line(self) -> str:
+        return json.dumps({"custom_id": self.custom_id, "method": "POST", "url": "/chat/completions", "body": self.body})
+
+
+@dataclass
+class ReportVariant:
+    """Data class to hold one variant (report type + temperature) of a file, as its waves complete."""
+    report_type: str
+    index: int
+    temperature: float
+    ldap_query: Optional[str] = None
+    content: Optional[dict] = None
+    metadata: Optional[dict] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchFileJob:
+    """Data class to hold the progress of one file through the waves."""
+    processed_file: ProcessedXMLFile
+    likelihoods: Dict[str, str] = field(default_factory=dict)
+    variants: List[ReportVariant] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchRunSummary:
+    """Data class to hold the outcome of a batch run."""
+    files: int = 0
+    reports_saved: int = 0
+    requests_submitted: int = 0
+    cache_hits: int = 0
+    failures: List[str] = field(default_factory=list)
+
+
+def make_request(
+    custom_id: str,
+    stage: str,
+    file: str,
+    layout: PromptLayout,
+    deployment_name: str,
+    temperature: float,
+    schema=None,
+    report_type: Optional[str] = None,
+) -> BatchRequest:
+    """
+    Builds one request of a wave, for the deployment and temperature of its stage.
+    Args:
+        deployment_name (str): The deployment of stages without a tier of their own (the backend's).
+        temperature (float): The temperature the call asks for, unless the stage fixes one.
+    """
+    tier = resolve_stage_tier(deployment_name, stage)
+    deployment_name, temperature = tier.deployment_name, tier.temperature_for(temperature)
+    system_prompt, prompt = layout.system_prompt, layout.user_prompt
+    return BatchRequest(
+        custom_id=custom_id,
+        stage=stage,
+        file=file,
+        temperature=temperature,
+        body=build_completion_arguments(deployment_name, system_prompt, prompt, temperature, schema),
+        schema=schema,
+        report_type=report_type,
+        cache_key=cache_key_for(deployment_name, system_prompt, prompt, temperature, schema),
+    )
+
+
+def write_job_files(requests: List[BatchRequest], path_prefix: str, settings: BatchSettings) -> List[str]:
+    """
+    Writes requests into as many JSONL job files as the per-file limits require.
+    Returns:
+        List[str]: The paths of the job files.
+    """
+    paths: List[str] = []
+    file = None
+    count = size = 0
+    try:
+        for request in requests:
+            line = (request.to_line() + "\n").encode("utf-8")
+            if file is None or count >= settings.max_requests_per_file or size + len(line) > settings.max_file_bytes:
+                if file is not None:
+                    file.close()
+                paths.append(f"{path_prefix}_{len(paths) + 1}.jsonl")
+                file = open(paths[-1], "wb")
+                count = size = 0
+            file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if file is not None:
+            file.close()
+    return paths
+
+
+def wait_for_batches(backend: BatchBackend, batch_ids: List[str]) -> Dict[str, BatchJobStatus]:
+    """Polls the jobs until all of them are done."""
+    statuses: Dict[str, BatchJobStatus] = {}
+    while True:
+        for batch_id in batch_ids:
+            if batch_id not in statuses or not statuses[batch_id].is_done:
+                statuses[batch_id] = backend.status(batch_id)
+        pending = [status for status in statuses.values() if not status.is_done]
+        if not pending:
+            return statuses
+        done = sum(status.completed + status.failed for status in statuses.values())
+        total = sum(status.total for status in statuses.values())
+        print(f"Waiting for {len(pending)} batch jobs ({done}/{total} requests done)...", end='\r')
+        time.sleep(backend.poll_interval)
+
+
+def read_result(line: Optional[dict], schema=None) -> Tuple[Optional[str], Any, Optional[dict], Optional[str]]:
+    """
+    Reads one result line.
+    Returns:
+        Tuple: (the reply as cached or None if it should not be cached, the parsed reply, the usage,
+                an error message or None)
+    """
+    if line is None:
+        return None, None, None, "no result"
+    if line.get("error"):
+        return None, None, None, f"{line['error'].get('code')}: {line['error'].get('message')}"
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        return None, None, None, f"HTTP {response.get('status_code')}: {body.get('error')}"
+    try:
+        completion = ChatCompletion.model_validate(body)
+        if schema is not None:
+            reply = tool_arguments_of(completion)
+            parsed = json.loads(reply)
+            if not validate_reply(schema, parsed):
+                reply = None  # Used, but never cached
+        else:
+            reply = parsed = completion.choices[0].message.content
+    except (ValueError, IndexError, TypeError, AttributeError) as error:
+        return None, None, None, f"unreadable reply: {error}"
+    return reply, parsed, body.get("usage"), None
+
+
+def _record(request: BatchRequest, usage: Optional[dict], cache_hit: bool, error: Optional[str], batch_id: str = "") -> None:
+    sink = get_telemetry_sink()
+    if sink is None:
+        return
+    usage = usage or {}
+    sink.write(LLMCallRecord(
+        timestamp=time.time(),
+        deployment=request.body["model"],
+        temperature=request.temperature,
+        stage=request.stage,
+        file=request.file,
+        report_type=request.report_type,
+        schema=request.schema.__name__ if request.schema else None,
+        prompt_tokens=usage.get("prompt_tokens"),
+        cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        total_tokens=usage.get("total_tokens"),
+        cache_hit=cache_hit,
+        error=error,
+        extra={"batch_id": batch_id} if batch_id else {},
+    ))
+
+
+def run_wave(
+    stage: str,
+    requests: List[BatchRequest],
+    backend: BatchBackend,
+    work_dir: str,
+    settings: BatchSettings,
+    summary: BatchRunSummary,
+) -> Dict[str, Any]:
+    """
+    Runs all requests of one stage through the backend.
+    Returns:
+        Dict[str, Any]: custom_id -> parsed reply, for the requests that succeeded.
+    """
+    cache = get_llm_cache()
+    replies: Dict[str, Any] = {}
+    pending: List[BatchRequest] = []
+    for request in requests:
+        cached = cache.get(request.cache_key) if request.cache_key else None
+        if cached is None:
+            pending.append(request)
+            continue
+        replies[request.custom_id] = json.loads(cached) if request.schema is not None else cached
+        summary.cache_hits += 1
+        _record(request, None, cache_hit=True, error=None)
+
+    print(f"\nWave '{stage}': {len(requests)} requests, {len(requests) - len(pending)} from the cache")
+    errors: Dict[str, str] = {}
+    for attempt in range(1, settings.max_attempts + 1):
+        if not pending:
+            break
+        paths = write_job_files(pending, os.path.join(work_dir, f"{stage}_attempt{attempt}"), settings)
+        batch_ids = [backend.submit(path) for path in paths]
+        summary.requests_submitted += len(pending)
+        print(f"Submitted {len(pending)} requests in {len(batch_ids)} batch jobs: {', '.join(batch_ids)}")
+
+        results: Dict[str, Tuple[dict, str]] = {}
+        for batch_id, status in wait_for_batches(backend, batch_ids).items():
+            if status.status != "completed":
+                print(f"\nBatch job {batch_id} ended as {status.status}")
+                continue
+            for line in backend.results(batch_id):
+                results[line["custom_id"]] = (line, batch_id)
+
+        failed: List[BatchRequest] = []
+        for request in pending:
+            line, batch_id = results.get(request.custom_id, (None, ""))
+            reply, parsed, usage, error = read_result(line, request.schema)
+            _record(request, usage, cache_hit=False, error=error, batch_id=batch_id)
+            if error is not None:
+                errors[request.custom_id] = error
+                failed.append(request)
+                continue
+            replies[request.custom_id] = parsed
+            if request.cache_key and reply is not None:
+                cache.put(request.cache_key, reply)
+        pending = failed
+
+    for request in pending:
+        failure = f"{request.file}: {stage} request {request.custom_id} failed ({errors[request.custom_id]})"
+        print(failure)
+        summary.failures.append(failure)
+    return replies
+
+
+def _content_layout(job: BatchFileJob, variant: ReportVariant) -> Tuple[PromptLayout, type]:
+    processed_file = job.processed_file
+    description = describe_desired_report_properties(variant.report_type)
+    if variant.report_type == "LDAP":
+        layout = build_ldap_content_prompt(
+            processed_file.minified_content, processed_file.extracted_data, variant.ldap_query, description)
+        return layout, LDAPContentSchema
+    if variant.report_type == "DNS":
+        layout = build_dns_content_prompt(processed_file.minified_content, processed_file.extracted_data, description)
+        return layout, DNSContentSchema
+    layout = build_nondns_content_prompt(processed_file.minified_content, processed_file.extracted_data, description)
+    return layout, NonDNSContentSchema
+
+
+def _metadata_layout(job: BatchFileJob, variant: ReportVariant) -> PromptLayout:
+    processed_file = job.processed_file
+    if variant.report_type == "LDAP":
+        return build_ldap_meta_prompt(
+            processed_file.minified_content, processed_file.extracted_data, variant.ldap_query, variant.content)
+    if variant.report_type == "DNS":
+        return build_dns_meta_prompt(processed_file.minified_content, processed_file.extracted_data, variant.content)
+    return build_nondns_meta_prompt(processed_file.minified_content, processed_file.extracted_data, variant.content)
+
+
+def run_batch_pipeline(
+    file_paths: List[str],
+    artifacts_dir: str,
+    backend: BatchBackend,
+    settings: Optional[BatchSettings] = None,
+    likelihood_policy: str = "auto",
+) -> BatchRunSummary:
+    """
+    Converts the files through batch jobs, wave by wave, and saves the reports like the interactive run.
+    Args:
+        file_paths (List[str]): The XML templates to convert.
+        artifacts_dir (str): Where the copies, job files and reports are written.
+        backend (BatchBackend): Runs the job files.
+        settings (Optional[BatchSettings]): Job file limits and retries. Defaults to the environment's.
+        likelihood_policy (str): "auto", "rules" or "deferred", see apply_likelihood_policy. Batch runs are never
+            interactive.
+    Returns:
+        BatchRunSummary: What was saved and what failed.
+    """
+    check_likelihood_policy(likelihood_policy)
+    if likelihood_policy == "interactive":
+        raise ValueError("Batch runs cannot ask the operator; use the auto, rules or deferred likelihood policy")
+    settings = settings or load_batch_settings()
+    work_dir = os.path.join(artifacts_dir, BATCH_DIRNAME)
+    os.makedirs(work_dir, exist_ok=True)
+    deployment_name = backend.deployment_name
+    summary = BatchRunSummary(files=len(file_paths))
+
+    jobs = []
+    for file_path in file_paths:
+        print(f"Pre-Processing: {file_path}")
+        jobs.append(BatchFileJob(prepare_xml_file(file_path, artifacts_dir)))
+    assign_subdir_names([job.processed_file for job in jobs])
+
+    # Wave 1: extraction
+    requests = [
+        make_request(f"f{i}-extraction", "extraction", job.processed_file.filename,
+                     build_extraction_prompt(job.processed_file.minified_content, job.processed_file.events_index),
+                     deployment_name, DEFAULT_TEMPERATURE)
+        for i, job in enumerate(jobs)
+    ]
+    replies = run_wave("extraction", requests, backend, work_dir, settings, summary)
+    for i, job in enumerate(jobs):
+        extracted_data = replies.get(f"f{i}-extraction")
+        if extracted_data is None:
+            job.error = "extraction failed"
+            continue
+        job.processed_file.extracted_data = extracted_data
+        with open(extracted_data_path(job.processed_file.filename, artifacts_dir), "w", encoding="utf-8") as file:
+            file.write(extracted_data)
+
+    # Wave 2: likelihood
+    requests = [
+        make_request(f"f{i}-likelihood", "likelihood", job.processed_file.filename,
+                     get_prompt_about_likely_report_types(job.processed_file.minified_content,
+                                                          job.processed_file.extracted_data),
+                     deployment_name, DEFAULT_TEMPERATURE, ReportTypeHints)
+        for i, job in enumerate(jobs) if job.error is None
+    ]
+    replies = run_wave("likelihood", requests, backend, work_dir, settings, summary)
+    for i, job in enumerate(jobs):
+        if job.error is not None:
+            continue
+        hints = replies.get(f"f{i}-likelihood")
+        if hints is None:
+            job.error = "likelihood failed"
+            continue
+        processed_file = job.processed_file
+        with telemetry_context(file=processed_file.filename):
+            job.likelihoods = apply_likelihood_policy(hints, likelihood_policy, processed_file.minified_content,
+                                                      processed_file.extracted_data, processed_file.events_found)
+        print(f"{job.processed_file.filename}: {job.likelihoods}")
+        for report_type, likelihood in job.likelihoods.items():
+            for index, temperature in enumerate(TEMPERATURES_BY_LIKELIHOOD[likelihood]):
+                job.variants.append(ReportVariant(report_type, index, temperature))
+
+    def variants_of(job: BatchFileJob, report_type: Optional[str] = None):
+        return [variant for variant in job.variants
+                if variant.error is None and (report_type is None or variant.report_type == report_type)]
+
+    def variant_id(i: int, stage: str, variant: ReportVariant) -> str:
+        return f"f{i}-{stage}-{variant.report_type}-{variant.index}"
+
+    # Wave 3: LDAP queries
+    requests = [
+        make_request(variant_id(i, "ldap_query", variant), "ldap_query", job.processed_file.filename,
+                     generate_ldap_request_prompt(job.processed_file.minified_content,
+                                                  job.processed_file.extracted_data),
+                     deployment_name, DEFAULT_TEMPERATURE, LDAPQueryAnsweringFormat, variant.report_type)
+        for i, job in enumerate(jobs) for variant in variants_of(job, "LDAP")
+    ]
+    replies = run_wave("ldap_query", requests, backend, work_dir, settings, summary)
+    for i, job in enumerate(jobs):
+        for variant in variants_of(job, "LDAP"):
+            reply = replies.get(variant_id(i, "ldap_query", variant))
+            if reply is None:
+                variant.error = "ldap_query failed"
+            else:
+                variant.ldap_query = reply["ldap_query"]
+
+    # Wave 4: content
+    requests = []
+    for i, job in enumerate(jobs):
+        for variant in variants_of(job):
+            layout, schema = _content_layout(job, variant)
+            requests.append(make_request(variant_id(i, "content", variant), "content", job.processed_file.filename,
+                                         layout, deployment_name, variant.temperature, schema, variant.report_type))
+    replies = run_wave("content", requests, backend, work_dir, settings, summary)
+    for i, job in enumerate(jobs):
+        for variant in variants_of(job):
+            variant.content = replies.get(variant_id(i, "content", variant))
+            if variant.content is None:
+                variant.error = "content failed"
+
+    # Wave 5: metadata
+    requests = [
+        make_request(variant_id(i, "metadata", variant), "metadata", job.processed_file.filename,
+                     _metadata_layout(job, variant), deployment_name, variant.temperature, MetaDataSchema,
+                     variant.report_type)
+        for i, job in enumerate(jobs) for variant in variants_of(job)
+    ]
+    replies = run_wave("metadata", requests, backend, work_dir, settings, summary)
+
+    # Fan back into post-processing and saving
+    for i, job in enumerate(jobs):
+        if job.error is not None:
+            summary.failures.append(f"{job.processed_file.filename}: {job.error}")
+            continue
+        generated_reports: Dict[str, List[dict]] = {report_type: [] for report_type in job.likelihoods}
+        for variant in variants_of(job):
+            variant.metadata = replies.get(variant_id(i, "metadata", variant))
+            if variant.metadata is None:
+                continue
+            report = {"Content": variant.content,
+                      "MetaData": variant.metadata,
+                      "SecurityReportSettings": None,
+                      "CustomLogic": None}
+            generated_reports[variant.report_type].append(post_process_report(variant.report_type, report))
+        save_generated_reports(job.processed_file, generated_reports, artifacts_dir)
+        summary.reports_saved += sum(len(reports) for reports in generated_reports.values())
+
+    print(f"\nBatch run done: {summary.reports_saved} reports saved for {summary.files} files, "
+          f"{summary.requests_submitted} requests submitted, {summary.cache_hits} served from the cache, "
+          f"{len(summary.failures)} failures")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert XML report templates through batch jobs.")
+    parser.add_argument("paths", nargs="+", help="XML template files.")
+    parser.add_argument("--backend", choices=BATCH_BACKENDS, default="local")
+    parser.add_argument("--likelihood-policy", choices=["auto", "rules", "deferred"], default="auto",
+                        help="How the model's likelihood conclusions are turned into report types to generate.")
+    args = parser.parse_args()
+
+    artifacts_dir = get_artifacts_dir()
+    if get_telemetry_sink() is None:
+        configure_telemetry(os.path.join(artifacts_dir, TELEMETRY_FILENAME))
+    if args.likelihood_policy == "deferred":
+        os.environ.setdefault("LIKELIHOOD_REVIEW_QUEUE", os.path.join(artifacts_dir, REVIEW_QUEUE_FILENAME))
+    summary = run_batch_pipeline(args.paths, artifacts_dir, get_batch_backend(args.backend),
+                                 likelihood_policy=args.likelihood_policy)
+    raise SystemExit(1 if summary.failures else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
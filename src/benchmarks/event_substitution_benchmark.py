@@ -0,0 +1,86 @@
+"""
+Benchmarks the single-pass event ID substitution against the original per-mapping-row str.replace loop.
+
+Run from the project root:
+    python -m src.benchmarks.event_substitution_benchmark [--sizes-mb 1 4 16] [--repeats 3]
+"""
+import argparse
+import random
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from src.files_management.files_handler import load_event_id_to_name_mapping, substitute_event_ids
+
+
+def legacy_substitute_event_ids(xml_content: str, mapping: Dict[str, str]) -> str:
+    """The original implementation: one full scan and copy of the content per mapping row."""
+    res = xml_content
+    for event_id, event_name in mapping.items():
+        res = res.replace(f'"{event_id}"', f'"{event_name}"')
+    return res
+
+
+def build_synthetic_template(mapping: Dict[str, str], size_mb: float, seed: int = 0) -> str:
+    """
+    Builds an XML template of roughly the requested size, mixing known event IDs,
+    unknown GUIDs and plain attributes, the way real exports look.
+    """
+    rng = random.Random(seed)
+    known_ids = list(mapping.keys())
+    target_len = int(size_mb * 1024 * 1024)
+    parts: List[str] = ['<?xml version="1.0" encoding="utf-16"?>\n<ReportTemplate>\n']
+    length = len(parts[0])
+    while length < target_len:
+        if rng.random() < 0.6:
+            guid = rng.choice(known_ids)
+        else:
+            guid = str(uuid.UUID(int=rng.getrandbits(128)))
+        line = (f'  <Filter Name="EventClass" Operator="Equals" Value="{guid}" '
+                f'Id="{rng.randint(0, 10 ** 6)}" Description="Some filter description text" />\n')
+        parts.append(line)
+        length += len(line)
+    parts.append("</ReportTemplate>\n")
+    return "".join(parts)
+
+
+def time_it(func: Callable[[], object], repeats: int) -> float:
+    """Returns the best wall-clock time (seconds) out of `repeats` runs."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(sizes_mb: List[float], repeats: int) -> None:
+    mapping = load_event_id_to_name_mapping()
+    print(f"Mapping rows: {len(mapping)}")
+    print(f"{'size (MB)':>10} {'legacy (s)':>12} {'single-pass (s)':>16} {'speedup':>9}")
+
+    for size_mb in sizes_mb:
+        template = build_synthetic_template(mapping, size_mb)
+
+        legacy_result = legacy_substitute_event_ids(template, mapping)
+        new_result, _ = substitute_event_ids(template, mapping)
+        if legacy_result != new_result:
+            raise AssertionError(f"Outputs differ for a {size_mb} MB template.")
+
+        legacy_time = time_it(lambda: legacy_substitute_event_ids(template, mapping), repeats)
+        new_time = time_it(lambda: substitute_event_ids(template, mapping), repeats)
+        print(f"{size_mb:>10} {legacy_time:>12.3f} {new_time:>16.3f} {legacy_time / new_time:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event ID substitution.")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[0.5, 2, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.sizes_mb, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
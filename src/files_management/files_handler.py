@@ -1,13 +1,28 @@
 import datetime
 import json
 import os
-import tkinter as tk
-from tkinter import filedialog
-from typing import Optional, Set, Tuple
-import pandas as pd
-from dataclasses import dataclass
+import re
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 
-from src.utils.azure_client_utils import ask
+from src.knowledge.knowledge_pack import get_knowledge_base
+from src.utils.azure_client_utils import ask_stream, ask_stream_async
+from src.utils.prompt_builder import PromptLayout, tagged
+from src.files_management.xml_minifier import MinificationStats, minify_for_prompts
+from src.utils.run_journal import get_file_journal
+from src.utils.telemetry import telemetry_context
+
+
+@dataclass
+class EventOccurrences:
+    """Data class to hold where a single event ID occurs in an XML file."""
+    event_id: str
+    event_name: str
+    offsets: List[int] = field(default_factory=list)  # Offsets of the ID in the original XML content
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets)
 
 
 @dataclass
@@ -19,6 +34,9 @@ class ProcessedXMLFile:
     events_found: Set[str]
     extracted_data: str
     subdir_name: str = ""
+    events_index: Dict[str, EventOccurrences] = field(default_factory=dict)  # Event ID -> occurrences
+    minified_content: str = ""  # The compact form of content_with_event_names that is put into prompts
+    minification: Optional[MinificationStats] = None
 
 
 def get_artifacts_dir(exists_ok: bool = True) -> str:
@@ -49,56 +67,179 @@ def get_artifacts_dir(exists_ok: bool = True) -> str:
     return dir_path
 
 
-def replace_event_ids_with_names(xml_content: str) -> Tuple[str, Set[str]]:
-    """Replace event IDs with names in XML content."""
-    res = xml_content
-    df = pd.read_csv("knowledge/events_ids_names_mapping.csv")
-    mapping = pd.Series(
-        df["EventClassNames"].values,
-        index=df["EventClassIDs"]).to_dict()
+# A GUID sitting directly between two double quotes. The quotes are matched with look-arounds
+# so that adjacent values sharing a quote (e.g. '"id1"id2"') are both found, like str.replace does.
+# Unlike the old per-ID str.replace loop, the same ID twice around a shared quote ('"id1"id1"') is
+# replaced twice too: the loop's first match consumed the shared quote and left the second ID as it was.
+QUOTED_GUID_PATTERN = re.compile(
+    r'(?<=")[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=")'
+)
+
+
+def load_event_id_to_name_mapping() -> Dict[str, str]:
+    """
+    Returns the event ID -> event name mapping from the process-wide knowledge pack.
+    Returns:
+        Dict[str, str]: Event class IDs mapped to their event class names.
+    """
+    return get_knowledge_base().event_names_by_id
+
+
+def substitute_event_ids(xml_content: str, mapping: Dict[str, str]) -> Tuple[str, Dict[str, EventOccurrences]]:
+    """
+    Replaces every quoted event ID in the XML content with its event name, in a single pass,
+    and indexes where each known event ID occurs.
+    IDs that are not in the mapping are left untouched and are not indexed.
+    Args:
+        xml_content (str): The XML content.
+        mapping (Dict[str, str]): Event class IDs mapped to their event class names.
+    Returns:
+        Tuple[str, Dict[str, EventOccurrences]]: (content with event names instead of IDs, event ID -> occurrences)
+    """
+    events_index: Dict[str, EventOccurrences] = {}
+
+    def name_or_id(match: re.Match) -> str:
+        event_id = match.group(0)
+        event_name = mapping.get(event_id)
+        if event_name is None:
+            return event_id
+        occurrences = events_index.get(event_id)
+        if occurrences is None:
+            occurrences = events_index[event_id] = EventOccurrences(event_id=event_id, event_name=event_name)
+        occurrences.offsets.append(match.start())
+        return event_name
+
+    return QUOTED_GUID_PATTERN.sub(name_or_id, xml_content), events_index
+
+
+def replace_event_ids_with_names(xml_content: str) -> Tuple[str, Set[str], Dict[str, EventOccurrences]]:
+    """
+    Replace event IDs with names in XML content.
+    Returns:
+        Tuple[str, Set[str], Dict[str, EventOccurrences]]: (content with event names, names of the events that
+        actually occur in the content, event ID -> occurrences)
+    """
+    mapping = load_event_id_to_name_mapping()
+    res, events_index = substitute_event_ids(xml_content, mapping)
+    events_found: Set[str] = {occurrences.event_name for occurrences in events_index.values()}
+
+    return res, events_found, events_index
+
 
-    events_found: Set[str] = set()
+def describe_events_found(events_index: Dict[str, EventOccurrences]) -> str:
+    """
+    Describes the events that occur in a report, most frequent first, for use in prompts.
+    """
+    if not events_index:
+        return "(no known event IDs were found in the report)"
+    ordered = sorted(events_index.values(), key=lambda occurrences: (-occurrences.count, occurrences.event_name))
+    return "\n".join(
+        f"- {occurrences.event_name} ({occurrences.count} occurrence{'s' if occurrences.count != 1 else ''})"
+        for occurrences in ordered
+    )
 
-    # Replace event IDs with names in the XML content
-    for event_id, event_name in mapping.items():
-        res = res.replace(f'"{event_id}"', f'"{event_name}"')
-        events_found.add(event_name)
 
-    return res, events_found
+EXTRACTION_SYSTEM_PROMPT = "You are a helpful assistant, expert at report understanding and data & insights extraction."
+EXTRACTED_DATA_SUFFIX = "_extracted_data.md"  # The streamed extraction reply is written next to the copied XML file
 
 
-def extract_data_about_report(content_with_event_names_instead_of_ids: str, events_found: Set[str]) -> str:
+EXTRACTION_INSTRUCTIONS = """I will give you an XML report template content, and the events I think it includes.
+
+Please tell me, in an elaborate way, what is the report about:
+- which environemt/scope does it search in?
+- Which events are included in the report?
+- Is there a daterange?
+- Other filtering parameters?
+- What information is displayed about the result? Which object fields?
+- Any other relevant information that you can extract from the XML content.
+
+Your summary will be used as a replacement for the report- so it should be inclusive, exhaustive and ellaborate.
+Start your answer with "# Report Overview and Extracted Data"."""
+
+
+def build_extraction_prompt(content_with_event_names_instead_of_ids: str, events_index: Dict[str, EventOccurrences]) -> PromptLayout:
+    # The instructions are the same for every file, so they come first (see src.utils.prompt_builder)
+    return PromptLayout(
+        system=EXTRACTION_SYSTEM_PROMPT,
+        knowledge=(EXTRACTION_INSTRUCTIONS,),
+        document=(
+            f"Here's an XML report template content:\n{tagged('xml report template', content_with_event_names_instead_of_ids)}",
+            f"I think that it includes the following events:\n{describe_events_found(events_index)}",
+        ),
+    )
+
+
+def remove_partial_file(path: str) -> None:
+    """Deletes what a reply that broke off had streamed into a file, so that no half-written file is left behind."""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def extract_data_about_report(
+    content_with_event_names_instead_of_ids: str,
+    events_index: Dict[str, EventOccurrences],
+    stream_to: Optional[str] = None,
+) -> str:
     """
     Extracts data about the report from the XML content.
+    The reply is streamed, so progress is shown while it is written.
     Args:
         content_with_event_names_instead_of_ids (str): The XML content with event names instead of IDs.
-        events_found (Set[str]): A set of event names found in the content.
+        events_index (Dict[str, EventOccurrences]): The events that occur in the content.
+        stream_to (Optional[str]): A file to write the reply to as it arrives.
+    Returns:
+        str: The whole reply.
     """
-    prompt = f"""Here's an XML report template content:
-    <xml report template>
-    {content_with_event_names_instead_of_ids}
-    </xml report template>
+    layout = build_extraction_prompt(content_with_event_names_instead_of_ids, events_index)
+
+    with telemetry_context(stage="extraction"):
+        chunks = ask_stream(system_prompt=layout.system_prompt, prompt=layout.user_prompt)
+        if stream_to is None:
+            return "".join(chunks)
+
+        received = []
+        try:
+            with open(stream_to, "w", encoding="utf-8") as file:
+                for chunk in chunks:
+                    received.append(chunk)
+                    file.write(chunk)
+                    file.flush()
+        except BaseException:
+            remove_partial_file(stream_to)
+            raise
     
-    I think that it includes the following events:
-    {events_found}
-    
-    Please tell me, in an elaborate way, what is the report about:
-    - which environemt/scope does it search in?
-    - Which events are included in the report?
-    - Is there a daterange?
-    - Other filtering parameters?
-    - What information is displayed about the result? Which object fields?
-    - Any other relevant information that you can extract from the XML content.
-    
-    Your summary will be used as a replacement for the report- so it should be inclusive, exhaustive and ellaborate.
-    Start your answer with "# Report Overview and Extracted Data".
+    return "".join(received)
+
+
+async def extract_data_about_report_async(
+    content_with_event_names_instead_of_ids: str,
+    events_index: Dict[str, EventOccurrences],
+    stream_to: Optional[str] = None,
+) -> str:
     """
-    
-    extracted_data_as_str = ask(
-        system_prompt="You are a helpful assistant, expert at report understanding and data & insights extraction.",
-        prompt=prompt)
-    
-    return extracted_data_as_str
+    Async version of extract_data_about_report().
+    Returns:
+        str: The whole reply, once the stream has finished.
+    """
+    layout = build_extraction_prompt(content_with_event_names_instead_of_ids, events_index)
+
+    with telemetry_context(stage="extraction"):
+        chunks = ask_stream_async(system_prompt=layout.system_prompt, prompt=layout.user_prompt)
+        if stream_to is None:
+            return "".join([chunk async for chunk in chunks])
+
+        received = []
+        try:
+            with open(stream_to, "w", encoding="utf-8") as file:
+                async for chunk in chunks:
+                    received.append(chunk)
+                    file.write(chunk)
+                    file.flush()
+        except BaseException:
+            remove_partial_file(stream_to)
+            raise
+
+    return "".join(received)
     
 
 def select_xml_file() -> Optional[str]:
@@ -107,6 +248,10 @@ def select_xml_file() -> Optional[str]:
     Returns:
         Optional[str]: The selected file path, or None if no file was selected.
     """
+    # Imported here so that headless runs (see cli.py) never need a display or tkinter at all
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()  # Hide the root window
 
@@ -152,33 +297,137 @@ def copy_and_read_xml_file(file_path: str, copy_to: Optional[str] = None) -> Tup
     return filename, content
 
 
-def process_xml_file(file_path: str, copy_to: Optional[str] = None) -> ProcessedXMLFile:
+def prepare_xml_file(file_path: str, copy_to: Optional[str] = None) -> ProcessedXMLFile:
     """
-    Processes a single XML file: copies, reads, replaces event IDs, and extracts data.
+    Prepares a single XML file without calling the model: copies, reads, replaces event IDs, and minifies.
+    The returned file's extracted_data is still empty.
     Args:
         file_path (str): Path to the XML file to process
         copy_to (Optional[str]): Directory to copy the file to
     Returns:
-        ProcessedXMLFile: Processed file data
+        ProcessedXMLFile: Processed file data, without extracted data
     """
     filename, original_content = copy_and_read_xml_file(file_path, copy_to)
-    content_with_event_names, events_found = replace_event_ids_with_names(original_content)
-    extracted_data = extract_data_about_report(content_with_event_names, events_found)
-    
+    return substitute_and_minify(filename, original_content)
+
+
+def substitute_and_minify(filename: str, original_content: str) -> ProcessedXMLFile:
+    """
+    The CPU-bound half of prepare_xml_file(): replaces event IDs with names and minifies the content for prompts.
+    Args:
+        filename (str): The name of the XML file.
+        original_content (str): Its content, as read by copy_and_read_xml_file().
+    Returns:
+        ProcessedXMLFile: Processed file data, without extracted data
+    """
+    content_with_event_names, events_found, events_index = replace_event_ids_with_names(original_content)
+    minified_content, minification = minify_for_prompts(content_with_event_names)
+    print(f"Minified {filename}: {minification.describe()}")
+
     return ProcessedXMLFile(
         filename=filename,
         original_content=original_content,
         content_with_event_names=content_with_event_names,
         events_found=events_found,
-        extracted_data=extracted_data
+        extracted_data="",
+        events_index=events_index,
+        minified_content=minified_content,
+        minification=minification
     )
 
 
+def extracted_data_path(filename: str, directory: Optional[str]) -> Optional[str]:
+    """Where the extraction reply of a file is written, next to its copy. None if the file is not copied."""
+    if not directory:
+        return None
+    return os.path.join(directory, os.path.splitext(filename)[0] + EXTRACTED_DATA_SUFFIX)
+
+
+def process_xml_file(file_path: str, copy_to: Optional[str] = None) -> ProcessedXMLFile:
+    """
+    Processes a single XML file: copies, reads, replaces event IDs, minifies, and extracts data.
+    Args:
+        file_path (str): Path to the XML file to process
+        copy_to (Optional[str]): Directory to copy the file to
+    Returns:
+        ProcessedXMLFile: Processed file data
+    """
+    processed_file = prepare_xml_file(file_path, copy_to)
+    journal = get_file_journal(processed_file.filename)
+    recorded = journal.stage_output("extraction") if journal is not None else None
+    if recorded is not None:
+        # Extracted by an earlier attempt of this run (see src.utils.run_journal)
+        processed_file.extracted_data = recorded
+        return processed_file
+
+    stream_to = extracted_data_path(processed_file.filename, copy_to)
+    with telemetry_context(file=processed_file.filename):
+        processed_file.extracted_data = extract_data_about_report(
+            processed_file.minified_content, processed_file.events_index, stream_to)
+    if journal is not None:
+        journal.record_stage("extraction", processed_file.extracted_data)
+    
+    return processed_file
+
+
+async def extract_processed_file_async(processed_file: ProcessedXMLFile, copy_to: Optional[str] = None) -> str:
+    """
+    The extraction half of process_xml_file(), for a file prepared by prepare_xml_file(), in the event loop.
+    Reuses the extraction recorded in the run journal by an earlier attempt of the run, if any.
+    Returns:
+        str: The extracted data
+    """
+    journal = get_file_journal(processed_file.filename)
+    recorded = journal.stage_output("extraction") if journal is not None else None
+    if recorded is not None:
+        return recorded
+
+    with telemetry_context(file=processed_file.filename):
+        extracted_data = await extract_data_about_report_async(
+            processed_file.minified_content, processed_file.events_index,
+            extracted_data_path(processed_file.filename, copy_to))
+    if journal is not None:
+        journal.record_stage("extraction", extracted_data)
+    return extracted_data
+
+
+def calculate_min_unique_prefix_length(filenames: List[str]) -> int:
+    """
+    Find the minimum int n, such that taking the first n characters of each string in the list will produce a unique set of strings.
+    """
+    min_length = 5
+    while True:
+        seen = set()
+        for s in filenames:
+            if len(s) < min_length:
+                return min_length
+            prefix = s[:min_length]
+            if prefix in seen:
+                break
+            seen.add(prefix)
+        else:
+            return min_length
+        min_length += 1
+
+
+def subdir_names_for(filenames: List[str]) -> Dict[str, str]:
+    """Filename -> the name of its output subdirectory: the shortest prefix that tells the files apart."""
+    min_prefix_length = calculate_min_unique_prefix_length(filenames)
+    return {filename: filename[:min(min_prefix_length, len(filename))] for filename in filenames}
+
+
+def assign_subdir_names(processed_files: List[ProcessedXMLFile]) -> None:
+    """Names each file's output subdirectory after the shortest prefix that tells the files apart."""
+    subdir_names = subdir_names_for([processed_file.filename for processed_file in processed_files])
+    for processed_file in processed_files:
+        processed_file.subdir_name = subdir_names[processed_file.filename]
+
+
 def read_xml_as_string(copy_to: Optional[str]) -> Tuple[str, str, str]:
     """
     Copies an XML file from a user-selected location and reads its content.
     Returns:
-        Tuple[str, str, str]: (filename, content_with_event_names, extracted_data)
+        Tuple[str, str, str]: (filename, minified content_with_event_names, extracted_data)
     """
     file_path = select_xml_file()
     
@@ -186,7 +435,7 @@ def read_xml_as_string(copy_to: Optional[str]) -> Tuple[str, str, str]:
         raise FileNotFoundError("No file was selected.")
 
     processed_file = process_xml_file(file_path, copy_to)
-    return processed_file.filename, processed_file.content_with_event_names, processed_file.extracted_data
+    return processed_file.filename, processed_file.minified_content, processed_file.extracted_data
 
 
 def save_schema_as_json(report_to_save: dict, report_name: str, subdir_name: str, directory: str) -> None:
@@ -210,4 +459,24 @@ def save_schema_as_json(report_to_save: dict, report_name: str, subdir_name: str
         json.dump(report_to_save, file, indent=2)
     print(f"Saved {report_name} to {directory}")
 
+
+def save_generated_reports(processed_file: ProcessedXMLFile, generated_reports: Dict[str, List[dict]], directory: str) -> None:
+    """
+    Saves every generated report of a file as <filename>_as_<report type>_<n>.json in the file's subdirectory.
+    Args:
+        processed_file (ProcessedXMLFile): The file the reports were generated from.
+        generated_reports (Dict[str, List[dict]]): Report type -> the generated reports of that type.
+        directory (str): The artifacts directory.
+    """
+    for report_type, reports in generated_reports.items():
+        print(f"{report_type}: {len(reports)} reports generated")
+        for i, report_dict in enumerate(reports):
+            report_name = f"{processed_file.filename}_as_{report_type}_{i + 1}"
+            save_schema_as_json(
+                report_to_save=report_dict,
+                report_name=report_name,
+                subdir_name=processed_file.subdir_name,
+                directory=directory
+            )
+
 # fin.
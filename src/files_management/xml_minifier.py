@@ -0,0 +1,180 @@
+"""
+Minifies XML report templates before they are put into prompts.
+
+The template is sent to the model in every prompt of the pipeline, so every indentation run, comment and
+boilerplate attribute is paid for several times per file. minify_xml() produces a compact form with the same
+content: it drops the XML declaration, comments and whitespace-only text between tags, collapses the whitespace
+inside tags and text, and removes stray byte-order marks / NUL characters left over from UTF-16 exports.
+Attribute values and CDATA sections are kept as they are.
+
+Known-irrelevant attributes can be stripped as well. Each entry is either an attribute name, stripped wherever
+it appears, or "name=value", stripped only where the attribute has that (default) value.
+
+Configuration (environment / .env):
+    XML_MINIFY                      "0" to put the templates into prompts as they are (default "1")
+    XML_MINIFY_STRIP_ATTRIBUTES     Comma-separated attributes to strip, e.g. "Description,Operator=Equals"
+
+Report the savings for some files from the project root:
+    python -m src.files_management.xml_minifier <file.xml> [...] [--strip Description Operator=Equals]
+"""
+import argparse
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.utils.rate_limiter import estimate_tokens
+
+# One alternative per kind of XML token, so a single pass can tell tags from text, comments and CDATA.
+# Tags are matched quote-aware, so a '>' inside an attribute value does not end the tag.
+XML_TOKEN_PATTERN = re.compile(
+    r"(?P<comment><!--.*?-->)"
+    r"|(?P<cdata><!\[CDATA\[.*?\]\]>)"
+    r"|(?P<declaration><\?xml\b.*?\?>)"
+    r"|(?P<tag><(?:[^\"'>]|\"[^\"]*\"|'[^']*')*>)"
+    r"|(?P<text>[^<]+)",
+    re.DOTALL,
+)
+QUOTED_OR_WHITESPACE_PATTERN = re.compile(r"(\"[^\"]*\"|'[^']*')|\s+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+ARTEFACT_CHARACTERS = str.maketrans("", "", "\ufeff\x00\u200b")  # BOMs, NULs and zero-width spaces
+
+
+@dataclass
+class MinificationStats:
+    """Data class to hold how much a template shrank."""
+    original_chars: int
+    minified_chars: int
+    original_tokens: int  # Estimated
+    minified_tokens: int  # Estimated
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.minified_tokens
+
+    @property
+    def saved_ratio(self) -> float:
+        return self.saved_tokens / self.original_tokens if self.original_tokens else 0.0
+
+    def describe(self) -> str:
+        return (f"{self.original_tokens:,} -> {self.minified_tokens:,} estimated tokens "
+                f"({self.saved_ratio:.0%} saved per prompt)")
+
+
+def parse_attribute_rules(rules: Iterable[str]) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Turns entries like "Description" or "Operator=Equals" into (name, value-or-None) pairs."""
+    parsed = []
+    for rule in rules:
+        rule = rule.strip()
+        if not rule:
+            continue
+        name, _, value = rule.partition("=")
+        parsed.append((name.strip(), value if "=" in rule else None))
+    return tuple(parsed)
+
+
+def _attribute_pattern(rules: Tuple[Tuple[str, Optional[str]], ...]) -> Optional[re.Pattern]:
+    if not rules:
+        return None
+    alternatives = []
+    for name, value in rules:
+        value_pattern = re.escape(value) if value is not None else r"[^\"]*"
+        alternatives.append(rf"{re.escape(name)}\s*=\s*\"{value_pattern}\"")
+        value_pattern = re.escape(value) if value is not None else r"[^']*"
+        alternatives.append(rf"{re.escape(name)}\s*=\s*'{value_pattern}'")
+    return re.compile(r"\s+(?:" + "|".join(alternatives) + r")(?=[\s/>])")
+
+
+def _minify_tag(tag: str, attribute_pattern: Optional[re.Pattern]) -> str:
+    if attribute_pattern is not None:
+        tag = attribute_pattern.sub("", tag)
+    tag = QUOTED_OR_WHITESPACE_PATTERN.sub(lambda match: match.group(1) or " ", tag)
+    # "<a x="1" />" -> "<a x="1"/>", "<a >" -> "<a>"
+    if tag.endswith(" />"):
+        tag = tag[:-3] + "/>"
+    elif tag.endswith(" >"):
+        tag = tag[:-2] + ">"
+    return tag
+
+
+def minify_xml(xml_content: str, strip_attributes: Iterable[str] = ()) -> str:
+    """
+    Returns a compact form of an XML template, for use in prompts.
+    Args:
+        xml_content (str): The XML content.
+        strip_attributes (Iterable[str]): Attributes to remove, as "name" or "name=value" entries.
+    Returns:
+        str: The minified XML content.
+    """
+    attribute_pattern = _attribute_pattern(parse_attribute_rules(strip_attributes))
+
+    def minify_token(match: re.Match) -> str:
+        kind = match.lastgroup
+        token = match.group()
+        if kind in ("comment", "declaration"):
+            return ""
+        if kind == "cdata":
+            return token
+        if kind == "tag":
+            return _minify_tag(token, attribute_pattern)
+        # Text: whitespace between tags is formatting only, other whitespace runs mean a single space
+        if token.isspace():
+            return ""
+        return WHITESPACE_PATTERN.sub(" ", token)
+
+    content = xml_content.translate(ARTEFACT_CHARACTERS)
+    return XML_TOKEN_PATTERN.sub(minify_token, content).strip()
+
+
+def measure_minification(original: str, minified: str) -> MinificationStats:
+    return MinificationStats(
+        original_chars=len(original),
+        minified_chars=len(minified),
+        original_tokens=estimate_tokens(original),
+        minified_tokens=estimate_tokens(minified),
+    )
+
+
+def load_minification_settings() -> Tuple[bool, Tuple[str, ...]]:
+    """
+    Returns:
+        Tuple[bool, Tuple[str, ...]]: (whether to minify, attributes to strip)
+    """
+    load_dotenv()
+    enabled = os.getenv("XML_MINIFY", "1").strip() != "0"
+    strip_attributes = tuple(
+        rule.strip() for rule in os.getenv("XML_MINIFY_STRIP_ATTRIBUTES", "").split(",") if rule.strip())
+    return enabled, strip_attributes
+
+
+def minify_for_prompts(xml_content: str) -> Tuple[str, MinificationStats]:
+    """
+    Minifies an XML template according to the environment's settings.
+    Returns:
+        Tuple[str, MinificationStats]: (the content to put into prompts, the savings)
+    """
+    enabled, strip_attributes = load_minification_settings()
+    minified = minify_xml(xml_content, strip_attributes) if enabled else xml_content
+    return minified, measure_minification(xml_content, minified)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how much minification saves on XML templates.")
+    parser.add_argument("paths", nargs="+", help="XML template files (UTF-16, like the Quest exports).")
+    parser.add_argument("--strip", nargs="*", default=[], help='Attributes to strip, as "name" or "name=value".')
+    parser.add_argument("--encoding", default="utf-16")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        with open(path, "r", encoding=args.encoding) as file:
+            content = file.read()
+        stats = measure_minification(content, minify_xml(content, args.strip))
+        print(f"{os.path.basename(path)}: {stats.describe()}")
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
@@ -0,0 +1,231 @@
+"""
+Compiles the knowledge CSVs that are read at run time into a single versioned, content-hashed binary pack,
+and loads it once per process (and knowledge directory) as a KnowledgeBase.
+
+Only the event ID -> name mapping is packed. The other CSVs of the knowledge directory (filters, display fields,
+report properties) are reference material: the prompts describe the report properties with the texts of
+src.utils.utils, which these CSVs do not reproduce word for word.
+
+Pack layout:
+    MAGIC (8 bytes) | format version (uint32, little endian) | pack hash (32 bytes, sha256) | pickled payload
+
+The pack hash covers the format version and the bytes of every source CSV, so it changes whenever the
+knowledge changes and can be used as a cache-invalidation key.
+
+Compile manually from the project root:
+    python -m src.knowledge.knowledge_pack [--strict]
+"""
+import argparse
+import csv
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import struct
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+KNOWLEDGE_DIR = "knowledge"
+PACK_FILENAME = "knowledge.pack"
+PACK_MAGIC = b"QRTKPACK"
+PACK_FORMAT_VERSION = 2
+_HEADER = struct.Struct("<8sI32s")
+
+# Source CSVs that make up the pack, by their key in the payload.
+KNOWLEDGE_SOURCES: Dict[str, str] = {
+    "events": "events_ids_names_mapping.csv",
+}
+
+
+class KnowledgePackError(Exception):
+    """Raised when the knowledge pack cannot be compiled or loaded."""
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+@dataclass
+class KnowledgeBase:
+    """The compiled knowledge, as loaded from the pack."""
+    pack_hash: str
+    event_names_by_id: Dict[str, str]
+    source_hashes: Dict[str, str] = field(default_factory=dict)  # Source filename -> sha256
+    duplicates: Dict[str, str] = field(default_factory=dict)  # Duplicate filename -> the source it duplicates
+
+
+def _sha256_file(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def _read_csv_rows(path: str) -> List[Dict[str, str]]:
+    # utf-8-sig drops the BOM the CSVs are saved with
+    with open(path, "r", encoding="utf-8-sig", newline="") as file:
+        return [dict(row) for row in csv.DictReader(file)]
+
+
+def compute_sources_hash(knowledge_dir: str = KNOWLEDGE_DIR) -> str:
+    """
+    Computes the pack hash of the current source CSVs, without compiling them.
+    Returns:
+        str: sha256 hex digest over the pack format version and the sources' content.
+    """
+    digest = hashlib.sha256(f"v{PACK_FORMAT_VERSION}".encode())
+    for key in sorted(KNOWLEDGE_SOURCES):
+        path = os.path.join(knowledge_dir, KNOWLEDGE_SOURCES[key])
+        if not os.path.exists(path):
+            raise KnowledgePackError(f"Knowledge source {path} does not exist.")
+        digest.update(key.encode())
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+def find_duplicate_sources(knowledge_dir: str = KNOWLEDGE_DIR) -> Dict[str, str]:
+    """
+    Finds CSV files in the knowledge directory that are byte-for-byte copies of a pack source,
+    or stray variants of a source (e.g. 'events_ids_names_mapping-<machine>.csv').
+    Returns:
+        Dict[str, str]: Duplicate filename -> the source filename it duplicates.
+    """
+    source_filenames = set(KNOWLEDGE_SOURCES.values())
+    source_hash_to_name = {
+        _sha256_file(os.path.join(knowledge_dir, name)): name
+        for name in source_filenames
+        if os.path.exists(os.path.join(knowledge_dir, name))
+    }
+
+    duplicates: Dict[str, str] = {}
+    for name in sorted(os.listdir(knowledge_dir)):
+        if not name.lower().endswith(".csv") or name in source_filenames:
+            continue
+        content_hash = _sha256_file(os.path.join(knowledge_dir, name))
+        if content_hash in source_hash_to_name:
+            duplicates[name] = source_hash_to_name[content_hash]
+            continue
+        for source_name in source_filenames:
+            if name.startswith(os.path.splitext(source_name)[0]):
+                duplicates[name] = source_name
+                break
+    return duplicates
+
+
+def compile_knowledge_pack(
+    knowledge_dir: str = KNOWLEDGE_DIR,
+    pack_path: Optional[str] = None,
+    strict: bool = False,
+) -> str:
+    """
+    Compiles the knowledge CSVs into a binary pack.
+    Args:
+        knowledge_dir (str): Directory holding the source CSVs.
+        pack_path (Optional[str]): Where to write the pack. Defaults to <knowledge_dir>/knowledge.pack.
+        strict (bool): If True, refuse to compile when duplicate sources are found.
+    Returns:
+        str: The pack hash.
+    Raises:
+        KnowledgePackError: If a source is missing, or duplicates are found in strict mode.
+    """
+    pack_path = pack_path or os.path.join(knowledge_dir, PACK_FILENAME)
+
+    duplicates = find_duplicate_sources(knowledge_dir)
+    for duplicate, source in duplicates.items():
+        print(f"WARNING: {os.path.join(knowledge_dir, duplicate)} duplicates {source} and is not part of the knowledge pack.")
+    if duplicates and strict:
+        raise KnowledgePackError(f"Duplicate knowledge sources found: {', '.join(sorted(duplicates))}")
+
+    pack_hash = compute_sources_hash(knowledge_dir)
+    rows = {key: _read_csv_rows(os.path.join(knowledge_dir, filename)) for key, filename in KNOWLEDGE_SOURCES.items()}
+    payload = {
+        "event_names_by_id": {row["EventClassIDs"]: row["EventClassNames"] for row in rows["events"]},
+        "source_hashes": {
+            filename: _sha256_file(os.path.join(knowledge_dir, filename)) for filename in KNOWLEDGE_SOURCES.values()
+        },
+        "duplicates": duplicates,
+    }
+
+    buffer = io.BytesIO()
+    buffer.write(_HEADER.pack(PACK_MAGIC, PACK_FORMAT_VERSION, bytes.fromhex(pack_hash)))
+    pickle.dump(payload, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Write to a temporary file first so concurrent readers never see a half-written pack
+    temporary_path = f"{pack_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(buffer.getvalue())
+    os.replace(temporary_path, pack_path)
+    return pack_hash
+
+
+def read_pack_hash(pack_path: str) -> Optional[str]:
+    """
+    Reads the pack hash from a pack's header.
+    Returns:
+        Optional[str]: The pack hash, or None if the file is missing or not a pack of the current format version.
+    """
+    if not os.path.exists(pack_path):
+        return None
+    with open(pack_path, "rb") as file:
+        header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    magic, version, pack_hash = _HEADER.unpack(header)
+    if magic != PACK_MAGIC or version != PACK_FORMAT_VERSION:
+        return None
+    return pack_hash.hex()
+
+
+def load_knowledge_pack(pack_path: str) -> KnowledgeBase:
+    """
+    Loads a compiled pack through a read-only memory map.
+    Raises:
+        KnowledgePackError: If the file is not a valid pack of the current format version.
+    """
+    pack_hash = read_pack_hash(pack_path)
+    if pack_hash is None:
+        raise KnowledgePackError(f"{pack_path} is not a version {PACK_FORMAT_VERSION} knowledge pack.")
+
+    with open(pack_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            payload = pickle.loads(mapped[_HEADER.size:])
+
+    return KnowledgeBase(pack_hash=pack_hash, **payload)
+
+
+_knowledge_bases: Dict[str, KnowledgeBase] = {}  # Absolute knowledge directory -> its loaded pack
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base(knowledge_dir: str = KNOWLEDGE_DIR) -> KnowledgeBase:
+    """
+    Returns the process-wide KnowledgeBase of a knowledge directory, compiling the pack first if it is missing or
+    stale. Worker processes that are forked inherit the loaded instances; spawned ones load the shared pack file.
+    """
+    key = os.path.abspath(knowledge_dir)
+    knowledge_base = _knowledge_bases.get(key)
+    if knowledge_base is not None:
+        return knowledge_base
+
+    with _knowledge_base_lock:
+        if key not in _knowledge_bases:
+            pack_path = os.path.join(knowledge_dir, PACK_FILENAME)
+            if read_pack_hash(pack_path) != compute_sources_hash(knowledge_dir):
+                compile_knowledge_pack(knowledge_dir, pack_path)
+            _knowledge_bases[key] = load_knowledge_pack(pack_path)
+        return _knowledge_bases[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the knowledge CSVs into a binary knowledge pack.")
+    parser.add_argument("--knowledge-dir", default=KNOWLEDGE_DIR)
+    parser.add_argument("--strict", action="store_true", help="Fail if duplicate knowledge sources are found.")
+    args = parser.parse_args()
+
+    pack_hash = compile_knowledge_pack(args.knowledge_dir, strict=args.strict)
+    print(f"Compiled {os.path.join(args.knowledge_dir, PACK_FILENAME)} ({pack_hash})")
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
@@ -0,0 +1,155 @@
+"""
+Pre-processes XML files in the background while the operator is still selecting them.
+
+Selecting files in main.py goes one dialog at a time, and then the list is confirmed. Instead of waiting for that,
+each file is read, has its event IDs substituted and is sent to extraction the moment it is added, by a
+BackgroundPreprocessor running its own event loop in a daemon thread. Removing a file from the selection cancels
+its work, waits until it has stopped writing, and deletes what it wrote. Once the selection is confirmed, the
+staged pipeline runs on the same event loop and picks up each file's background task where it is (see
+src.pipeline.staged_pipeline), so by then most of the extraction latency has already been paid.
+
+Configuration (environment / .env):
+    PREPROCESS_WHILE_SELECTING      "1" (default) to pre-process files as they are selected, "0" to wait
+    PREPROCESS_CONCURRENCY          Files pre-processed at once (default 4)
+"""
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Coroutine, Dict, List, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from src.files_management.files_handler import (
+    ProcessedXMLFile,
+    copy_and_read_xml_file,
+    extract_processed_file_async,
+    extracted_data_path,
+    substitute_and_minify,
+)
+from src.pipeline.file_conversion import FileResult
+from src.pipeline.staged_pipeline import PipelineSettings, run_staged_pipeline_async
+from src.utils.run_journal import get_run_journal
+
+T = TypeVar("T")
+
+
+class BackgroundPreprocessor:
+    """Reads, substitutes and extracts files on a background event loop as they are added. Thread-safe."""
+    def __init__(self, artifacts_dir: str, concurrency: int = 4):
+        self.artifacts_dir = artifacts_dir
+        self.concurrency = concurrency
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="preprocessing", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.Semaphore(concurrency)  # Bound to the background loop on first use
+        self._tasks: Dict[str, "asyncio.Task"] = {}  # File path -> its pre-processing, a task of the background loop
+        self._lock = threading.Lock()
+
+    def _call(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Runs a coroutine on the background loop and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    @staticmethod
+    async def _in_thread(function: Callable[..., T], *args) -> T:
+        """
+        Like asyncio.to_thread(), except that a cancelled caller still waits for the thread, so that nothing the
+        thread writes can appear after the task is done.
+        """
+        future = asyncio.ensure_future(asyncio.to_thread(function, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.gather(future, return_exceptions=True)
+            raise
+
+    async def _preprocess(self, file_path: str) -> ProcessedXMLFile:
+        async with self._semaphore:
+            filename, original_content = await self._in_thread(copy_and_read_xml_file, file_path, self.artifacts_dir)
+            processed_file = await self._in_thread(substitute_and_minify, filename, original_content)
+            processed_file.extracted_data = await extract_processed_file_async(processed_file, self.artifacts_dir)
+            return processed_file
+
+    async def _start(self, file_path: str) -> "asyncio.Task":
+        return asyncio.ensure_future(self._preprocess(file_path))
+
+    @staticmethod
+    async def _cancel(tasks: List["asyncio.Task"]) -> None:
+        """Cancels the tasks and waits until they have finished unwinding."""
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, file_path: str) -> None:
+        """
+        Starts pre-processing a file, unless it is already being pre-processed.
+        Raises:
+            ValueError: If another file of the same name is being pre-processed, since what the two write (and what
+                remove() deletes) is named after the file name.
+        """
+        filename = os.path.basename(file_path)
+        with self._lock:
+            if file_path in self._tasks:
+                return
+            for other_path in self._tasks:
+                if os.path.basename(other_path) == filename:
+                    raise ValueError(f"{other_path} is already pre-processed under the name {filename}; "
+                                     "file names must be unique in a run")
+            self._tasks[file_path] = self._call(self._start(file_path))
+
+    def remove(self, file_path: str) -> None:
+        """Cancels the pre-processing of a file and deletes its copy, its extracted data and its journal entries."""
+        with self._lock:
+            task = self._tasks.pop(file_path, None)
+        if task is None:
+            return
+        # Cancelled or failed, nothing of it is kept: wait until it stopped writing, then delete what it wrote
+        self._call(self._cancel([task]))
+        filename = os.path.basename(file_path)
+        for path in (os.path.join(self.artifacts_dir, filename), extracted_data_path(filename, self.artifacts_dir)):
+            if os.path.exists(path):
+                os.remove(path)
+        journal = get_run_journal()
+        if journal is not None:
+            journal.forget(filename)
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            tasks = list(self._tasks.values())
+        done = sum(1 for task in tasks if task.done())
+        return {"files": len(tasks), "done": done, "running": len(tasks) - done}
+
+    def run_pipeline(
+        self,
+        file_paths: List[str],
+        likelihood_policy: str = "interactive",
+        settings: Optional[PipelineSettings] = None,
+        on_result: Optional[Callable[[FileResult], None]] = None,
+    ) -> List[FileResult]:
+        """
+        Converts the selected files through the staged pipeline, on the background loop, reusing each file's
+        pre-processing. Files that were never added are pre-processed by the pipeline itself.
+        """
+        async def run() -> List[FileResult]:
+            with self._lock:
+                tasks = {file_path: task for file_path, task in self._tasks.items() if file_path in file_paths}
+            return await run_staged_pipeline_async(file_paths, self.artifacts_dir, settings, likelihood_policy,
+                                                   on_result, preprocessed=tasks)
+        return self._call(run())
+
+    def close(self) -> None:
+        """Cancels whatever is still running and stops the background loop."""
+        with self._lock:
+            tasks, self._tasks = list(self._tasks.values()), {}
+        self._call(self._cancel(tasks))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+
+def load_preprocessing_settings() -> Optional[int]:
+    """The concurrency of background pre-processing, or None when PREPROCESS_WHILE_SELECTING is off."""
+    load_dotenv()
+    if os.getenv("PREPROCESS_WHILE_SELECTING", "1").strip() != "1":
+        return None
+    return max(1, int(os.getenv("PREPROCESS_CONCURRENCY", 4)))
+
+# fin.
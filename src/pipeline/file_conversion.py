@@ -0,0 +1,108 @@
+"""
+Converts one XML report template, end to end: pre-processing and extraction, the likelihood of each report type,
+generation of the report variants, and saving them.
+
+This is the unit of work of the headless runs (see cli.py and src.pipeline.worker_pool). A file is converted independently of the others: its
+output subdirectory is named up front from the names of all the files of the run (see plan_subdir_names), so the
+naming does not depend on the order in which files finish, and a file that fails is recorded in its FileResult
+instead of raising, so it never stops the rest of the run. When the run is journaled (see src.utils.run_journal),
+a file resumes after its last recorded stage.
+"""
+import os
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from src.files_management.files_handler import process_xml_file, save_generated_reports, subdir_names_for
+from src.utils.likely_report_types import get_likely_report_types
+from src.utils.report_template_envocation import generate_reports_from_likely_report_types
+from src.utils.run_journal import get_file_journal, journal_file
+from src.utils.telemetry import telemetry_context
+
+
+@dataclass
+class FileResult:
+    """Data class to hold the outcome of converting one file."""
+    file_path: str
+    filename: str
+    subdir_name: str = ""
+    likelihoods: Optional[Dict[str, str]] = None
+    reports_saved: int = 0
+    error: Optional[str] = None  # "<stage>: <exception>" if the conversion failed
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def plan_subdir_names(file_paths: List[str]) -> Dict[str, str]:
+    """
+    File path -> the output subdirectory of its reports, as main.py names them.
+    Raises:
+        ValueError: If two of the files have the same name, since their copies and reports would overwrite each other.
+    """
+    filenames = [os.path.basename(file_path) for file_path in file_paths]
+    duplicates = sorted({filename for filename in filenames if filenames.count(filename) > 1})
+    if duplicates:
+        raise ValueError(f"Several input files are named {', '.join(duplicates)}; file names must be unique in a run")
+    subdir_names = subdir_names_for(filenames)
+    return {file_path: subdir_names[filename] for file_path, filename in zip(file_paths, filenames)}
+
+
+def convert_file(file_path: str, artifacts_dir: str, subdir_name: str, likelihood_policy: str = "auto") -> FileResult:
+    """
+    Converts one XML template and saves its reports in artifacts_dir/subdir_name.
+    Args:
+        file_path (str): The XML template.
+        artifacts_dir (str): Where the copy of the file, its extracted data and its reports are written.
+        subdir_name (str): The subdirectory of its reports, see plan_subdir_names.
+        likelihood_policy (str): How the likelihoods are confirmed, see get_likely_report_types.
+    Returns:
+        FileResult: What was saved, or where the conversion failed. Exceptions are not raised.
+    """
+    started_at = time.perf_counter()
+    result = FileResult(file_path=file_path, filename=os.path.basename(file_path), subdir_name=subdir_name)
+    journal = get_file_journal(result.filename)
+    written = journal.stage_output("write") if journal is not None else None
+    if written is not None:
+        # Converted by an earlier attempt of the run
+        result.likelihoods = journal.stage_output("likelihood")
+        result.reports_saved = written["reports_saved"]
+        return result
+
+    stage = "pre-processing"
+    try:
+        processed_file = process_xml_file(file_path, artifacts_dir)
+        processed_file.subdir_name = subdir_name
+        with telemetry_context(file=processed_file.filename), journal_file(processed_file.filename):
+            stage = "likelihood"
+            result.likelihoods = journal.stage_output("likelihood") if journal is not None else None
+            if result.likelihoods is None:
+                result.likelihoods = get_likely_report_types(
+                    quest_report_str=processed_file.minified_content,
+                    extracted_data=processed_file.extracted_data,
+                    policy=likelihood_policy,
+                    events_found=processed_file.events_found,
+                )
+                if journal is not None:
+                    journal.record_stage("likelihood", result.likelihoods)
+            stage = "generation"
+            generated_reports = generate_reports_from_likely_report_types(
+                report_type_to_likelihood=result.likelihoods,
+                quest_report_str=processed_file.minified_content,
+                extracted_data=processed_file.extracted_data,
+            )
+        stage = "save"
+        save_generated_reports(processed_file, generated_reports, artifacts_dir)
+        result.reports_saved = sum(len(reports) for reports in generated_reports.values())
+        if journal is not None:
+            journal.record_stage("write", {"reports_saved": result.reports_saved})
+    except Exception as error:
+        result.error = f"{stage}: {type(error).__name__}: {error}"
+        traceback.print_exc()
+    result.seconds = time.perf_counter() - started_at
+    return result
+
+# fin.
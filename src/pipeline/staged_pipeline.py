@@ -0,0 +1,311 @@
+"""
+A staged, streaming pipeline that converts many XML templates in one process, with the stages overlapping.
+
+Each file flows through the stages on its own, as soon as its previous stage is done:
+
+    read → substitution → extraction → likelihood → generation → post_process → write
+
+Bounded asyncio queues connect the stages. When a stage falls behind, the queue in front of it fills up and the
+stages upstream wait (backpressure), so only about (queue size + concurrency) files per stage are held in memory,
+however many files the run has. The first reports are written while later files are still being extracted.
+
+The LLM stages (extraction, likelihood, generation) run as coroutines; reading, event substitution,
+post-processing and writing run in threads, so they do not hold up the event loop. A file that fails at any stage
+is recorded in its FileResult and skips the remaining stages, while the other files go on.
+
+With the interactive likelihood policy, the variants of the model's conclusions start generating as soon as they
+are known, while the operator is still answering (see SpeculativeReports); the generation stage then only waits
+for what is left. REPORT_SPECULATION=0 turns this off.
+
+Files that were already read, substituted and sent to extraction in the background while the operator was still
+selecting them (see src.pipeline.background_preprocessing) skip those stages: the extraction stage only waits for
+their background task.
+
+When the run is journaled (see src.utils.run_journal), each stage records its output as the file leaves it, and
+a resumed run takes up each file after its last recorded stage: written files go straight to the end, and recorded
+extractions, likelihoods and variants are reused.
+
+Every few seconds a progress line shows, for each stage, the files waiting in its queue and the files it is
+working on, e.g. "extraction 5+8". It is held back while the operator is answering a question of the interactive
+likelihood policy, so it does not end up in the middle of the question.
+
+Configuration (environment / .env):
+    PIPELINE_CONCURRENCY_<STAGE>    Files a stage works on at once (defaults: read 4, substitution 2,
+                                    extraction 8, likelihood 8, generation 4, post_process 2, write 2)
+    PIPELINE_QUEUE_SIZE             Files that can wait in front of each stage (default 8)
+    PIPELINE_PROGRESS_INTERVAL      Seconds between progress lines, 0 for none (default 5)
+The LLM calls themselves stay bounded by the rate limiter (LLM_MAX_CONCURRENCY, see src.utils.rate_limiter).
+"""
+import asyncio
+import os
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from src.files_management.files_handler import (
+    ProcessedXMLFile,
+    copy_and_read_xml_file,
+    extract_processed_file_async,
+    save_generated_reports,
+    substitute_and_minify,
+)
+from src.pipeline.file_conversion import FileResult, plan_subdir_names
+from src.utils.likely_report_types import get_likely_report_types_async, is_operator_prompt_open
+from src.utils.report_template_envocation import (
+    SpeculativeReports,
+    generate_reports_from_likely_report_types_async,
+    load_speculation_enabled,
+    post_process_report,
+)
+from src.utils.run_journal import get_file_journal, journal_file
+from src.utils.telemetry import telemetry_context
+
+STAGES = ("read", "substitution", "extraction", "likelihood", "generation", "post_process", "write")
+DEFAULT_STAGE_CONCURRENCY = {
+    "read": 4,
+    "substitution": 2,
+    "extraction": 8,
+    "likelihood": 8,
+    "generation": 4,
+    "post_process": 2,
+    "write": 2,
+}
+
+
+@dataclass
+class PipelineSettings:
+    """Data class to hold the concurrency of each stage and the size of the queues between them."""
+    concurrency: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_STAGE_CONCURRENCY))
+    queue_size: int = 8
+    progress_interval: float = 5.0  # Seconds, 0 for no progress lines
+
+
+@dataclass
+class _FileJob:
+    """Data class to hold a file on its way through the stages."""
+    result: FileResult
+    original_content: str = ""
+    processed_file: Optional[ProcessedXMLFile] = None
+    generated_reports: Optional[Dict[str, List[dict]]] = None
+    speculation: Optional[SpeculativeReports] = None  # Variants started while the operator confirmed the likelihoods
+    started_at: Optional[float] = None  # When the file entered the first stage
+
+
+class StageProgress:
+    """How many files wait in front of each stage, are in it, and have left it."""
+    def __init__(self, queues: Dict[str, "asyncio.Queue"]):
+        self.queues = queues
+        self.active = {stage: 0 for stage in STAGES}
+        self.finished = 0
+        self.failed = 0
+
+    def describe(self, total: int) -> str:
+        stages = " | ".join(f"{stage} {self.queues[stage].qsize()}+{self.active[stage]}" for stage in STAGES)
+        return f"[{self.finished}/{total} files, {self.failed} failed] {stages}"
+
+
+def load_pipeline_settings() -> PipelineSettings:
+    load_dotenv()
+    return PipelineSettings(
+        concurrency={
+            stage: max(1, int(os.getenv(f"PIPELINE_CONCURRENCY_{stage.upper()}", default)))
+            for stage, default in DEFAULT_STAGE_CONCURRENCY.items()
+        },
+        queue_size=max(1, int(os.getenv("PIPELINE_QUEUE_SIZE", PipelineSettings.queue_size))),
+        progress_interval=float(os.getenv("PIPELINE_PROGRESS_INTERVAL", PipelineSettings.progress_interval)),
+    )
+
+
+def _stage_functions(
+    artifacts_dir: str, likelihood_policy: str, preprocessed: Dict[str, "asyncio.Future"]
+) -> Dict[str, Callable[[_FileJob], Awaitable[Any]]]:
+    speculate = likelihood_policy == "interactive" and load_speculation_enabled()
+
+    async def read(job: _FileJob) -> None:
+        if job.result.file_path in preprocessed:
+            return
+        job.result.filename, job.original_content = await asyncio.to_thread(
+            copy_and_read_xml_file, job.result.file_path, artifacts_dir)
+
+    async def substitution(job: _FileJob) -> None:
+        if job.result.file_path in preprocessed:
+            return
+        job.processed_file = await asyncio.to_thread(substitute_and_minify, job.result.filename, job.original_content)
+        job.processed_file.subdir_name = job.result.subdir_name
+        job.original_content = ""  # Kept in processed_file from here on
+
+    async def extraction(job: _FileJob) -> None:
+        if job.result.file_path in preprocessed:
+            job.processed_file = await preprocessed[job.result.file_path]
+            job.processed_file.subdir_name = job.result.subdir_name
+            job.result.filename = job.processed_file.filename
+            return
+        job.processed_file.extracted_data = await extract_processed_file_async(job.processed_file, artifacts_dir)
+
+    async def likelihood(job: _FileJob) -> None:
+        processed_file = job.processed_file
+        journal = get_file_journal()
+        recorded = journal.stage_output("likelihood") if journal is not None else None
+        if recorded is not None:
+            job.result.likelihoods = recorded  # Confirmed by an earlier attempt of the run
+            return
+        if speculate:
+            job.speculation = SpeculativeReports(processed_file.minified_content, processed_file.extracted_data,
+                                                 post_process=False)
+        try:
+            job.result.likelihoods = await get_likely_report_types_async(
+                processed_file.minified_content, processed_file.extracted_data, likelihood_policy,
+                processed_file.events_found, on_conclusions=job.speculation.start if job.speculation else None)
+        except BaseException:
+            if job.speculation is not None:
+                job.speculation.cancel()
+            raise
+        if job.speculation is not None:
+            job.speculation.confirm(job.result.likelihoods)
+        if journal is not None:
+            journal.record_stage("likelihood", job.result.likelihoods)
+
+    async def generation(job: _FileJob) -> None:
+        if job.speculation is not None:
+            job.generated_reports = await job.speculation.results()
+            return
+        job.generated_reports = await generate_reports_from_likely_report_types_async(
+            report_type_to_likelihood=job.result.likelihoods,
+            quest_report_str=job.processed_file.minified_content,
+            extracted_data=job.processed_file.extracted_data,
+            post_process=False,
+        )
+
+    async def post_process(job: _FileJob) -> None:
+        def post_process_all() -> Dict[str, List[dict]]:
+            return {report_type: [post_process_report(report_type, report) for report in reports]
+                    for report_type, reports in job.generated_reports.items()}
+        job.generated_reports = await asyncio.to_thread(post_process_all)
+
+    async def write(job: _FileJob) -> None:
+        await asyncio.to_thread(save_generated_reports, job.processed_file, job.generated_reports, artifacts_dir)
+        job.result.reports_saved = sum(len(reports) for reports in job.generated_reports.values())
+        journal = get_file_journal()
+        if journal is not None:
+            journal.record_stage("write", {"reports_saved": job.result.reports_saved})
+
+    return {"read": read, "substitution": substitution, "extraction": extraction, "likelihood": likelihood,
+            "generation": generation, "post_process": post_process, "write": write}
+
+
+async def run_staged_pipeline_async(
+    file_paths: List[str],
+    artifacts_dir: str,
+    settings: Optional[PipelineSettings] = None,
+    likelihood_policy: str = "auto",
+    on_result: Optional[Callable[[FileResult], None]] = None,
+    preprocessed: Optional[Dict[str, "asyncio.Future"]] = None,
+) -> List[FileResult]:
+    """
+    Converts the files through the staged pipeline.
+    Args:
+        file_paths (List[str]): The XML templates. Their names must be unique, see plan_subdir_names.
+        artifacts_dir (str): Where the copies and reports are written.
+        settings (Optional[PipelineSettings]): Stage concurrency and queue sizes. Defaults to the environment's.
+        likelihood_policy (str): How the likelihoods are confirmed, see get_likely_report_types. With
+            "interactive", the likelihood stage handles one file at a time, so questions are asked one by one.
+        on_result (Optional[Callable[[FileResult], None]]): Called as each file leaves the pipeline.
+        preprocessed (Optional[Dict[str, asyncio.Future]]): File path -> a task of this event loop that reads,
+            substitutes and extracts the file, and returns its ProcessedXMLFile.
+    Returns:
+        List[FileResult]: One result per file, in the order of file_paths.
+    """
+    settings = settings or load_pipeline_settings()
+    concurrency = dict(settings.concurrency)
+    if likelihood_policy == "interactive":
+        concurrency["likelihood"] = 1
+    subdir_names = plan_subdir_names(file_paths)
+    functions = _stage_functions(artifacts_dir, likelihood_policy, preprocessed or {})
+    queues = {stage: asyncio.Queue(maxsize=settings.queue_size) for stage in STAGES}
+    done_queue: asyncio.Queue = asyncio.Queue()
+    progress = StageProgress(queues)
+    results: Dict[str, FileResult] = {}
+
+    async def worker(stage: str, next_queue: asyncio.Queue) -> None:
+        while True:
+            job = await queues[stage].get()
+            if job is None:
+                return
+            if job.started_at is None:
+                job.started_at = time.perf_counter()
+            if job.result.ok:
+                progress.active[stage] += 1
+                try:
+                    with telemetry_context(file=job.result.filename), journal_file(job.result.filename):
+                        await functions[stage](job)
+                except Exception as error:
+                    job.result.error = f"{stage}: {type(error).__name__}: {error}"
+                    traceback.print_exc()
+                finally:
+                    progress.active[stage] -= 1
+            await next_queue.put(job)
+
+    async def run_stage(index: int) -> None:
+        stage = STAGES[index]
+        is_last = index == len(STAGES) - 1
+        next_queue = done_queue if is_last else queues[STAGES[index + 1]]
+        await asyncio.gather(*(worker(stage, next_queue) for _ in range(concurrency[stage])))
+        # Every worker of this stage has stopped: tell the next stage's workers to stop once they are done
+        for _ in range(1 if is_last else concurrency[STAGES[index + 1]]):
+            await next_queue.put(None)
+
+    async def feed() -> None:
+        for file_path in file_paths:
+            result = FileResult(file_path=file_path, filename=os.path.basename(file_path),
+                                subdir_name=subdir_names[file_path])
+            journal = get_file_journal(result.filename)
+            written = journal.stage_output("write") if journal is not None else None
+            if written is not None:
+                # Converted by an earlier attempt of the run
+                result.likelihoods = journal.stage_output("likelihood")
+                result.reports_saved = written["reports_saved"]
+                await done_queue.put(_FileJob(result, started_at=time.perf_counter()))
+                continue
+            await queues[STAGES[0]].put(_FileJob(result))
+        for _ in range(concurrency[STAGES[0]]):
+            await queues[STAGES[0]].put(None)
+
+    async def collect() -> None:
+        while (job := await done_queue.get()) is not None:
+            job.result.seconds = time.perf_counter() - job.started_at
+            results[job.result.file_path] = job.result
+            progress.finished += 1
+            progress.failed += 0 if job.result.ok else 1
+            if on_result is not None:
+                on_result(job.result)
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(settings.progress_interval)
+            if not is_operator_prompt_open():
+                print(progress.describe(len(file_paths)))
+
+    reporter = asyncio.create_task(report_progress()) if settings.progress_interval > 0 else None
+    try:
+        await asyncio.gather(feed(), collect(), *(run_stage(index) for index in range(len(STAGES))))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+    print(progress.describe(len(file_paths)))
+    return [results[file_path] for file_path in file_paths]
+
+
+def run_staged_pipeline(
+    file_paths: List[str],
+    artifacts_dir: str,
+    settings: Optional[PipelineSettings] = None,
+    likelihood_policy: str = "auto",
+    on_result: Optional[Callable[[FileResult], None]] = None,
+) -> List[FileResult]:
+    """Runs run_staged_pipeline_async() in a new event loop."""
+    return asyncio.run(run_staged_pipeline_async(file_paths, artifacts_dir, settings, likelihood_policy, on_result))
+
+# fin.
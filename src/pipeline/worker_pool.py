@@ -0,0 +1,146 @@
+"""
+Converts many XML templates in parallel, one file per worker process at a time.
+
+Files are independent of each other, so each one is converted by convert_file() (see src.pipeline.file_conversion)
+in a pool of worker processes. Each worker runs its own asyncio loop and LLM clients, with its own bound on
+in-flight LLM calls, and gets an equal share of the RPM / TPM quota (LLM_QUOTA_SHARE, see src.utils.rate_limiter)
+so that together the workers stay within the deployment's quota. The per-run cap on hedged calls
+(LLM_HEDGE_MAX_PER_RUN, see src.utils.hedging) is split between the workers the same way. The response cache
+(SQLite, WAL mode) and the telemetry file (one appended line per call) are shared by all the workers.
+
+Results are handed back as files finish, in completion order, while the output of each file keeps the name
+planned for it up front. A file that fails is recorded in its FileResult and the other files go on. A worker that
+dies (e.g. killed for memory) takes down the whole pool: the files it had not finished are retried once in a new
+pool, and recorded as failed if workers die again.
+
+Workers record each file's stage outputs in the run journal of this process, if any (see src.utils.run_journal);
+SQLite's WAL mode lets them all write to it.
+
+A worker's console output is written to logs/<filename>.log in the artifacts directory instead of the console,
+where the output of many workers would interleave.
+"""
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from src.pipeline.file_conversion import FileResult, convert_file, plan_subdir_names
+from src.utils.hedging import load_hedge_settings
+from src.utils.run_journal import configure_run_journal, get_run_journal
+from src.utils.telemetry import configure_telemetry, get_telemetry_sink
+
+LOGS_DIRNAME = "logs"
+MAX_ATTEMPTS = 2  # Broken pools a file may be caught in before it counts as failed
+
+
+@dataclass
+class WorkerPoolSettings:
+    """Data class to hold how many workers convert files, and how hard each one may call the LLM."""
+    workers: int = 1
+    concurrency_per_worker: Optional[int] = None  # In-flight LLM calls per worker. None: LLM_MAX_CONCURRENCY
+
+
+def worker_environment(settings: WorkerPoolSettings) -> Dict[str, str]:
+    """The environment variables that configure a worker's LLM calls."""
+    hedge_settings = load_hedge_settings()
+    # Rounded down, so that all the workers together never hedge more than the run may
+    hedges_per_worker = hedge_settings.max_per_run // settings.workers
+    if hedge_settings.enabled and hedges_per_worker == 0 and hedge_settings.max_per_run > 0:
+        print(f"Warning: LLM_HEDGE_MAX_PER_RUN={hedge_settings.max_per_run} is less than one hedge per worker "
+              f"({settings.workers} workers), so hedging is off for this run")
+    environment = {
+        "LLM_QUOTA_SHARE": str(1.0 / settings.workers),
+        "LLM_HEDGE_MAX_PER_RUN": str(hedges_per_worker),
+    }
+    if settings.concurrency_per_worker is not None:
+        environment["LLM_MAX_CONCURRENCY"] = str(settings.concurrency_per_worker)
+    return environment
+
+
+def _init_worker(environment: Dict[str, str], telemetry_path: Optional[str], journal_path: Optional[str]) -> None:
+    os.environ.update(environment)
+    configure_telemetry(telemetry_path)
+    configure_run_journal(journal_path)
+
+
+def _convert_in_worker(file_path: str, artifacts_dir: str, subdir_name: str, likelihood_policy: str) -> FileResult:
+    logs_dir = os.path.join(artifacts_dir, LOGS_DIRNAME)
+    os.makedirs(logs_dir, exist_ok=True)
+    with open(os.path.join(logs_dir, os.path.basename(file_path) + ".log"), "w", encoding="utf-8") as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            return convert_file(file_path, artifacts_dir, subdir_name, likelihood_policy)
+
+
+def convert_files(
+    file_paths: List[str],
+    artifacts_dir: str,
+    settings: Optional[WorkerPoolSettings] = None,
+    likelihood_policy: str = "auto",
+    on_result: Optional[Callable[[FileResult], None]] = None,
+) -> List[FileResult]:
+    """
+    Converts the files, in worker processes when settings.workers > 1, otherwise one by one in this process.
+    Args:
+        file_paths (List[str]): The XML templates. Their names must be unique, see plan_subdir_names.
+        artifacts_dir (str): Where the copies, reports and worker logs are written.
+        settings (Optional[WorkerPoolSettings]): Workers and their LLM concurrency. Defaults to a single worker.
+        likelihood_policy (str): How the likelihoods are confirmed, see get_likely_report_types.
+        on_result (Optional[Callable[[FileResult], None]]): Called in this process as each file finishes.
+    Returns:
+        List[FileResult]: One result per file, in the order of file_paths.
+    """
+    settings = settings or WorkerPoolSettings()
+    subdir_names = plan_subdir_names(file_paths)
+    results: Dict[str, FileResult] = {}
+
+    def finish(result: FileResult) -> None:
+        results[result.file_path] = result
+        if on_result is not None:
+            on_result(result)
+
+    if settings.workers <= 1:
+        if settings.concurrency_per_worker is not None:
+            os.environ["LLM_MAX_CONCURRENCY"] = str(settings.concurrency_per_worker)
+        for file_path in file_paths:
+            finish(convert_file(file_path, artifacts_dir, subdir_names[file_path], likelihood_policy))
+        return [results[file_path] for file_path in file_paths]
+
+    sink = get_telemetry_sink()
+    journal = get_run_journal()
+    initargs = (worker_environment(settings), sink.path if sink is not None else None,
+                journal.path if journal is not None else None)
+    attempts = {file_path: 0 for file_path in file_paths}
+    pending = list(file_paths)
+    while pending:
+        retry = []
+        # Spawned rather than forked: workers must not inherit this process's LLM clients, locks and threads
+        with ProcessPoolExecutor(max_workers=min(settings.workers, len(pending)),
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=initargs) as executor:
+            futures: Dict[Future, str] = {}
+            for file_path in pending:
+                attempts[file_path] += 1
+                futures[executor.submit(_convert_in_worker, file_path, artifacts_dir, subdir_names[file_path],
+                                        likelihood_policy)] = file_path
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    finish(future.result())
+                except BrokenProcessPool:
+                    if attempts[file_path] < MAX_ATTEMPTS:
+                        retry.append(file_path)
+                    else:
+                        finish(FileResult(file_path=file_path, filename=os.path.basename(file_path),
+                                          subdir_name=subdir_names[file_path], error="worker: the worker process died"))
+                except Exception as error:
+                    finish(FileResult(file_path=file_path, filename=os.path.basename(file_path),
+                                      subdir_name=subdir_names[file_path], error=f"worker: {type(error).__name__}: {error}"))
+        if retry:
+            print(f"A worker process died; retrying {len(retry)} files in a new pool")
+        pending = retry
+    return [results[file_path] for file_path in file_paths]
+
+# fin.
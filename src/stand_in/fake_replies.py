@@ -0,0 +1,129 @@
+"""
+Fake chat-completions replies, for running the pipeline without Azure.
+
+Tool calls get arguments generated from the tool's JSON schema (the one Pydantic produced for ask_with_schema), so
+they validate against the schema and flow through post-processing like real replies. Plain calls get a short
+placeholder text. Replies are deterministic for a given seed, and report token usage estimated the same way the
+rate limiter estimates it.
+"""
+import json
+import random
+import time
+from typing import Any, Dict, Optional
+
+from src.utils.rate_limiter import estimate_request_tokens, estimate_tokens
+
+STAND_IN_DEPLOYMENT_NAME = "stand-in"  # Fake replies are cached under their own deployment, never under a real one
+
+FAKE_TEXT_REPLY = """# Report Overview and Extracted Data
+(A stand-in reply: no model was called.)
+The report searches the whole environment, includes the events listed in the template, and displays the object
+name, the change time and who made the change."""
+
+
+def _resolve(schema: Dict[str, Any], definitions: Dict[str, Any]) -> Dict[str, Any]:
+    while "$ref" in schema:
+        schema = definitions[schema["$ref"].split("/")[-1]]
+    return schema
+
+
+def fake_value(schema: Dict[str, Any], rng: random.Random, definitions: Dict[str, Any], name: str = "value") -> Any:
+    """Generates a value that validates against a (Pydantic-generated) JSON schema."""
+    schema = _resolve(schema, definitions)
+
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    for combinator in ("anyOf", "oneOf"):
+        if combinator in schema:
+            options = [_resolve(option, definitions) for option in schema[combinator]]
+            # Prefer a real value over null, so more of the schema is exercised
+            non_null = [option for option in options if option.get("type") != "null"]
+            return fake_value(rng.choice(non_null or options), rng, definitions, name)
+    if "allOf" in schema:
+        merged: Dict[str, Any] = {}
+        for part in schema["allOf"]:
+            merged.update(_resolve(part, definitions))
+        return fake_value(merged, rng, definitions, name)
+
+    schema_type = schema.get("type", "object" if "properties" in schema else "string")
+    if isinstance(schema_type, list):
+        schema_type = next((option for option in schema_type if option != "null"), "null")
+
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {key: fake_value(value, rng, definitions, key) for key, value in properties.items()}
+    if schema_type == "array":
+        minimum = schema.get("minItems", 1)
+        maximum = max(minimum, min(schema.get("maxItems", 2), 2))
+        items = [fake_value(schema.get("items", {}), rng, definitions, name)
+                 for _ in range(rng.randint(minimum, maximum))]
+        if schema.get("uniqueItems"):
+            unique = {json.dumps(item, sort_keys=True): item for item in items}
+            items = list(unique.values())
+        return items
+    if schema_type == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+    if schema_type == "number":
+        return round(rng.uniform(schema.get("minimum", 0.0), schema.get("maximum", 100.0)), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    if schema_type == "null":
+        return None
+    text = f"Stand-in {name}"
+    minimum = schema.get("minLength", 0)
+    return text.ljust(minimum, "x")[:schema.get("maxLength", len(text) + minimum)]
+
+
+def fake_tool_arguments(parameters: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+    return fake_value(parameters, rng, parameters.get("$defs", {}))
+
+
+def fake_chat_completion(body: Dict[str, Any], seed: Any = 0, model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Builds a chat-completions reply (as the API's JSON) to a request body.
+    With `n` in the body, returns that many choices.
+    """
+    rng = random.Random(json.dumps(seed, default=str))
+    tools = body.get("tools") or []
+    choices = []
+    for index in range(body.get("n", 1)):
+        if tools:
+            function = tools[0]["function"]
+            arguments = json.dumps(fake_tool_arguments(function.get("parameters", {}), rng))
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{rng.getrandbits(48):012x}",
+                    "type": "function",
+                    "function": {"name": function["name"], "arguments": arguments},
+                }],
+            }
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": FAKE_TEXT_REPLY}
+            finish_reason = "stop"
+        choices.append({"index": index, "message": message, "finish_reason": finish_reason})
+
+    prompt_tokens = estimate_request_tokens(body, completion_tokens=0)
+    completion_tokens = sum(
+        estimate_tokens(choice["message"]["content"] or choice["message"]["tool_calls"][0]["function"]["arguments"])
+        for choice in choices
+    )
+    return {
+        "id": f"chatcmpl-{rng.getrandbits(64):016x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or body.get("model", STAND_IN_DEPLOYMENT_NAME),
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+# fin.
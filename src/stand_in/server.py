@@ -0,0 +1,374 @@
+"""
+A local stand-in for the Azure OpenAI chat-completions endpoint, for benchmarking and load-testing the converter
+without spending quota.
+
+It implements the subset of the API the pipeline uses: chat completions with and without a forced tool call, `n`
+choices and streaming (server-sent events, with the final usage chunk when stream_options.include_usage is set).
+Tool calls are answered with fake arguments generated from the tool's JSON schema (see src.stand_in.fake_replies),
+so replies validate and flow through post-processing like real ones. Both the Azure path
+(/openai/deployments/<deployment>/chat/completions) and the plain OpenAI path (/v1/chat/completions) are served.
+
+To look like a real deployment under load it can:
+- delay each reply with a latency drawn from a distribution, plus a per-completion-token generation time;
+- reject requests with 429s (at random, or when the requests-/tokens-per-minute quota is used up), with Retry-After;
+- hang on requests without replying, so the client's timeout fires;
+- report token usage, including cached prompt tokens once a system message (>= 1024 tokens) has been seen before.
+
+Counters are served as JSON on GET /stats and printed on shutdown.
+
+Configuration (environment / .env, or the matching command-line options):
+    STAND_IN_HOST, STAND_IN_PORT        Where to listen (default 127.0.0.1:8790)
+    STAND_IN_LATENCY                    "fixed", "uniform", "normal" or "lognormal" (default lognormal)
+    STAND_IN_LATENCY_MS                 Median time to the first token, in ms (default 800)
+    STAND_IN_LATENCY_SPREAD             Spread of the distribution: the sigma of lognormal, otherwise a fraction of
+                                        the median (default 0.5)
+    STAND_IN_MS_PER_TOKEN               Generation time per completion token, in ms (default 10)
+    STAND_IN_RATE_LIMIT_RATE            Fraction of requests rejected with a 429 (default 0)
+    STAND_IN_TIMEOUT_RATE               Fraction of requests left hanging (default 0)
+    STAND_IN_HANG_SECONDS               How long a hanging request hangs before the connection is dropped (default 600)
+    STAND_IN_RETRY_AFTER                Retry-After of injected 429s, in seconds (default 1)
+    STAND_IN_RPM_LIMIT, STAND_IN_TPM_LIMIT  Simulated quota (0 = unlimited, the default)
+    STAND_IN_SEED                       Seed of the fake replies and of the injected faults (default 0)
+
+Point the client at it with LLM_STAND_IN_URL (see src.utils.azure_client_utils), e.g. in .env:
+    LLM_STAND_IN_URL=http://127.0.0.1:8790
+
+Run from the project root:
+    python -m src.stand_in.server [--port 8790] [--latency-ms 800] [--rate-limit-rate 0.05] [--timeout-rate 0.01]
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.stand_in.fake_replies import STAND_IN_DEPLOYMENT_NAME, fake_chat_completion
+from src.utils.rate_limiter import estimate_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+CHAT_COMPLETIONS_PATH = re.compile(r"^(?:/openai/deployments/(?P<deployment>[^/]+))?(?:/v1)?/chat/completions$")
+PROMPT_CACHE_MIN_TOKENS = 1024  # Like Azure OpenAI: shorter prompts are never cached
+PROMPT_CACHE_BLOCK_TOKENS = 128  # Cached prefixes grow in blocks of this many tokens
+STREAM_CHUNK_CHARS = 24
+
+
+@dataclass
+class StandInSettings:
+    """Data class to hold the behaviour of the stand-in server."""
+    host: str = "127.0.0.1"
+    port: int = 8790
+    latency: str = "lognormal"
+    latency_ms: float = 800.0
+    latency_spread: float = 0.5
+    ms_per_token: float = 10.0
+    rate_limit_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 600.0
+    retry_after: float = 1.0
+    rpm_limit: int = 0
+    tpm_limit: int = 0
+    seed: int = 0
+
+
+def load_stand_in_settings() -> StandInSettings:
+    load_dotenv()
+    settings = StandInSettings()
+    for field in fields(StandInSettings):
+        value = os.getenv(f"STAND_IN_{field.name.upper()}")
+        if value is not None and value.strip():
+            setattr(settings, field.name, type(getattr(settings, field.name))(value.strip()))
+    if settings.latency not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Invalid latency distribution: {settings.latency}. "
+                         f"Valid distributions are: {', '.join(LATENCY_DISTRIBUTIONS)}")
+    return settings
+
+
+class QuotaWindow:
+    """Requests and tokens of the last minute, to reject requests over the simulated quota."""
+    def __init__(self, rpm_limit: int, tpm_limit: int):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._lock = threading.Lock()
+        self._entries: Deque[Tuple[float, int]] = collections.deque()
+        self._tokens = 0
+
+    def try_admit(self, tokens: int) -> Optional[float]:
+        """Admits a request, or returns the seconds until it would fit into the quota."""
+        now = time.monotonic()
+        with self._lock:
+            while self._entries and self._entries[0][0] <= now - 60.0:
+                self._tokens -= self._entries.popleft()[1]
+            over_requests = self.rpm_limit and len(self._entries) >= self.rpm_limit
+            over_tokens = self.tpm_limit and self._tokens + tokens > self.tpm_limit and self._entries
+            if over_requests or over_tokens:
+                return max(0.0, self._entries[0][0] + 60.0 - now)
+            self._entries.append((now, tokens))
+            self._tokens += tokens
+            return None
+
+
+class StandInStats:
+    """Thread-safe counters of what the server did."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def add(self, **amounts: int) -> None:
+        with self._lock:
+            self.counters.update(amounts)
+
+    def enter(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: StandInSettings):
+        super().__init__((settings.host, settings.port), StandInRequestHandler)
+        self.settings = settings
+        self.stats = StandInStats()
+        self.quota = QuotaWindow(settings.rpm_limit, settings.tpm_limit)
+        self._rng = random.Random(settings.seed)
+        self._rng_lock = threading.Lock()
+        self._seen_system_prompts: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._request_counter = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_request(self) -> Tuple[int, float, float]:
+        """Returns (request number, fault roll, latency in seconds) from the server's seeded generator."""
+        with self._rng_lock:
+            self._request_counter += 1
+            return self._request_counter, self._rng.random(), self._draw_latency()
+
+    def _draw_latency(self) -> float:
+        median = self.settings.latency_ms / 1000.0
+        spread = self.settings.latency_spread
+        if self.settings.latency == "fixed":
+            return median
+        if self.settings.latency == "uniform":
+            return self._rng.uniform(median * (1 - spread), median * (1 + spread))
+        if self.settings.latency == "normal":
+            return max(0.0, self._rng.gauss(median, median * spread))
+        return self._rng.lognormvariate(0.0, spread) * median
+
+    def cached_prompt_tokens(self, body: Dict[str, Any]) -> int:
+        """Cached tokens of a request: its system message, once the same one has been seen before."""
+        system = next((message.get("content") or "" for message in body.get("messages", [])
+                       if message.get("role") == "system"), "")
+        tools = json.dumps(body.get("tools") or [], sort_keys=True)
+        prefix_tokens = estimate_tokens(system) + estimate_tokens(tools)
+        if prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        key = hashlib.sha256((system + tools).encode("utf-8")).hexdigest()
+        with self._seen_lock:
+            seen = key in self._seen_system_prompts
+            self._seen_system_prompts[key] = None
+            self._seen_system_prompts.move_to_end(key)
+            while len(self._seen_system_prompts) > 1000:
+                self._seen_system_prompts.popitem(last=False)
+        return prefix_tokens // PROMPT_CACHE_BLOCK_TOKENS * PROMPT_CACHE_BLOCK_TOKENS if seen else 0
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StandInServer
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, code: str, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"error": {"code": code, "message": message}}, headers)
+
+    def _send_rate_limited(self, retry_after: float) -> None:
+        self.server.stats.add(rate_limited=1)
+        self._send_error(429, "429", "Requests to the stand-in deployment have exceeded the rate limit.", {
+            "Retry-After": str(max(1, round(retry_after))),
+            "retry-after-ms": str(int(retry_after * 1000)),
+        })
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] == "/stats":
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_error(404, "NotFound", f"No route for GET {self.path}")
+
+    def do_POST(self) -> None:
+        match = CHAT_COMPLETIONS_PATH.match(self.path.split("?")[0])
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length)
+        if match is None:
+            self._send_error(404, "NotFound", f"No route for POST {self.path}")
+            return
+        try:
+            body = json.loads(raw_body)
+        except json.JSONDecodeError as error:
+            self._send_error(400, "BadRequest", f"Invalid JSON body: {error}")
+            return
+
+        stats = self.server.stats
+        stats.enter()
+        try:
+            self._complete(body, match.group("deployment") or body.get("model") or STAND_IN_DEPLOYMENT_NAME)
+        finally:
+            stats.leave()
+
+    def _complete(self, body: Dict[str, Any], deployment: str) -> None:
+        server, settings, stats = self.server, self.server.settings, self.server.stats
+        request_number, fault_roll, latency = server.next_request()
+        stats.add(requests=1)
+
+        if fault_roll < settings.timeout_rate:
+            stats.add(timeouts=1)
+            time.sleep(settings.hang_seconds)
+            self.close_connection = True
+            return
+        if fault_roll < settings.timeout_rate + settings.rate_limit_rate:
+            self._send_rate_limited(settings.retry_after)
+            return
+
+        seed = [settings.seed, hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()]
+        reply = fake_chat_completion(body, seed=seed, model=deployment)
+        usage = reply["usage"]
+        wait = server.quota.try_admit(usage["total_tokens"])
+        if wait is not None:
+            self._send_rate_limited(wait)
+            return
+
+        usage["prompt_tokens_details"]["cached_tokens"] = min(server.cached_prompt_tokens(body), usage["prompt_tokens"])
+        stats.add(completed=1, prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"],
+                  cached_tokens=usage["prompt_tokens_details"]["cached_tokens"])
+
+        time.sleep(latency)
+        generation_seconds = usage["completion_tokens"] * settings.ms_per_token / 1000.0
+        if body.get("stream"):
+            stats.add(streamed=1)
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            self._send_stream(reply, include_usage, generation_seconds)
+        else:
+            time.sleep(generation_seconds)
+            self._send_json(200, reply, {"x-request-id": f"stand-in-{request_number}"})
+
+    def _send_stream(self, reply: Dict[str, Any], include_usage: bool, generation_seconds: float) -> None:
+        chunks = list(stream_chunks(reply))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        delay = generation_seconds / max(len(chunks), 1)
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(delay)
+        if include_usage:
+            usage_chunk = {**_chunk_envelope(reply), "choices": [], "usage": reply["usage"]}
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def _chunk_envelope(reply: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": reply["id"], "object": "chat.completion.chunk", "created": reply["created"], "model": reply["model"]}
+
+
+def _pieces(text: str) -> Iterator[str]:
+    for start in range(0, len(text), STREAM_CHUNK_CHARS):
+        yield text[start:start + STREAM_CHUNK_CHARS]
+
+
+def stream_chunks(reply: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Splits a chat completion into the chunks a streamed reply would have been made of."""
+    envelope = _chunk_envelope(reply)
+    for choice in reply["choices"]:
+        index, message = choice["index"], choice["message"]
+        yield {**envelope, "choices": [{"index": index, "delta": {"role": "assistant", "content": ""},
+                                        "finish_reason": None}]}
+        if message.get("tool_calls"):
+            tool_call = message["tool_calls"][0]
+            yield {**envelope, "choices": [{"index": index, "finish_reason": None, "delta": {"tool_calls": [{
+                "index": 0, "id": tool_call["id"], "type": "function",
+                "function": {"name": tool_call["function"]["name"], "arguments": ""},
+            }]}}]}
+            for piece in _pieces(tool_call["function"]["arguments"]):
+                yield {**envelope, "choices": [{"index": index, "finish_reason": None, "delta": {
+                    "tool_calls": [{"index": 0, "function": {"arguments": piece}}]}}]}
+        else:
+            for piece in _pieces(message.get("content") or ""):
+                yield {**envelope, "choices": [{"index": index, "delta": {"content": piece}, "finish_reason": None}]}
+        yield {**envelope, "choices": [{"index": index, "delta": {}, "finish_reason": choice["finish_reason"]}]}
+
+
+def start_stand_in_server(settings: Optional[StandInSettings] = None) -> StandInServer:
+    """
+    Starts a stand-in server in a background thread, e.g. for a benchmark in the same process.
+    Stop it with server.shutdown().
+    """
+    server = StandInServer(settings or load_stand_in_settings())
+    threading.Thread(target=server.serve_forever, name="stand-in-server", daemon=True).start()
+    return server
+
+
+def main():
+    defaults = load_stand_in_settings()
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Azure OpenAI chat-completions API.")
+    for field in fields(StandInSettings):
+        option = "--" + field.name.replace("_", "-")
+        kwargs = {"choices": LATENCY_DISTRIBUTIONS} if field.name == "latency" else {}
+        parser.add_argument(option, type=type(getattr(defaults, field.name)), default=getattr(defaults, field.name),
+                            **kwargs)
+    args = parser.parse_args()
+
+    server = StandInServer(StandInSettings(**vars(args)))
+    print(f"Stand-in server listening on {server.url} (point the client at it with LLM_STAND_IN_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
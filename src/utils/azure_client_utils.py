@@ -1,27 +1,244 @@
+import asyncio
 import json
-from typing import Optional
+import threading
+import time
+import weakref
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import httpx
+import openai
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
 import os
 
+from src.stand_in.fake_replies import STAND_IN_DEPLOYMENT_NAME
+from src.utils.endpoint_pool import (
+    DEFAULT_ENDPOINT_NAME,
+    EndpointConfig,
+    EndpointPool,
+    PooledEndpoint,
+    get_endpoint_pool,
+)
+from src.utils.hedging import run_hedged, run_hedged_sync
+from src.utils.llm_cache import LLMCache, get_llm_cache
+from src.utils.model_tiers import StageTier, get_stage_tier
+from src.utils.rate_limiter import (
+    RETRYABLE_ERRORS,
+    STREAM_RETRYABLE_ERRORS,
+    RateLimitScheduler,
+    estimate_request_tokens,
+    get_rate_limit_scheduler,
+    load_rate_limit_settings,
+)
+from src.utils.schema_registry import get_compiled_schema, validate_reply
+from src.utils.telemetry import annotate_llm_call, on_http_request, on_http_response, record_llm_call, telemetry_context
 
-def get_client_and_deployment_name():
-    load_dotenv()
+DEFAULT_DEPLOYMENT_NAME = "gpt-4o"  # As specified in the original script
+STAND_IN_API_VERSION = "2024-10-21"  # Any version works with the stand-in server, the client just needs one
 
-    api_key = os.getenv("AZURE_API_KEY")
-    api_version = os.getenv("AZURE_API_VERSION")
-    azure_endpoint = os.getenv("AZURE_API_BASE")
-    deployment_name = "gpt-4o"  # As specified in the original script
 
-    # Initialize the Azure OpenAI client
-    client = AzureOpenAI(
-        api_key=api_key.strip(),
-        api_version=api_version.strip(),
-        azure_endpoint=azure_endpoint.strip(),
-        timeout=30.0,
+@dataclass(frozen=True)
+class AzureSettings:
+    """Data class to hold the Azure OpenAI connection settings."""
+    api_key: str
+    api_version: str
+    azure_endpoint: str
+    deployment_name: str = DEFAULT_DEPLOYMENT_NAME
+    timeout: float = 30.0
+    max_connections: int = 20  # Upper bound on open connections in the pool
+    max_keepalive_connections: int = 10  # Idle connections kept open for reuse
+    keepalive_expiry: float = 60.0  # Seconds an idle connection is kept open
+    call_timeout: float = 180.0  # Seconds before an async LLM call is cancelled, including its retries
+
+
+class ConnectionStats:
+    """Thread-safe counters showing how well HTTP connections are being reused across LLM calls."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def record(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_connections": max(self.requests - self.new_connections, 0),
+            }
+
+
+_settings: Optional[AzureSettings] = None
+_clients: Dict[str, AzureOpenAI] = {}  # Endpoint name -> client
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncAzureOpenAI]]" = weakref.WeakKeyDictionary()
+_endpoint_schedulers: Dict[str, RateLimitScheduler] = {}  # "<endpoint>/<deployment>" -> its rate limiter
+_client_lock = threading.Lock()
+_connection_stats = ConnectionStats()
+
+
+def load_azure_settings() -> AzureSettings:
+    """
+    Loads the Azure OpenAI settings from the environment (and .env) once per process.
+    Pool sizes can be tuned with AZURE_MAX_CONNECTIONS, AZURE_MAX_KEEPALIVE_CONNECTIONS and AZURE_KEEPALIVE_EXPIRY,
+    and the overall timeout of async calls with LLM_CALL_TIMEOUT. Concurrency and retries are governed by the
+    rate limiter (see src/utils/rate_limiter.py).
+    With LLM_STAND_IN_URL set, calls go to a local stand-in server instead (see src/stand_in/server.py), under the
+    "stand-in" deployment so that its fake replies are never cached as replies of the real deployment.
+    """
+    global _settings
+    if _settings is not None:
+        return _settings
+
+    with _client_lock:
+        if _settings is None:
+            load_dotenv()
+            stand_in_url = os.getenv("LLM_STAND_IN_URL", "").strip()
+            _settings = AzureSettings(
+                api_key=os.getenv("AZURE_API_KEY", "").strip() or (STAND_IN_DEPLOYMENT_NAME if stand_in_url else ""),
+                api_version=os.getenv("AZURE_API_VERSION", "").strip() or (STAND_IN_API_VERSION if stand_in_url else ""),
+                azure_endpoint=stand_in_url or os.getenv("AZURE_API_BASE", "").strip(),
+                deployment_name=STAND_IN_DEPLOYMENT_NAME if stand_in_url else DEFAULT_DEPLOYMENT_NAME,
+                timeout=float(os.getenv("AZURE_TIMEOUT", AzureSettings.timeout)),
+                max_connections=int(os.getenv("AZURE_MAX_CONNECTIONS", AzureSettings.max_connections)),
+                max_keepalive_connections=int(
+                    os.getenv("AZURE_MAX_KEEPALIVE_CONNECTIONS", AzureSettings.max_keepalive_connections)),
+                keepalive_expiry=float(os.getenv("AZURE_KEEPALIVE_EXPIRY", AzureSettings.keepalive_expiry)),
+                call_timeout=float(os.getenv("LLM_CALL_TIMEOUT", AzureSettings.call_timeout)),
+            )
+    return _settings
+
+
+def _http_limits(settings: AzureSettings) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
     )
 
-    return client, deployment_name
+
+def _trace_connection_event(event_name: str, info: dict) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        _connection_stats.record("new_connections")
+    elif event_name == "connection.start_tls.complete":
+        _connection_stats.record("tls_handshakes")
+
+
+async def _trace_connection_event_async(event_name: str, info: dict) -> None:
+    _trace_connection_event(event_name, info)
+
+
+def _on_request(request: httpx.Request) -> None:
+    _connection_stats.record("requests")
+    request.extensions["trace"] = _trace_connection_event
+    on_http_request()
+
+
+async def _on_request_async(request: httpx.Request) -> None:
+    _connection_stats.record("requests")
+    request.extensions["trace"] = _trace_connection_event_async
+    on_http_request()
+
+
+def _on_response(response: httpx.Response) -> None:
+    on_http_response()
+
+
+async def _on_response_async(response: httpx.Response) -> None:
+    on_http_response()
+
+
+def _default_endpoint_config() -> EndpointConfig:
+    settings = load_azure_settings()
+    return EndpointConfig(
+        name=DEFAULT_ENDPOINT_NAME,
+        azure_endpoint=settings.azure_endpoint,
+        api_key=settings.api_key,
+        api_version=settings.api_version,
+    )
+
+
+def get_pool() -> EndpointPool:
+    """Returns the process-wide endpoint pool (a single endpoint unless LLM_ENDPOINTS_FILE is set)."""
+    return get_endpoint_pool(_default_endpoint_config())
+
+
+def get_client(endpoint: Optional[EndpointConfig] = None) -> AzureOpenAI:
+    """
+    Returns the process-wide Azure OpenAI client of an endpoint (by default, the AZURE_* one), creating it on
+    first use.
+    The client keeps a pool of keep-alive connections, so TLS handshakes are paid once and reused
+    across calls. It is safe to share between threads.
+    """
+    endpoint = endpoint or _default_endpoint_config()
+    client = _clients.get(endpoint.name)
+    if client is not None:
+        return client
+
+    settings = load_azure_settings()
+    with _client_lock:
+        if endpoint.name not in _clients:
+            _clients[endpoint.name] = AzureOpenAI(
+                api_key=endpoint.api_key,
+                api_version=endpoint.api_version,
+                azure_endpoint=endpoint.azure_endpoint,
+                timeout=settings.timeout,
+                max_retries=0,  # Retries are done by the rate limiter, which knows about the quota
+                http_client=DefaultHttpxClient(
+                    limits=_http_limits(settings),
+                    timeout=settings.timeout,
+                    event_hooks={"request": [_on_request], "response": [_on_response]},
+                ),
+            )
+        return _clients[endpoint.name]
+
+
+def get_async_client(endpoint: Optional[EndpointConfig] = None) -> AsyncAzureOpenAI:
+    """
+    Returns the Azure OpenAI async client of an endpoint (by default, the AZURE_* one) for the running event loop,
+    creating it on first use.
+    Async connection pools are bound to the loop they were created in, so each loop gets its own client.
+    """
+    endpoint = endpoint or _default_endpoint_config()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop, {}).get(endpoint.name)
+    if client is not None:
+        return client
+
+    settings = load_azure_settings()
+    with _client_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if endpoint.name not in clients:
+            clients[endpoint.name] = AsyncAzureOpenAI(
+                api_key=endpoint.api_key,
+                api_version=endpoint.api_version,
+                azure_endpoint=endpoint.azure_endpoint,
+                timeout=settings.timeout,
+                max_retries=0,  # Retries are done by the rate limiter, which knows about the quota
+                http_client=DefaultAsyncHttpxClient(
+                    limits=_http_limits(settings),
+                    timeout=settings.timeout,
+                    event_hooks={"request": [_on_request_async], "response": [_on_response_async]},
+                ),
+            )
+        return clients[endpoint.name]
+
+
+def get_connection_stats() -> Dict[str, int]:
+    """
+    Returns the connection-reuse counters of all pooled clients in this process.
+    Returns:
+        Dict[str, int]: requests, new_connections, tls_handshakes and reused_connections.
+    """
+    return _connection_stats.snapshot()
+
+
+def get_client_and_deployment_name() -> Tuple[AzureOpenAI, str]:
+    return get_client(), load_azure_settings().deployment_name
 
 def trim_to_len(s: str, length: int = 120) -> str:
     """
@@ -48,72 +265,567 @@ def announce_llm_interaction(deployment_name: str, system_prompt: str, prompt: s
     print('-' * 20)
     print("Waiting...", end='\r')
 
-def announce_reply(reply_as_plain_text: str) -> None:
-    print(f"Reply:  \t{trim_to_len(reply_as_plain_text)}")
+def announce_reply(reply_as_plain_text: str, cached: bool = False, seconds_to_first_token: Optional[float] = None) -> None:
+    print(f"Reply{' (cached)' if cached else ''}:  \t{trim_to_len(reply_as_plain_text)}")
+    if seconds_to_first_token is not None:
+        print(f"First token after {seconds_to_first_token:.2f}s")
     print('=' * 20)
 
+def announce_escalation(tier: StageTier, schema) -> None:
+    print(f"Reply of {tier.deployment_name} does not match {schema.__name__}, asking {tier.escalate_to} instead")
+
+def stage_tier() -> StageTier:
+    """Returns the deployment and temperature policy of the current pipeline stage, see src/utils/model_tiers.py."""
+    return resolve_stage_tier(load_azure_settings().deployment_name)
+
+def resolve_stage_tier(default_deployment: str, stage: Optional[str] = None) -> StageTier:
+    """
+    Returns the tier of a stage (by default, of the current one) for calls whose default deployment is
+    `default_deployment`, e.g. the deployment of a batch backend.
+    """
+    tier = get_stage_tier(default_deployment, stage)
+    if default_deployment == STAND_IN_DEPLOYMENT_NAME and tier.deployment_name != STAND_IN_DEPLOYMENT_NAME:
+        # Against the stand-in server, tiered deployments are renamed too, so fake replies never share their cache keys
+        return replace(
+            tier,
+            deployment_name=f"{STAND_IN_DEPLOYMENT_NAME}-{tier.deployment_name}",
+            escalate_to=f"{STAND_IN_DEPLOYMENT_NAME}-{tier.escalate_to}" if tier.escalate_to else None,
+        )
+    return tier
+
+def announce_stream_progress(received_characters: int) -> None:
+    print(f"Receiving... {received_characters} characters", end='\r')
+
+def _build_messages(system_prompt: str, prompt: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+def _build_tool_arguments(schema) -> dict:
+    return get_compiled_schema(schema).tool_arguments
+
+def _build_stream_arguments() -> dict:
+    # include_usage adds a final chunk carrying the usage of the whole call
+    return {"stream": True, "stream_options": {"include_usage": True}}
+
+def _chunk_text(chunk) -> str:
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+def build_completion_arguments(deployment_name: str, system_prompt: str, prompt: str, temperature: float, schema=None) -> dict:
+    """
+    Returns the chat-completions request body of a call, as ask() / ask_with_schema() would send it.
+    Used to serialize calls into batch job files.
+    """
+    arguments = {
+        "model": deployment_name,
+        "messages": _build_messages(system_prompt, prompt),
+        "temperature": temperature,
+    }
+    if schema is not None:
+        arguments.update(_build_tool_arguments(schema))
+    return arguments
+
+def tool_arguments_of(response) -> str:
+    tool_call = response.choices[0].message.tool_calls[0]
+    return tool_call.function.arguments
+
+def _parse_tool_arguments(json_arguments: str, cached: bool = False) -> dict:
+    # Parse and pretty-print the JSON
+    parsed_json = json.loads(json_arguments)
+
+    reply_as_plain_text = str(json.dumps(parsed_json, indent=2))
+    announce_reply(reply_as_plain_text, cached)
+
+    return parsed_json
+
+def cache_key_for(deployment_name: str, system_prompt: str, prompt: str, temperature: float, schema=None, **extra) -> Optional[str]:
+    """
+    Returns the response-cache key of a call, or None if calls like this one are not cached.
+    Extra keyword arguments (e.g. n=3 for a multi-sample call) become part of the key.
+    """
+    if not get_llm_cache().should_cache(temperature):
+        return None
+    schema_json = get_compiled_schema(schema).schema_json if schema else None
+    return LLMCache.make_key(deployment_name, system_prompt, prompt, schema_json, temperature, **extra)
+
 def ask(system_prompt: Optional[str], prompt: str, temperature: float = 0.25) -> str:
     system_prompt = system_prompt or "You are a helpful assistant. Reply briefly."
     
-    client, deployment_name = get_client_and_deployment_name()
+    tier = stage_tier()
+    deployment_name, temperature = tier.deployment_name, tier.temperature_for(temperature)
     
     announce_llm_interaction(deployment_name, system_prompt, prompt, temperature)
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": prompt}
-    ]
 
-    response = client.chat.completions.create(
-        model=deployment_name,
-        messages=messages,
-        temperature=temperature,
-    )
+    with record_llm_call(deployment_name, temperature) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature)
+        cached = get_llm_cache().get(cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            announce_reply(cached, cached=True)
+            return cached
+
+        response = create_completion(
+            model=deployment_name,
+            messages=_build_messages(system_prompt, prompt),
+            temperature=temperature,
+        )
+        call.set_usage(response.usage)
     result = response.choices[0].message.content
 
     announce_reply(result)
+    if cache_key and result is not None:
+        get_llm_cache().put(cache_key, result)
 
     return result
 
+def _ask_with_schema_on(deployment_name: str, system_prompt: str, prompt: str, schema, temperature: float, validation_mode: Optional[str]) -> Tuple[dict, bool]:
+    """Asks one deployment. Returns the parsed reply and whether it matches the schema."""
+    announce_llm_interaction(deployment_name, system_prompt, prompt, temperature, schema)
+
+    with record_llm_call(deployment_name, temperature, schema) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature, schema)
+        cached = get_llm_cache().get(cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            return _parse_tool_arguments(cached, cached=True), True
+
+        completion_arguments = build_completion_arguments(deployment_name, system_prompt, prompt, temperature, schema)
+        # Slow calls get a duplicate request when hedging is on, see src/utils/hedging.py
+        response, hedge = run_hedged_sync(
+            f"{deployment_name}/{schema.__name__}",
+            lambda: create_completion(**completion_arguments),
+            lambda: create_completion_async(None, **completion_arguments),
+        )
+        call.set_hedge(hedge)
+        call.set_usage(response.usage)
+    json_arguments = tool_arguments_of(response)
+    parsed_json = _parse_tool_arguments(json_arguments)
+    # Replies that do not match the schema are never cached (in strict mode, they raise)
+    valid = validate_reply(schema, parsed_json, validation_mode)
+    if valid and cache_key:
+        get_llm_cache().put(cache_key, json_arguments)
+
+    return parsed_json, valid
+
 def ask_with_schema(system_prompt: Optional[str], prompt: str, schema, temperature: float = 0.25):
     system_prompt = system_prompt or "You are a helpful assistant. Reply briefly according to the schema."
-    
-    client, deployment_name = get_client_and_deployment_name()
-    
+    tier = stage_tier()
+    temperature = tier.temperature_for(temperature)
+
+    # With an escalation deployment, an invalid reply is only a warning: the call is repeated on the larger model
+    parsed_json, valid = _ask_with_schema_on(tier.deployment_name, system_prompt, prompt, schema, temperature,
+                                             "warn" if tier.escalate_to else None)
+    if not valid and tier.escalate_to:
+        announce_escalation(tier, schema)
+        with telemetry_context(escalated_from=tier.deployment_name):
+            parsed_json, _ = _ask_with_schema_on(tier.escalate_to, system_prompt, prompt, schema, temperature, None)
+
+    return parsed_json
+
+def ask_stream(system_prompt: Optional[str], prompt: str, temperature: float = 0.25) -> Iterator[str]:
+    """
+    Like ask(), but yields the reply in chunks as they arrive.
+    A cached reply is yielded as a single chunk.
+    """
+    system_prompt = system_prompt or "You are a helpful assistant. Reply briefly."
+
+    tier = stage_tier()
+    deployment_name, temperature = tier.deployment_name, tier.temperature_for(temperature)
+
+    announce_llm_interaction(deployment_name, system_prompt, prompt, temperature)
+
+    with record_llm_call(deployment_name, temperature) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature)
+        cached = get_llm_cache().get(cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            announce_reply(cached, cached=True)
+            yield cached
+            return
+
+        stream = stream_completion(
+            model=deployment_name,
+            messages=_build_messages(system_prompt, prompt),
+            temperature=temperature,
+            **_build_stream_arguments(),
+        )
+        chunks = []
+        received = 0
+        for chunk in stream:
+            if chunk.usage is not None:
+                call.set_usage(chunk.usage)
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            call.mark_first_token()
+            chunks.append(text)
+            received += len(text)
+            announce_stream_progress(received)
+            yield text
+    result = "".join(chunks)
+
+    announce_reply(result, seconds_to_first_token=call.seconds_to_first_token())
+    if cache_key:
+        get_llm_cache().put(cache_key, result)
+
+def _scheduler_for(endpoint: EndpointConfig, deployment_name: str) -> RateLimitScheduler:
+    # Azure quotas are per deployment, so each deployment of an endpoint gets its own rate limiter
+    name = f"{endpoint.name}/{deployment_name}"
+    scheduler = _endpoint_schedulers.get(name)
+    if scheduler is not None:
+        return scheduler
+    overrides = {
+        "requests_per_minute": endpoint.rpm_limit,
+        "tokens_per_minute": endpoint.tpm_limit,
+        "max_concurrency": endpoint.max_concurrency,
+        "max_retries": endpoint.max_retries,
+    }
+    settings = replace(load_rate_limit_settings(), **{key: value for key, value in overrides.items() if value is not None})
+    scheduler = _endpoint_schedulers[name] = get_rate_limit_scheduler(name, settings)
+    return scheduler
+
+def _fails_endpoint(error: Exception) -> bool:
+    # Throttling means the endpoint is busy, not broken: it fails over without counting against the breaker
+    return not isinstance(error, openai.RateLimitError)
+
+def _served_by(endpoint: PooledEndpoint) -> None:
+    if len(get_pool()) > 1:
+        annotate_llm_call(endpoint=endpoint.name)
+
+def create_completion(**completion_arguments):
+    """
+    Sends a chat-completions request to an endpoint of the pool, through that endpoint's rate limiter.
+    If the endpoint still fails after its retries, the request fails over to the next endpoint serving the model.
+    """
+    pool = get_pool()
+    model = completion_arguments["model"]
+    tried: List[str] = []
+    while True:
+        endpoint = pool.acquire(model, exclude=tried)
+        if endpoint is None:
+            raise last_error if tried else pool.unavailable_error(model)
+        arguments = {**completion_arguments, "model": endpoint.config.deployment_for(model)}
+        scheduler = _scheduler_for(endpoint.config, arguments["model"])
+        estimated_tokens = estimate_request_tokens(arguments, scheduler.settings.estimated_completion_tokens)
+        client = get_client(endpoint.config)
+        started_at = time.perf_counter()
+        try:
+            response = scheduler.call(estimated_tokens, lambda: client.chat.completions.create(**arguments))
+        except RETRYABLE_ERRORS as error:
+            pool.release(endpoint, failed=_fails_endpoint(error))
+            tried.append(endpoint.name)
+            last_error = error
+            continue
+        except BaseException:
+            pool.release(endpoint)
+            raise
+        pool.release(endpoint, latency=time.perf_counter() - started_at)
+        _served_by(endpoint)
+        return response
+
+def stream_completion(**completion_arguments) -> Iterator:
+    """
+    Like create_completion(), for a streamed request: yields its chunks. The rate-limiter slot and the endpoint are
+    held until the stream ends, so the endpoint's latency covers the whole reply. A failure before the first token
+    is retried and fails over like create_completion(); a later one is raised.
+    """
+    pool = get_pool()
+    model = completion_arguments["model"]
+    tried: List[str] = []
+    while True:
+        endpoint = pool.acquire(model, exclude=tried)
+        if endpoint is None:
+            raise last_error if tried else pool.unavailable_error(model)
+        arguments = {**completion_arguments, "model": endpoint.config.deployment_for(model)}
+        scheduler = _scheduler_for(endpoint.config, arguments["model"])
+        estimated_tokens = estimate_request_tokens(arguments, scheduler.settings.estimated_completion_tokens)
+        client = get_client(endpoint.config)
+        started_at = time.perf_counter()
+        started = False
+        try:
+            for chunk in scheduler.stream(estimated_tokens, lambda: client.chat.completions.create(**arguments),
+                                          is_token=_is_token):
+                started = started or _is_token(chunk)
+                yield chunk
+        except STREAM_RETRYABLE_ERRORS as error:
+            pool.release(endpoint, failed=_fails_endpoint(error))
+            if started:
+                raise
+            tried.append(endpoint.name)
+            last_error = error
+            continue
+        except BaseException:
+            pool.release(endpoint)
+            raise
+        pool.release(endpoint, latency=time.perf_counter() - started_at)
+        _served_by(endpoint)
+        return
+
+def _is_token(chunk) -> bool:
+    return bool(_chunk_text(chunk))
+
+async def _create_completion_with_failover_async(completion_arguments: dict):
+    pool = get_pool()
+    model = completion_arguments["model"]
+    tried: List[str] = []
+    while True:
+        endpoint = pool.acquire(model, exclude=tried)
+        if endpoint is None:
+            raise last_error if tried else pool.unavailable_error(model)
+        arguments = {**completion_arguments, "model": endpoint.config.deployment_for(model)}
+        scheduler = _scheduler_for(endpoint.config, arguments["model"])
+        estimated_tokens = estimate_request_tokens(arguments, scheduler.settings.estimated_completion_tokens)
+        client = get_async_client(endpoint.config)
+        started_at = time.perf_counter()
+        try:
+            response = await scheduler.call_async(estimated_tokens, lambda: client.chat.completions.create(**arguments))
+        except RETRYABLE_ERRORS as error:
+            pool.release(endpoint, failed=_fails_endpoint(error))
+            tried.append(endpoint.name)
+            last_error = error
+            continue
+        except BaseException:
+            pool.release(endpoint)
+            raise
+        pool.release(endpoint, latency=time.perf_counter() - started_at)
+        _served_by(endpoint)
+        return response
+
+async def create_completion_async(timeout: Optional[float], **completion_arguments):
+    """
+    Like create_completion(), for async calls.
+    The whole call, including waiting for quota, retries and failing over, is cancelled if it takes longer than
+    `timeout` seconds.
+    """
+    timeout = timeout if timeout is not None else load_azure_settings().call_timeout
+    return await asyncio.wait_for(_create_completion_with_failover_async(completion_arguments), timeout=timeout)
+
+async def stream_completion_async(**completion_arguments) -> AsyncIterator:
+    """Like stream_completion(), for async calls."""
+    pool = get_pool()
+    model = completion_arguments["model"]
+    tried: List[str] = []
+    while True:
+        endpoint = pool.acquire(model, exclude=tried)
+        if endpoint is None:
+            raise last_error if tried else pool.unavailable_error(model)
+        arguments = {**completion_arguments, "model": endpoint.config.deployment_for(model)}
+        scheduler = _scheduler_for(endpoint.config, arguments["model"])
+        estimated_tokens = estimate_request_tokens(arguments, scheduler.settings.estimated_completion_tokens)
+        client = get_async_client(endpoint.config)
+        started_at = time.perf_counter()
+        started = False
+        try:
+            async for chunk in scheduler.stream_async(
+                    estimated_tokens, lambda: client.chat.completions.create(**arguments), is_token=_is_token):
+                started = started or _is_token(chunk)
+                yield chunk
+        except STREAM_RETRYABLE_ERRORS as error:
+            pool.release(endpoint, failed=_fails_endpoint(error))
+            if started:
+                raise
+            tried.append(endpoint.name)
+            last_error = error
+            continue
+        except BaseException:
+            pool.release(endpoint)
+            raise
+        pool.release(endpoint, latency=time.perf_counter() - started_at)
+        _served_by(endpoint)
+        return
+
+async def ask_async(system_prompt: Optional[str], prompt: str, temperature: float = 0.25, timeout: Optional[float] = None) -> str:
+    system_prompt = system_prompt or "You are a helpful assistant. Reply briefly."
+    tier = stage_tier()
+    deployment_name, temperature = tier.deployment_name, tier.temperature_for(temperature)
+
+    announce_llm_interaction(deployment_name, system_prompt, prompt, temperature)
+
+    with record_llm_call(deployment_name, temperature) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature)
+        cached = await asyncio.to_thread(get_llm_cache().get, cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            announce_reply(cached, cached=True)
+            return cached
+
+        response = await create_completion_async(
+            timeout,
+            model=deployment_name,
+            messages=_build_messages(system_prompt, prompt),
+            temperature=temperature,
+        )
+        call.set_usage(response.usage)
+    result = response.choices[0].message.content
+
+    announce_reply(result)
+    if cache_key and result is not None:
+        await asyncio.to_thread(get_llm_cache().put, cache_key, result)
+
+    return result
+
+async def _ask_with_schema_on_async(deployment_name: str, system_prompt: str, prompt: str, schema, temperature: float, validation_mode: Optional[str], timeout: Optional[float]) -> Tuple[dict, bool]:
+    """Asks one deployment. Returns the parsed reply and whether it matches the schema."""
     announce_llm_interaction(deployment_name, system_prompt, prompt, temperature, schema)
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": prompt}
-    ]
 
-    response = client.chat.completions.create(
-        model=deployment_name,
-        messages=messages,
-        tools=[
-            {
-                "type": "function",
-                "function": {
-                    "name": schema.__name__,
-                    "description": "Get the structured response based on the provided schema.",
-                    "parameters": schema.model_json_schema(),
-                },
-            }
-        ],
-        tool_choice={
-            "type": "function",
-            "function": {"name": schema.__name__},
-        },
-        temperature=temperature,
-    )
+    with record_llm_call(deployment_name, temperature, schema) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature, schema)
+        cached = await asyncio.to_thread(get_llm_cache().get, cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            return _parse_tool_arguments(cached, cached=True), True
 
-    tool_call = response.choices[0].message.tool_calls[0]
-    json_arguments = tool_call.function.arguments
+        completion_arguments = build_completion_arguments(deployment_name, system_prompt, prompt, temperature, schema)
+        # Slow calls get a duplicate request when hedging is on, see src/utils/hedging.py
+        response, hedge = await run_hedged(
+            f"{deployment_name}/{schema.__name__}", lambda: create_completion_async(timeout, **completion_arguments))
+        call.set_hedge(hedge)
+        call.set_usage(response.usage)
+    json_arguments = tool_arguments_of(response)
+    parsed_json = _parse_tool_arguments(json_arguments)
+    # Replies that do not match the schema are never cached (in strict mode, they raise)
+    valid = validate_reply(schema, parsed_json, validation_mode)
+    if valid and cache_key:
+        await asyncio.to_thread(get_llm_cache().put, cache_key, json_arguments)
 
-    # Parse and pretty-print the JSON
-    parsed_json = json.loads(json_arguments)
+    return parsed_json, valid
 
-    reply_as_plain_text = str(json.dumps(parsed_json, indent=2))
-    announce_reply(reply_as_plain_text)
-    
-    return parsed_json
\ No newline at end of file
+async def ask_with_schema_async(system_prompt: Optional[str], prompt: str, schema, temperature: float = 0.25, timeout: Optional[float] = None):
+    system_prompt = system_prompt or "You are a helpful assistant. Reply briefly according to the schema."
+    tier = stage_tier()
+    temperature = tier.temperature_for(temperature)
+
+    # With an escalation deployment, an invalid reply is only a warning: the call is repeated on the larger model
+    parsed_json, valid = await _ask_with_schema_on_async(
+        tier.deployment_name, system_prompt, prompt, schema, temperature, "warn" if tier.escalate_to else None, timeout)
+    if not valid and tier.escalate_to:
+        announce_escalation(tier, schema)
+        with telemetry_context(escalated_from=tier.deployment_name):
+            parsed_json, _ = await _ask_with_schema_on_async(
+                tier.escalate_to, system_prompt, prompt, schema, temperature, None, timeout)
+
+    return parsed_json
+
+async def _ask_with_schema_samples_on_async(deployment_name: str, system_prompt: str, prompt: str, schema, samples: int, temperature: float, validation_mode: Optional[str], timeout: Optional[float]) -> Tuple[List[dict], int]:
+    """Asks one deployment. Returns the parsed candidates and how many of them match the schema."""
+    announce_llm_interaction(deployment_name, system_prompt, prompt, temperature, schema)
+
+    with record_llm_call(deployment_name, temperature, schema) as call:
+        call.record.extra["samples"] = samples
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature, schema, n=samples)
+        cached = await asyncio.to_thread(get_llm_cache().get, cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            return [_parse_tool_arguments(json_arguments, cached=True) for json_arguments in json.loads(cached)], samples
+
+        response = await create_completion_async(
+            timeout,
+            n=samples,
+            **build_completion_arguments(deployment_name, system_prompt, prompt, temperature, schema),
+        )
+        call.set_usage(response.usage)
+
+    candidates, all_arguments = [], []
+    for choice in response.choices:
+        if not choice.message.tool_calls:
+            print(f"Warning: sample {choice.index} of {schema.__name__} has no tool call ({choice.finish_reason})")
+            continue
+        json_arguments = choice.message.tool_calls[0].function.arguments
+        try:
+            parsed_json = _parse_tool_arguments(json_arguments)
+        except json.JSONDecodeError as error:
+            print(f"Warning: sample {choice.index} of {schema.__name__} is not valid JSON: {error}")
+            continue
+        if validate_reply(schema, parsed_json, validation_mode):
+            all_arguments.append(json_arguments)
+        candidates.append(parsed_json)
+    # Cached only when every sample came back valid, so a later run never gets fewer candidates from the cache
+    if cache_key and len(all_arguments) == samples:
+        await asyncio.to_thread(get_llm_cache().put, cache_key, json.dumps(all_arguments))
+
+    return candidates, len(all_arguments)
+
+async def ask_with_schema_samples_async(system_prompt: Optional[str], prompt: str, schema, samples: int, temperature: float = 0.25, timeout: Optional[float] = None) -> List[dict]:
+    """
+    Like ask_with_schema_async(), but asks for several candidate replies in one request (the `n` parameter),
+    so the prompt is sent and billed once for all of them.
+    Returns:
+        List[dict]: The parsed candidates. Choices without a usable tool call are dropped, so there may be fewer.
+    """
+    system_prompt = system_prompt or "You are a helpful assistant. Reply briefly according to the schema."
+    tier = stage_tier()
+    temperature = tier.temperature_for(temperature)
+
+    candidates, valid = await _ask_with_schema_samples_on_async(
+        tier.deployment_name, system_prompt, prompt, schema, samples, temperature,
+        "warn" if tier.escalate_to else None, timeout)
+    # Escalated only when no candidate at all is valid: some valid variants are enough
+    if not valid and tier.escalate_to:
+        announce_escalation(tier, schema)
+        with telemetry_context(escalated_from=tier.deployment_name):
+            candidates, _ = await _ask_with_schema_samples_on_async(
+                tier.escalate_to, system_prompt, prompt, schema, samples, temperature, None, timeout)
+
+    return candidates
+
+async def _prepend(first, rest: AsyncIterator) -> AsyncIterator:
+    if first is None:
+        return
+    yield first
+    async for item in rest:
+        yield item
+
+async def ask_stream_async(system_prompt: Optional[str], prompt: str, temperature: float = 0.25, timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Like ask_async(), but yields the reply in chunks as they arrive.
+    The timeout applies to getting the reply started; a cached reply is yielded as a single chunk.
+    """
+    system_prompt = system_prompt or "You are a helpful assistant. Reply briefly."
+    tier = stage_tier()
+    deployment_name, temperature = tier.deployment_name, tier.temperature_for(temperature)
+
+    announce_llm_interaction(deployment_name, system_prompt, prompt, temperature)
+
+    with record_llm_call(deployment_name, temperature) as call:
+        cache_key = cache_key_for(deployment_name, system_prompt, prompt, temperature)
+        cached = await asyncio.to_thread(get_llm_cache().get, cache_key) if cache_key else None
+        if cached is not None:
+            call.record.cache_hit = True
+            announce_reply(cached, cached=True)
+            yield cached
+            return
+
+        stream = stream_completion_async(
+            model=deployment_name,
+            messages=_build_messages(system_prompt, prompt),
+            temperature=temperature,
+            **_build_stream_arguments(),
+        )
+        chunks = []
+        received = 0
+        timeout = timeout if timeout is not None else load_azure_settings().call_timeout
+        # Only the wait for the first chunk is bounded: a long reply may take longer than that to stream.
+        # asyncio.timeout() keeps anext() in this task, where wait_for() would run the stream in a task of its own
+        async with asyncio.timeout(timeout):
+            first_chunk = await anext(stream, None)
+        async for chunk in _prepend(first_chunk, stream):
+            if chunk.usage is not None:
+                call.set_usage(chunk.usage)
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            call.mark_first_token()
+            chunks.append(text)
+            received += len(text)
+            announce_stream_progress(received)
+            yield text
+    result = "".join(chunks)
+
+    announce_reply(result, seconds_to_first_token=call.seconds_to_first_token())
+    if cache_key:
+        await asyncio.to_thread(get_llm_cache().put, cache_key, result)
+
+# fin.
@@ -0,0 +1,272 @@
+"""
+A pool of Azure OpenAI endpoints / deployments that LLM calls are spread over.
+
+One deployment's quota caps the throughput of a run, and one regional outage stops it. With a pool, every call is
+routed to one of several endpoints serving the requested model:
+- "ewma" routing (the default) picks the endpoint with the lowest exponentially weighted moving average latency,
+  scaled by its outstanding calls, so fast endpoints get more traffic without being swamped;
+- "least_outstanding" routing picks the endpoint with the fewest calls in flight, relative to its concurrency.
+A circuit breaker ejects an endpoint after consecutive failures (connection errors, timeouts, 5xx). After a cooldown
+it lets one probe call through, and closes again if the probe succeeds. While every endpoint of a model is ejected,
+calls still go to the one ejected longest ago, as its probe; once each of them has a probe in flight, calls fail
+fast with EndpointUnavailableError until a probe comes back. Each endpoint keeps its own rate limiter,
+with its own quota, see src.utils.rate_limiter.
+
+Without a pool file, the pool holds a single endpoint built from the AZURE_* settings, which serves any model.
+
+The pool file is JSON:
+    {
+      "routing": "ewma",
+      "endpoints": [
+        {"name": "sweden", "azure_endpoint": "https://....openai.azure.com/", "api_key_env": "AZURE_API_KEY_SWEDEN",
+         "deployment_name": "gpt-4o-sweden", "model": "gpt-4o", "tpm_limit": 450000, "max_concurrency": 16},
+        ...
+      ]
+    }
+"model" is the name callers ask for (default: the deployment name) and "deployment_name" the deployment on that
+endpoint. The API key is given directly ("api_key") or by the name of an environment variable ("api_key_env"),
+and api_version defaults to AZURE_API_VERSION.
+
+Configuration (environment / .env):
+    LLM_ENDPOINTS_FILE          The pool file (default: no pool, a single endpoint)
+    LLM_ROUTING                 "ewma" or "least_outstanding", overrides the file's routing
+    LLM_BREAKER_FAILURES        Consecutive failures that eject an endpoint (default 3)
+    LLM_BREAKER_COOLDOWN        Seconds an ejected endpoint waits before its probe call (default 30)
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+ROUTING_STRATEGIES = ("ewma", "least_outstanding")
+EWMA_DECAY = 0.3  # Weight of the newest latency in the moving average
+DEFAULT_ENDPOINT_NAME = "default"
+
+
+class EndpointUnavailableError(Exception):
+    """Raised when every endpoint serving a model is ejected, and each one is already being probed."""
+    def __init__(self, model: str):
+        super().__init__(f"Every endpoint serving the model {model} is ejected and already being probed")
+        self.model = model
+
+
+@dataclass(frozen=True)
+class EndpointConfig:
+    """Data class to hold one endpoint / deployment of the pool."""
+    name: str
+    azure_endpoint: str
+    api_key: str
+    api_version: str
+    deployment_name: Optional[str] = None  # None: send the model the caller asked for
+    model: Optional[str] = None  # The model callers ask for. None: any model
+    rpm_limit: Optional[int] = None  # None: the AZURE_RPM_LIMIT / AZURE_TPM_LIMIT defaults
+    tpm_limit: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    max_retries: Optional[int] = None  # Retries on this endpoint before failing over to another one
+
+    def serves(self, model: str) -> bool:
+        return self.model is None or self.model == model
+
+    def deployment_for(self, model: str) -> str:
+        return self.deployment_name or model
+
+
+@dataclass
+class BreakerSettings:
+    """Data class to hold when endpoints are ejected and probed."""
+    failure_threshold: int = 3
+    cooldown: float = 30.0  # Seconds
+
+
+class PooledEndpoint:
+    """An endpoint of the pool, with its load, latency and circuit-breaker state."""
+    def __init__(self, config: EndpointConfig):
+        self.config = config
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None  # Set while the circuit is open (the endpoint is ejected)
+        self.probing = False
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "probing" if self.probing else "open"
+
+
+class EndpointPool:
+    """Routes calls to endpoints and tracks their health. Thread-safe."""
+    def __init__(self, configs: List[EndpointConfig], routing: str = "ewma",
+                 breaker: Optional[BreakerSettings] = None):
+        if not configs:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        if routing not in ROUTING_STRATEGIES:
+            raise ValueError(f"Invalid routing: {routing}. Valid strategies are: {', '.join(ROUTING_STRATEGIES)}")
+        self.endpoints = [PooledEndpoint(config) for config in configs]
+        self.routing = routing
+        self.breaker = breaker or BreakerSettings()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def endpoints_for(self, model: str) -> List[PooledEndpoint]:
+        return [endpoint for endpoint in self.endpoints if endpoint.config.serves(model)]
+
+    def _available(self, endpoint: PooledEndpoint, now: float) -> bool:
+        if endpoint.opened_at is None:
+            return True
+        # Half-open: after the cooldown, a single probe call is let through
+        return not endpoint.probing and now - endpoint.opened_at >= self.breaker.cooldown
+
+    def _score(self, endpoint: PooledEndpoint, default_latency: float) -> float:
+        if self.routing == "least_outstanding":
+            return endpoint.outstanding / (endpoint.config.max_concurrency or 1)
+        latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else default_latency
+        return latency * (endpoint.outstanding + 1)
+
+    def acquire(self, model: str, exclude: Collection[str] = ()) -> Optional[PooledEndpoint]:
+        """
+        Picks the endpoint for a call and counts the call as outstanding on it.
+        Returns None if every endpoint serving the model has been excluded, or is ejected with a probe in flight.
+        If all of them are ejected, the one ejected longest ago that is not being probed yet is used anyway (and
+        probed), so calls fail over rather than fail outright.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints_for(model) if endpoint.name not in exclude]
+            if not candidates:
+                return None
+            available = [endpoint for endpoint in candidates if self._available(endpoint, now)]
+            if available:
+                # Endpoints without a latency yet are assumed to be as fast as the fastest one, so they get tried
+                known = [endpoint.ewma_latency for endpoint in available if endpoint.ewma_latency is not None]
+                default_latency = min(known) if known else 1.0
+                chosen = min(available, key=lambda endpoint: self._score(endpoint, default_latency))
+            else:
+                # A second call on an endpoint that is being probed would be a second probe
+                unprobed = [endpoint for endpoint in candidates if not endpoint.probing]
+                if not unprobed:
+                    return None
+                chosen = min(unprobed, key=lambda endpoint: endpoint.opened_at)
+            if chosen.opened_at is not None:
+                chosen.probing = True
+            chosen.outstanding += 1
+            chosen.calls += 1
+            return chosen
+
+    def unavailable_error(self, model: str) -> Exception:
+        """The error for a call that acquire() found no endpoint for before trying any."""
+        if self.endpoints_for(model):
+            return EndpointUnavailableError(model)
+        return ValueError(f"No endpoint serves the model {model}")
+
+    def release(self, endpoint: PooledEndpoint, latency: Optional[float] = None, failed: bool = False) -> None:
+        """
+        Ends a call on an endpoint.
+        Args:
+            latency (Optional[float]): Seconds the call took, if it succeeded.
+            failed (bool): Whether the endpoint failed the call. Throttling and cancelled calls are neither
+                successes nor failures: they leave the breaker as it is.
+        """
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.probing = False
+            if failed:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.opened_at is not None or endpoint.consecutive_failures >= self.breaker.failure_threshold:
+                    if endpoint.opened_at is None:
+                        endpoint.ejections += 1
+                    endpoint.opened_at = time.monotonic()
+            elif latency is not None:
+                endpoint.consecutive_failures = 0
+                endpoint.opened_at = None
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency = EWMA_DECAY * latency + (1 - EWMA_DECAY) * endpoint.ewma_latency
+
+    def stats(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return [
+                {
+                    "name": endpoint.name,
+                    "state": endpoint.state,
+                    "calls": endpoint.calls,
+                    "failures": endpoint.failures,
+                    "ejections": endpoint.ejections,
+                    "outstanding": endpoint.outstanding,
+                    "ewma_latency_ms": round(endpoint.ewma_latency * 1000, 1) if endpoint.ewma_latency else None,
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+def load_endpoint_configs(path: str, default_api_version: str) -> Tuple[List[EndpointConfig], Optional[str]]:
+    """
+    Reads a pool file.
+    Returns:
+        Tuple[List[EndpointConfig], Optional[str]]: (the endpoints, the file's routing strategy if any)
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        pool = json.load(file)
+    configs = []
+    for index, entry in enumerate(pool.get("endpoints", [])):
+        entry = dict(entry)
+        api_key_env = entry.pop("api_key_env", None)
+        api_key = entry.pop("api_key", None) or (os.getenv(api_key_env, "").strip() if api_key_env else "")
+        configs.append(EndpointConfig(
+            name=entry.pop("name", f"endpoint{index + 1}"),
+            azure_endpoint=entry.pop("azure_endpoint"),
+            api_key=api_key,
+            api_version=entry.pop("api_version", default_api_version),
+            **entry,
+        ))
+    return configs, pool.get("routing")
+
+
+def load_breaker_settings() -> BreakerSettings:
+    load_dotenv()
+    return BreakerSettings(
+        failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", BreakerSettings.failure_threshold)),
+        cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", BreakerSettings.cooldown)),
+    )
+
+
+_pool: Optional[EndpointPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool(default_endpoint: EndpointConfig) -> EndpointPool:
+    """
+    Returns the process-wide endpoint pool, creating it on first use from LLM_ENDPOINTS_FILE, or from
+    `default_endpoint` alone when there is no pool file.
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            load_dotenv()
+            path = os.getenv("LLM_ENDPOINTS_FILE", "").strip()
+            configs, routing = [default_endpoint], None
+            if path:
+                configs, routing = load_endpoint_configs(path, default_endpoint.api_version)
+            routing = os.getenv("LLM_ROUTING", "").strip().lower() or routing or "ewma"
+            _pool = EndpointPool(configs, routing, load_breaker_settings())
+    return _pool
+
+# fin.
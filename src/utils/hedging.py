@@ -0,0 +1,246 @@
+"""
+Hedged LLM calls, to cut the tail latency of slow requests.
+
+A few calls per batch take many times the median, and the whole file waits for them. With hedging on, a call that
+has not answered by a percentile of the recent latencies of its kind (e.g. of its schema) gets a duplicate: whichever
+finishes first is used, and the other one is cancelled. The number of hedges per run is capped, so the extra spend
+is bounded. With --workers N (see src.pipeline.worker_pool), each worker process gets 1/N of the cap, rounded down,
+so the run as a whole stays within it (with fewer hedges than workers, none are hedged, with a warning).
+
+Synchronous calls (run_hedged_sync) that are to be hedged run the async version of the call on a background event
+loop instead, so that the attempt that loses is cancelled there too rather than left running in a thread.
+
+Each hedged call is tagged in the telemetry (hedged, hedge_won, hedge_delay_ms, hedge_saved_ms), see
+src.utils.telemetry. The savings of a winning hedge are estimated from the recent calls of the same kind that took
+longer than the winner: how much longer they took on average is what the cancelled call would have cost.
+
+Configuration (environment / .env):
+    LLM_HEDGE                   "1" to hedge ask_with_schema calls (default "0")
+    LLM_HEDGE_PERCENTILE        Latency percentile after which a call is hedged (default 95)
+    LLM_HEDGE_MIN_SAMPLES       Latencies needed before a kind of call is hedged at all (default 10)
+    LLM_HEDGE_MIN_DELAY         Never hedge before this many seconds (default 2)
+    LLM_HEDGE_MAX_PER_RUN       Hedges per run, shared by its worker processes (default 20)
+"""
+import asyncio
+import collections
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+
+from src.utils.telemetry import percentile
+
+T = TypeVar("T")
+
+LATENCY_WINDOW = 200  # Recent latencies kept per kind of call
+
+
+@dataclass
+class HedgeSettings:
+    """Data class to hold when and how often calls are hedged."""
+    enabled: bool = False
+    percentile: float = 95.0
+    min_samples: int = 10
+    min_delay: float = 2.0  # Seconds
+    max_per_run: int = 20
+
+
+@dataclass
+class HedgeOutcome:
+    """Data class to hold what happened to one call."""
+    hedged: bool = False
+    hedge_won: bool = False
+    delay: Optional[float] = None  # Seconds after which the hedge was sent
+    saved: Optional[float] = None  # Estimated seconds saved by a winning hedge
+
+
+class HedgePolicy:
+    """Tracks recent latencies per kind of call, decides when to hedge, and enforces the per-run budget."""
+    def __init__(self, settings: HedgeSettings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies[kind].append(seconds)
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """Seconds after which a call of this kind should be hedged, or None while there is too little history."""
+        with self._lock:
+            latencies = list(self._latencies[kind])
+        if len(latencies) < self.settings.min_samples:
+            return None
+        return max(self.settings.min_delay, percentile(latencies, self.settings.percentile / 100.0))
+
+    def try_take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges >= self.settings.max_per_run:
+                return False
+            self.hedges += 1
+            return True
+
+    def estimate_saved(self, kind: str, elapsed: float) -> float:
+        """Average extra time of the recent calls of this kind that took longer than `elapsed`."""
+        with self._lock:
+            longer = [latency - elapsed for latency in self._latencies[kind] if latency > elapsed]
+        return sum(longer) / len(longer) if longer else 0.0
+
+    def record_win(self, saved: float) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+            self.saved_seconds += saved
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"hedges": self.hedges, "hedge_wins": self.hedge_wins, "saved_seconds": round(self.saved_seconds, 1)}
+
+
+async def _cancel(task: "asyncio.Task") -> None:
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+async def run_hedged(kind: str, call: Callable[[], Awaitable[T]], policy: Optional["HedgePolicy"] = None) -> Tuple[T, HedgeOutcome]:
+    """
+    Runs an async call, hedging it with a duplicate if it is slow.
+    Args:
+        kind (str): What the latency of this call is compared with, e.g. the schema name.
+        call (Callable[[], Awaitable[T]]): Starts one attempt of the call. Called a second time for the hedge.
+        policy (Optional[HedgePolicy]): Defaults to the process-wide policy.
+    Returns:
+        Tuple[T, HedgeOutcome]: The first successful result, and whether a hedge was sent and won.
+    """
+    policy = policy or get_hedge_policy()
+    outcome = HedgeOutcome()
+    if not policy.settings.enabled:
+        return await call(), outcome
+
+    started_at = time.perf_counter()
+    primary = asyncio.ensure_future(call())
+    delay = policy.hedge_delay(kind)
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done and policy.try_take_hedge():
+                outcome.hedged, outcome.delay = True, delay
+                return await _race(kind, policy, primary, asyncio.ensure_future(call()), started_at, outcome)
+        result = await primary
+    except BaseException:
+        if not primary.done():
+            await _cancel(primary)
+        raise
+    policy.record_latency(kind, time.perf_counter() - started_at)
+    return result, outcome
+
+
+async def _race(kind: str, policy: HedgePolicy, primary: "asyncio.Task", hedge: "asyncio.Task", started_at: float,
+                outcome: HedgeOutcome):
+    pending = {primary, hedge}
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    first_error = first_error or task.exception()
+                    continue
+                elapsed = time.perf_counter() - started_at
+                if task is hedge:
+                    outcome.hedge_won = True
+                    outcome.saved = policy.estimate_saved(kind, elapsed)
+                    policy.record_win(outcome.saved)
+                    policy.record_latency(kind, elapsed - outcome.delay)
+                else:
+                    policy.record_latency(kind, elapsed)
+                return task.result(), outcome
+        raise first_error
+    finally:
+        for task in pending:
+            await _cancel(task)
+
+
+def run_hedged_sync(
+    kind: str,
+    call: Callable[[], T],
+    call_async: Callable[[], Awaitable[T]],
+    policy: Optional["HedgePolicy"] = None,
+) -> Tuple[T, HedgeOutcome]:
+    """
+    Like run_hedged(), for synchronous callers.
+    Args:
+        call (Callable[[], T]): Makes the call, when it is not hedged.
+        call_async (Callable[[], Awaitable[T]]): Starts one attempt of the same call, when it may be hedged. The
+            attempts run on the hedging loop, so the one that loses can be cancelled.
+    """
+    policy = policy or get_hedge_policy()
+    if not policy.settings.enabled or policy.hedge_delay(kind) is None:
+        started_at = time.perf_counter()
+        result = call()
+        if policy.settings.enabled:
+            policy.record_latency(kind, time.perf_counter() - started_at)
+        return result, HedgeOutcome()
+
+    # The callback that starts the task runs in a copy of this thread's context (telemetry_context and all)
+    future = asyncio.run_coroutine_threadsafe(run_hedged(kind, call_async, policy), get_hedging_loop())
+    try:
+        return future.result()
+    except BaseException:
+        # E.g. KeyboardInterrupt while waiting: no attempt may outlive its caller
+        future.cancel()
+        raise
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_hedging_loop() -> asyncio.AbstractEventLoop:
+    """Returns the event loop that runs the hedged calls of synchronous callers, in a daemon thread of its own."""
+    global _loop
+    if _loop is not None:
+        return _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="hedging", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+_policy: Optional[HedgePolicy] = None
+_policy_lock = threading.Lock()
+
+
+def load_hedge_settings() -> HedgeSettings:
+    load_dotenv()
+    return HedgeSettings(
+        enabled=os.getenv("LLM_HEDGE", "0").strip() == "1",
+        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", HedgeSettings.percentile)),
+        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", HedgeSettings.min_samples)),
+        min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", HedgeSettings.min_delay)),
+        max_per_run=int(os.getenv("LLM_HEDGE_MAX_PER_RUN", HedgeSettings.max_per_run)),
+    )
+
+
+def get_hedge_policy() -> HedgePolicy:
+    """Returns the process-wide hedge policy, creating it from the environment on first use."""
+    global _policy
+    if _policy is not None:
+        return _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy(load_hedge_settings())
+    return _policy
+
+# fin.
@@ -0,0 +1,262 @@
+"""
+Policies that turn the model's likelihood conclusions into the report types to generate, without asking anyone.
+
+- "auto": the model's conclusions, as they are.
+- "rules": the model's conclusions, corrected by the rules of a JSON file (LIKELIHOOD_RULES_FILE), e.g.
+      {"rules": [
+          {"name": "changes are NonDNS", "if": {"event_matches": "(?i)change"}, "set": {"NonDNS": "yes"}},
+          {"if": {"content_matches": "dnsZone"}, "at_least": {"DNS": "maybe"}},
+          {"if": {"model": {"LDAP": "maybe"}, "extracted_matches": "(?i)history"}, "set": {"LDAP": "no"}}
+      ]}
+  Rules apply in order. All the conditions of a rule must hold: "event_matches" (a regex that one of the event
+  names found in the report matches), "content_matches" (a regex on the report), "extracted_matches" (a regex on
+  the extracted data) and "model" (the model's conclusion of each listed type). "set" replaces the likelihood of
+  a type, "at_least" only raises it.
+- "deferred": generate speculatively and let a human decide afterwards. Every type is generated at least at
+  LIKELIHOOD_DEFERRED_FLOOR (default "maybe", so the reviewer can choose among all types; "no" generates only
+  what the model and rules propose). The rules apply first, when a rules file is set. Each file's conclusions
+  and reasoning are appended to a review queue, and a single bulk pass approves or drops the variants:
+
+Run from the project root:
+    python -m src.utils.likelihood_policies review <artifacts dir> [--drop-rated no] [--drop f1.xml:DNS ...] [--approve-all]
+Without options, the pending files are listed with the model's reasoning and one line of input decides them all.
+Dropped reports are moved to dropped/ in the artifacts directory, not deleted.
+
+Configuration (environment / .env):
+    LIKELIHOOD_RULES_FILE           The rules of the "rules" policy
+    LIKELIHOOD_DEFERRED_FLOOR       "no", "maybe" (default) or "yes": the least a type is generated at when deferred
+    LIKELIHOOD_REVIEW_QUEUE         The review queue of the "deferred" policy (cli.py sets it to review_queue.jsonl
+                                    in the output directory)
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from src.utils.telemetry import current_telemetry_context
+
+LIKELIHOOD_ORDER = {"no": 0, "maybe": 1, "yes": 2}
+REVIEW_QUEUE_FILENAME = "review_queue.jsonl"
+REVIEW_DECISIONS_FILENAME = "review_decisions.jsonl"
+DROPPED_DIRNAME = "dropped"
+
+
+@dataclass(frozen=True)
+class LikelihoodRule:
+    """Data class to hold one rule of a rules file."""
+    name: str
+    event_matches: Optional["re.Pattern"] = None
+    content_matches: Optional["re.Pattern"] = None
+    extracted_matches: Optional["re.Pattern"] = None
+    model: Dict[str, str] = field(default_factory=dict)  # Report type -> the model's conclusion
+    set: Dict[str, str] = field(default_factory=dict)
+    at_least: Dict[str, str] = field(default_factory=dict)
+
+    def applies(self, conclusions: Dict[str, str], quest_report_str: str, extracted_data: str,
+                events_found: Set[str]) -> bool:
+        if self.event_matches and not any(self.event_matches.search(event) for event in events_found):
+            return False
+        if self.content_matches and not self.content_matches.search(quest_report_str):
+            return False
+        if self.extracted_matches and not self.extracted_matches.search(extracted_data):
+            return False
+        return all(conclusions.get(report_type) == conclusion for report_type, conclusion in self.model.items())
+
+
+def _check_likelihoods(likelihoods: Dict[str, str], where: str) -> Dict[str, str]:
+    for report_type, likelihood in likelihoods.items():
+        if likelihood not in LIKELIHOOD_ORDER:
+            raise ValueError(f"Invalid likelihood {likelihood!r} for {report_type} in {where}")
+    return likelihoods
+
+
+def load_likelihood_rules(path: str) -> List[LikelihoodRule]:
+    with open(path, "r", encoding="utf-8") as file:
+        entries = json.load(file).get("rules", [])
+    rules = []
+    for index, entry in enumerate(entries):
+        name = entry.get("name", f"rule {index + 1}")
+        conditions = entry.get("if", {})
+        unknown = set(conditions) - {"event_matches", "content_matches", "extracted_matches", "model"}
+        if unknown:
+            raise ValueError(f"Unknown conditions in {name} of {path}: {', '.join(sorted(unknown))}")
+        rules.append(LikelihoodRule(
+            name=name,
+            event_matches=re.compile(conditions["event_matches"]) if "event_matches" in conditions else None,
+            content_matches=re.compile(conditions["content_matches"]) if "content_matches" in conditions else None,
+            extracted_matches=re.compile(conditions["extracted_matches"]) if "extracted_matches" in conditions else None,
+            model=_check_likelihoods(conditions.get("model", {}), f"{name} of {path}"),
+            set=_check_likelihoods(entry.get("set", {}), f"{name} of {path}"),
+            at_least=_check_likelihoods(entry.get("at_least", {}), f"{name} of {path}"),
+        ))
+    return rules
+
+
+_rules: Optional[List[LikelihoodRule]] = None
+_rules_lock = threading.Lock()
+
+
+def get_likelihood_rules() -> List[LikelihoodRule]:
+    """Returns the rules of LIKELIHOOD_RULES_FILE, loaded on first use. No file means no rules."""
+    global _rules
+    if _rules is not None:
+        return _rules
+    with _rules_lock:
+        if _rules is None:
+            load_dotenv()
+            path = os.getenv("LIKELIHOOD_RULES_FILE", "").strip()
+            _rules = load_likelihood_rules(path) if path else []
+    return _rules
+
+
+def apply_rules(conclusions: Dict[str, str], quest_report_str: str, extracted_data: str,
+                events_found: Optional[Set[str]] = None, rules: Optional[List[LikelihoodRule]] = None) -> Dict[str, str]:
+    """Corrects the model's conclusions with the rules that apply, in order."""
+    rules = get_likelihood_rules() if rules is None else rules
+    likelihoods = dict(conclusions)
+    for rule in rules:
+        if not rule.applies(conclusions, quest_report_str, extracted_data, events_found or set()):
+            continue
+        likelihoods.update(rule.set)
+        for report_type, minimum in rule.at_least.items():
+            if LIKELIHOOD_ORDER[likelihoods.get(report_type, "no")] < LIKELIHOOD_ORDER[minimum]:
+                likelihoods[report_type] = minimum
+        print(f"Likelihood rule applied: {rule.name}")
+    return likelihoods
+
+
+def load_deferred_floor() -> str:
+    load_dotenv()
+    floor = os.getenv("LIKELIHOOD_DEFERRED_FLOOR", "maybe").strip().lower()
+    if floor not in LIKELIHOOD_ORDER:
+        raise ValueError(f"Invalid LIKELIHOOD_DEFERRED_FLOOR: {floor}. Valid values are: {', '.join(LIKELIHOOD_ORDER)}")
+    return floor
+
+
+def defer_to_review(parsed_completion: Dict[str, Any], likelihoods: Dict[str, str]) -> Dict[str, str]:
+    """
+    Raises every type to LIKELIHOOD_DEFERRED_FLOOR and queues the file for review, with the model's reasoning.
+    The file is the one of the current telemetry_context().
+    Returns:
+        Dict[str, str]: The likelihoods to generate with.
+    """
+    floor = load_deferred_floor()
+    generated = {report_type: likelihood if LIKELIHOOD_ORDER[likelihood] >= LIKELIHOOD_ORDER[floor] else floor
+                 for report_type, likelihood in likelihoods.items()}
+    load_dotenv()
+    queue_path = os.getenv("LIKELIHOOD_REVIEW_QUEUE", "").strip() or REVIEW_QUEUE_FILENAME
+    entry = {
+        "timestamp": time.time(),
+        "file": current_telemetry_context().get("file"),
+        "model": parsed_completion,
+        "proposed": likelihoods,
+        "generated": generated,
+    }
+    # One line per append, so workers in several processes can share the queue
+    with open(queue_path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return generated
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def report_paths(artifacts_dir: str, filename: str, report_type: str) -> List[str]:
+    """The saved variants of one report type of a file (see save_generated_reports)."""
+    pattern = os.path.join(artifacts_dir, "*", glob.escape(f"{filename}_as_{report_type}_") + "*.json")
+    return sorted(glob.glob(pattern))
+
+
+def pending_reviews(artifacts_dir: str) -> List[Dict[str, Any]]:
+    """The latest queue entry of each file that has no decision yet."""
+    decided = {decision["file"] for decision in _read_jsonl(os.path.join(artifacts_dir, REVIEW_DECISIONS_FILENAME))}
+    latest = {entry["file"]: entry for entry in _read_jsonl(os.path.join(artifacts_dir, REVIEW_QUEUE_FILENAME))}
+    return [entry for filename, entry in sorted(latest.items()) if filename not in decided]
+
+
+def apply_review(artifacts_dir: str, drops: Set[tuple]) -> Dict[str, int]:
+    """
+    Decides every pending file at once: the (file, report type) pairs in `drops` are moved to dropped/, the rest
+    are approved.
+    Returns:
+        Dict[str, int]: Counts of the files decided and the reports kept and dropped.
+    """
+    counts = {"files": 0, "kept": 0, "dropped": 0}
+    with open(os.path.join(artifacts_dir, REVIEW_DECISIONS_FILENAME), "a", encoding="utf-8") as decisions:
+        for entry in pending_reviews(artifacts_dir):
+            filename, dropped_types = entry["file"], []
+            for report_type in entry["generated"]:
+                paths = report_paths(artifacts_dir, filename, report_type)
+                if (filename, report_type) not in drops:
+                    counts["kept"] += len(paths)
+                    continue
+                dropped_types.append(report_type)
+                for path in paths:
+                    target_dir = os.path.join(artifacts_dir, DROPPED_DIRNAME, os.path.basename(os.path.dirname(path)))
+                    os.makedirs(target_dir, exist_ok=True)
+                    shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+                    counts["dropped"] += 1
+            decisions.write(json.dumps({"timestamp": time.time(), "file": filename, "dropped": dropped_types}) + "\n")
+            counts["files"] += 1
+    return counts
+
+
+def _parse_drop(value: str) -> tuple:
+    filename, _, report_type = value.rpartition(":")
+    if not filename or not report_type:
+        raise ValueError(f"Invalid drop: {value}. Expected <file>:<report type>, e.g. report.xml:DNS")
+    return filename, report_type
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Review the report types generated under the deferred policy.")
+    parser.add_argument("command", choices=["review"])
+    parser.add_argument("artifacts_dir")
+    parser.add_argument("--drop", nargs="*", default=[], help="<file>:<report type> pairs to drop.")
+    parser.add_argument("--drop-rated", nargs="*", default=[], choices=list(LIKELIHOOD_ORDER),
+                        help="Drop every type the model rated this way, e.g. --drop-rated no.")
+    parser.add_argument("--approve-all", action="store_true", help="Keep everything that is not dropped explicitly.")
+    args = parser.parse_args()
+
+    artifacts_dir = os.path.abspath(args.artifacts_dir)
+    pending = pending_reviews(artifacts_dir)
+    if not pending:
+        print("Nothing to review.")
+        return
+    drops = {_parse_drop(value) for value in args.drop}
+    for entry in pending:
+        for report_type, conclusion in entry["model"].items():
+            if conclusion["conclusion"] in args.drop_rated:
+                drops.add((entry["file"], report_type))
+
+    if not (args.drop or args.drop_rated or args.approve_all):
+        for entry in pending:
+            print(f"\n{entry['file']}")
+            for report_type, conclusion in entry["model"].items():
+                variants = len(report_paths(artifacts_dir, entry["file"], report_type))
+                print(f"  {report_type}: model says {conclusion['conclusion']}, {variants} variants. "
+                      f"{conclusion['reasoning']}")
+        print("\nEnter the <file>:<report type> pairs to drop, separated by spaces (empty: keep everything):")
+        drops = {_parse_drop(value) for value in input().split()}
+
+    counts = apply_review(artifacts_dir, drops)
+    print(f"Reviewed {counts['files']} files: kept {counts['kept']} reports, dropped {counts['dropped']} "
+          f"(moved to {os.path.join(artifacts_dir, DROPPED_DIRNAME)})")
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
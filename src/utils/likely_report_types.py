@@ -1,10 +1,20 @@
+import asyncio
 import json
-from typing import Dict, Literal, List, Any
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Set
 from pydantic import BaseModel, Field
 
-from src.utils.azure_client_utils import ask_with_schema, get_client_and_deployment_name
+from src.utils.azure_client_utils import ask_with_schema, ask_with_schema_async, get_client_and_deployment_name
+from src.utils.likelihood_policies import apply_rules, defer_to_review
+from src.utils.prompt_builder import PromptLayout
+from src.utils.telemetry import current_telemetry_context, telemetry_context
 from src.utils.utils import describe_LDAP, describe_report_properties
 
+# How the model's conclusions are confirmed: by asking the operator, or by a policy that never asks anyone
+# (unattended runs, see src.utils.likelihood_policies)
+LIKELIHOOD_POLICIES = ("interactive", "auto", "rules", "deferred")
+
 
 class LDAPLikelihoodSchema(BaseModel):
     """How likely is it that a user's description of a report is about an LDAP report."""
@@ -56,9 +66,13 @@ class ReportTypeHints(BaseModel):
     )
 
 
-def get_prompt_about_likely_report_types(quest_report_str, extracted_data) -> str:
+LIKELIHOOD_SYSTEM_PROMPT = "You are a helpful assistant that analyzes reports and determines what kinds of report they could be. You pay attention to functionality, fields names etc."
+
+
+def get_prompt_about_likely_report_types(quest_report_str, extracted_data) -> PromptLayout:
     """
-    Returns the system message prompt for determining likely report types.
+    Returns the prompt for determining likely report types.
+    The static descriptions of the 3 kinds come first, so they form a prefix shared by every file.
     """
     result_example = str(
         {
@@ -77,34 +91,32 @@ def get_prompt_about_likely_report_types(quest_report_str, extracted_data) -> st
         }
     )
 
-    prompt = f"""
-I can produce 3 kinds of reports: LDAP, DNS and NonDNS. Here is some information about the 3 kinds:
+    knowledge = f"""I can produce 3 kinds of reports: LDAP, DNS and NonDNS. Here is some information about the 3 kinds:
 
 # LDAP:
 {describe_LDAP()}
 
 # DNS and NonDNS:
-{describe_report_properties(report_type="both", filters_or_displays="both")}
-
-For each of these 3 kinds (LDAP, DNS, NonDNS), I'd like you look at the following XML report template- and tell me how likely it is to be of that kind.
-For example, if it might be LDAP, definitely not DNS and very likely NonDNS, then return: {result_example}.
+{describe_report_properties(report_type="both", filters_or_displays="both")}"""
 
-Here's the report template:
-<The XML file starts here>
-{quest_report_str}
-<The XML file ends here>
-
-Here's some extracted information about the report:
-{extracted_data}
+    working_process = """For each of these 3 kinds (LDAP, DNS, NonDNS), I'd like you look at the XML report template I'll give you- and tell me how likely it is to be of that kind.
 
 Here's your working process:
 1. Read the report template.
 2. Analyze the content of the report template.
 3. Determine if the report is likely to be LDAP, DNS, or NonDNS based on the content.
 4. Return a dictionary with keys "LDAP", "DNS", and "NonDNS" and values "yes", "no", or "maybe" based on your analysis.
-5. You may add comments to your response in the designated fields.
-"""
-    return prompt
+5. You may add comments to your response in the designated fields."""
+
+    return PromptLayout(
+        system=LIKELIHOOD_SYSTEM_PROMPT,
+        knowledge=(knowledge, working_process),
+        schema=f"For example, if it might be LDAP, definitely not DNS and very likely NonDNS, then return: {result_example}.",
+        document=(
+            f"Here's the report template:\n<The XML file starts here>\n{quest_report_str}\n<The XML file ends here>",
+            f"Here's some extracted information about the report:\n{extracted_data}",
+        ),
+    )
 
 
 def complete_likelihoods(
@@ -129,9 +141,10 @@ def complete_likelihoods(
     # )
     # return mocked_response
 
-    parsed_json = ask_with_schema(system_prompt=system_message,
-                                  prompt=prompt,
-                                  schema=answer_format)
+    with telemetry_context(stage="likelihood"):
+        parsed_json = ask_with_schema(system_prompt=system_message,
+                                      prompt=prompt,
+                                      schema=answer_format)
     return parsed_json
     # client, deployment_name = get_client_and_deployment_name()
 
@@ -166,6 +179,12 @@ def complete_likelihoods(
     # return parsed_json
 
 
+async def complete_likelihoods_async(system_message, prompt, answer_format):
+    """Async version of complete_likelihoods()."""
+    with telemetry_context(stage="likelihood"):
+        return await ask_with_schema_async(system_prompt=system_message, prompt=prompt, schema=answer_format)
+
+
 def ask_user_for_type_confirmation(assumed_type: str, likelihood: str, reasoning: str):
     likelihood_phrasing = {
         "yes": "is probably (=2)",
@@ -188,6 +207,28 @@ Do you agree with this conclusion? Enter 0=no, 1=maybe, or 2=yes, empty response
     return the_user_thinks[user_input]
 
 
+_open_prompts = 0  # Operator prompts waiting for an answer, see operator_prompt()
+_open_prompts_lock = threading.Lock()
+
+
+@contextmanager
+def operator_prompt() -> Iterator[None]:
+    """Marks the block as waiting for the operator's answers, so that status lines hold back meanwhile."""
+    global _open_prompts
+    with _open_prompts_lock:
+        _open_prompts += 1
+    try:
+        yield
+    finally:
+        with _open_prompts_lock:
+            _open_prompts -= 1
+
+
+def is_operator_prompt_open() -> bool:
+    """Whether the operator is being asked something, e.g. by confirm_with_user()."""
+    return _open_prompts > 0
+
+
 def confirm_with_user(parsed_completion: Dict[str, Any]) -> Dict[str, Any]:
     """
     Confirm the parsed completion with the user.
@@ -197,28 +238,82 @@ def confirm_with_user(parsed_completion: Dict[str, Any]) -> Dict[str, Any]:
     # Here you can implement a confirmation step with the user if needed
     # For example, you could print the result and ask for confirmation
     result = {}
-    for key, value in parsed_completion.items():
-        likelihood = value["conclusion"]
-        reasoning = value["reasoning"]
-        user_wants = ask_user_for_type_confirmation(key, likelihood, reasoning)
+    with operator_prompt():
+        for key, value in parsed_completion.items():
+            likelihood = value["conclusion"]
+            reasoning = value["reasoning"]
+            user_wants = ask_user_for_type_confirmation(key, likelihood, reasoning)
 
-        result[key] = user_wants
+            result[key] = user_wants
     return result
 
 
+def accept_conclusions(parsed_completion: Dict[str, Any]) -> Dict[str, Any]:
+    """Takes the model's conclusions as they are, without asking anyone."""
+    return {key: value["conclusion"] for key, value in parsed_completion.items()}
+
+
+def check_likelihood_policy(policy: str) -> None:
+    if policy not in LIKELIHOOD_POLICIES:
+        raise ValueError(f"Invalid likelihood policy: {policy}. Valid policies are: {', '.join(LIKELIHOOD_POLICIES)}")
+
+
+def apply_likelihood_policy(
+    parsed_completion: Dict[str, Any], policy: str, quest_report_str: str, extracted_data: str,
+    events_found: Optional[Set[str]] = None
+) -> Dict[str, Any]:
+    """The likelihoods a non-interactive policy decides on, from the model's conclusions."""
+    conclusions = accept_conclusions(parsed_completion)
+    if policy == "auto":
+        return conclusions
+    if policy == "rules":
+        return apply_rules(conclusions, quest_report_str, extracted_data, events_found)
+    # "deferred": the rules, if any, then a human reviews whatever is generated
+    return defer_to_review(parsed_completion, apply_rules(conclusions, quest_report_str, extracted_data, events_found))
+
+
 def get_likely_report_types(
-    quest_report_str: str, extracted_data: str
+    quest_report_str: str, extracted_data: str, policy: str = "interactive", events_found: Optional[Set[str]] = None
 ) -> Dict[Literal["LDAP", "DNS", "NonDNS"], Literal["yes", "no", "maybe"]]:
     """
     Analyzes the quest report string and determines the likely report types.
     Args:
         quest_report_str (str): The string representation of the quest report.
         extracted_data (str): Additional data extracted from the report as free text.
+        policy (str): "interactive" to have the operator confirm each conclusion, otherwise one of the policies
+            of src.utils.likelihood_policies: "auto", "rules" or "deferred".
+        events_found (Optional[Set[str]]): The names of the events in the report, for the rules.
     """
-    # Analyze the quest_report_str and determine the likely report types
-    # For now, we'll return a dummy implementation
-    system_message = "You are a helpful assistant that analyzes reports and determines what kinds of report they could be. You pay attention to functionality, fields names etc."
-    prompt = get_prompt_about_likely_report_types(quest_report_str, extracted_data)
-    parsed_completion = complete_likelihoods(system_message, prompt, answer_format=ReportTypeHints)
+    check_likelihood_policy(policy)
+    layout = get_prompt_about_likely_report_types(quest_report_str, extracted_data)
+    parsed_completion = complete_likelihoods(layout.system_prompt, layout.user_prompt, answer_format=ReportTypeHints)
+    if policy != "interactive":
+        return apply_likelihood_policy(parsed_completion, policy, quest_report_str, extracted_data, events_found)
     the_user_confirmed_likelihood = confirm_with_user(parsed_completion)
     return the_user_confirmed_likelihood
+
+
+async def get_likely_report_types_async(
+    quest_report_str: str, extracted_data: str, policy: str = "interactive", events_found: Optional[Set[str]] = None,
+    on_conclusions: Optional[Callable[[Dict[str, str]], None]] = None
+) -> Dict[Literal["LDAP", "DNS", "NonDNS"], Literal["yes", "no", "maybe"]]:
+    """
+    Async version of get_likely_report_types(). The operator's confirmation, if any, runs in a thread so it does
+    not block the event loop.
+    Args:
+        on_conclusions (Optional[Callable[[Dict[str, str]], None]]): Called with the model's conclusions before the
+            operator is asked, e.g. to start generating speculatively (see SpeculativeReports).
+    """
+    check_likelihood_policy(policy)
+    layout = get_prompt_about_likely_report_types(quest_report_str, extracted_data)
+    parsed_completion = await complete_likelihoods_async(layout.system_prompt, layout.user_prompt,
+                                                         answer_format=ReportTypeHints)
+    if on_conclusions is not None:
+        on_conclusions(accept_conclusions(parsed_completion))
+    if policy != "interactive":
+        return apply_likelihood_policy(parsed_completion, policy, quest_report_str, extracted_data, events_found)
+    # Other files may be in flight, so say which one the questions are about
+    print(f'\n{"#" * 50}\nReport types of: {current_telemetry_context().get("file")}\n{"#" * 50}')
+    return await asyncio.to_thread(confirm_with_user, parsed_completion)
+
+# fin.
@@ -0,0 +1,251 @@
+"""
+A persistent, content-addressed cache of LLM replies, stored in SQLite.
+
+Entries are keyed by a hash of (deployment, system prompt, prompt, schema JSON, temperature) and evicted
+least-recently-used first once the cache grows beyond its size limit, or once they are older than the age limit.
+SQLite's WAL mode and busy timeout make the cache safe to share between threads and worker processes.
+
+Configuration (environment / .env):
+    LLM_CACHE_MODE              "use" (default): read and write, "refresh": write only, "bypass": neither
+    LLM_CACHE_ALL_TEMPERATURES  "1" to also cache calls with temperature > 0 (default: only temperature 0)
+    LLM_CACHE_PATH              SQLite file (default: .llm_cache/responses.sqlite)
+    LLM_CACHE_MAX_MB            Size limit in MB (default: 512)
+    LLM_CACHE_MAX_AGE_DAYS      Age limit in days (default: 30)
+
+Inspect or clear the cache from the project root:
+    python -m src.utils.llm_cache stats|clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Literal, Optional
+
+from dotenv import load_dotenv
+
+CacheMode = Literal["use", "refresh", "bypass"]
+
+DEFAULT_CACHE_PATH = os.path.join(".llm_cache", "responses.sqlite")
+EVICTION_CHECK_INTERVAL = 50  # Check the size limit once every this many writes
+
+
+class LLMCache:
+    """An on-disk LRU cache of LLM replies."""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        mode: CacheMode = "use",
+        cache_all_temperatures: bool = False,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_age_seconds: float = 30 * 24 * 3600,
+    ):
+        self.path = path
+        self.mode = mode
+        self.cache_all_temperatures = cache_all_temperatures
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        self._counters_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(
+        deployment_name: str,
+        system_prompt: str,
+        prompt: str,
+        schema_json: Optional[str],
+        temperature: float,
+        **extra,
+    ) -> str:
+        """
+        Hashes everything that determines a reply into a cache key.
+        Extra keyword arguments (e.g. the number of samples) are included when given.
+        """
+        material = json.dumps(
+            {
+                "deployment": deployment_name,
+                "system": system_prompt,
+                "prompt": prompt,
+                "schema": schema_json,
+                "temperature": float(temperature),
+                **extra,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, counter: str) -> None:
+        with self._counters_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def should_cache(self, temperature: float) -> bool:
+        """Whether a call with this temperature takes part in caching at all."""
+        return self.mode != "bypass" and (self.cache_all_temperatures or temperature == 0)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached reply for the key, or None on a miss (or in refresh mode).
+        Expired entries count as misses.
+        """
+        if self.mode != "use":
+            return None
+
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or now - row[1] > self.max_age_seconds:
+            self._count("misses")
+            return None
+
+        connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Stores a reply, evicting old entries now and then to stay within the limits."""
+        if self.mode == "bypass":
+            return
+
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), now, now),
+        )
+        self._count("writes")
+        if self.writes % EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Removes expired entries, then least-recently-used entries until the cache fits its size limit.
+        Returns:
+            int: The number of entries removed.
+        """
+        connection = self._connection()
+        removed = connection.execute(
+            "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+        ).rowcount
+
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size > self.max_bytes:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+                for key, size in rows:
+                    if total_size <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total_size -= size
+                    removed += 1
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        with self._counters_lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns this process's hit/miss/write/eviction counters, plus the cache's current entries and size.
+        """
+        entries, total_size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        with self._counters_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": total_size,
+            }
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Returns the process-wide LLM cache, configured from the environment on first use."""
+    global _cache
+    if _cache is not None:
+        return _cache
+
+    with _cache_lock:
+        if _cache is None:
+            load_dotenv()
+            mode = os.getenv("LLM_CACHE_MODE", "use").strip().lower()
+            if mode not in ("use", "refresh", "bypass"):
+                raise ValueError(f"Invalid LLM_CACHE_MODE: {mode}. Valid modes are: use, refresh, bypass")
+            _cache = LLMCache(
+                path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                mode=mode,
+                cache_all_temperatures=os.getenv("LLM_CACHE_ALL_TEMPERATURES", "0").strip() == "1",
+                max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", 512)) * 1024 * 1024),
+                max_age_seconds=float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", 30)) * 24 * 3600,
+            )
+    return _cache
+
+
+def set_llm_cache_mode(mode: CacheMode) -> None:
+    """Switches the process-wide cache between use, refresh and bypass."""
+    get_llm_cache().mode = mode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM response cache.")
+    parser.add_argument("command", choices=["stats", "clear", "evict"])
+    args = parser.parse_args()
+
+    cache = get_llm_cache()
+    if args.command == "clear":
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    elif args.command == "evict":
+        print(f"Evicted {cache.evict()} entries from {cache.path}")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
@@ -0,0 +1,73 @@
+"""
+Model tiering: the deployment and temperature each stage of the pipeline runs on.
+
+Not every stage needs the largest model. The likelihood classification and the mostly constant metadata can run on
+a smaller, cheaper and faster deployment, while content generation stays on the large one. A stage can also name
+a deployment to escalate to: when a reply of the stage's model does not match its schema, the call is repeated
+once on the escalation deployment (see ask_with_schema in src.utils.azure_client_utils).
+
+The stage of a call is taken from its telemetry_context() (see src.utils.telemetry), which every stage already
+sets. Calls outside a known stage use the default deployment.
+
+Configuration (environment / .env), per stage (EXTRACTION, LIKELIHOOD, LDAP_QUERY, CONTENT, METADATA):
+    LLM_MODEL_<STAGE>           The stage's deployment (default: the default deployment)
+    LLM_TEMPERATURE_<STAGE>     A fixed temperature for the stage's calls (default: the temperature each call asks
+                                for; content variants differ by temperature, so this is mostly for the other stages)
+    LLM_ESCALATE_<STAGE>        The deployment to repeat a call on when its reply fails schema validation
+e.g. LLM_MODEL_LIKELIHOOD=gpt-4o-mini, LLM_ESCALATE_LIKELIHOOD=gpt-4o
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from src.utils.telemetry import current_telemetry_context
+
+STAGES = ("extraction", "likelihood", "ldap_query", "content", "metadata")
+
+
+@dataclass(frozen=True)
+class StageTier:
+    """Data class to hold the model policy of a pipeline stage."""
+    deployment_name: str
+    temperature: Optional[float] = None  # Overrides the temperature of the stage's calls
+    escalate_to: Optional[str] = None  # Deployment to repeat a call on when its reply fails schema validation
+
+    def temperature_for(self, requested: float) -> float:
+        return requested if self.temperature is None else self.temperature
+
+
+_tiers: Dict[str, Dict[str, StageTier]] = {}  # Default deployment -> stage -> tier
+_tiers_lock = threading.Lock()
+
+
+def load_stage_tiers(default_deployment: str) -> Dict[str, StageTier]:
+    load_dotenv()
+    tiers = {}
+    for stage in STAGES:
+        prefix = stage.upper()
+        temperature = os.getenv(f"LLM_TEMPERATURE_{prefix}", "").strip()
+        tiers[stage] = StageTier(
+            deployment_name=os.getenv(f"LLM_MODEL_{prefix}", "").strip() or default_deployment,
+            temperature=float(temperature) if temperature else None,
+            escalate_to=os.getenv(f"LLM_ESCALATE_{prefix}", "").strip() or None,
+        )
+    return tiers
+
+
+def get_stage_tier(default_deployment: str, stage: Optional[str] = None) -> StageTier:
+    """
+    Returns the tier of a stage, by default of the stage in the current telemetry context.
+    Args:
+        default_deployment (str): The deployment of stages (and calls) without a tier of their own.
+    """
+    stage = stage or current_telemetry_context().get("stage")
+    tiers = _tiers.get(default_deployment)
+    if tiers is None:
+        with _tiers_lock:
+            tiers = _tiers.setdefault(default_deployment, load_stage_tiers(default_deployment))
+    return tiers.get(stage) or StageTier(deployment_name=default_deployment)
+
+# fin.
@@ -0,0 +1,53 @@
+"""
+Lays out prompts so that requests share the longest possible identical prefix.
+
+Azure OpenAI caches the processed prefix of recent prompts (from 1024 tokens on) and bills the cached part at a
+discount, with lower latency. A prefix is only reused if it is byte-identical, so every request is ordered from
+the most shared part to the least shared one:
+
+    1. static system text        the same for every call of a stage
+    2. static knowledge          filter / display field descriptions, examples, working process
+    3. schema                    the expected reply format
+    4. per-file document         the (minified) XML template and what was extracted from it
+    5. per-variant instructions  whatever differs between the variants of one file, e.g. generated content
+
+Parts 1-3 go into the system message and parts 4-5 into the user message, so the system message of a stage is
+identical across files and temperatures.
+
+The cached-token counts the API reports are recorded by the telemetry (cached_tokens), see src.utils.telemetry.
+"""
+from dataclasses import dataclass
+from typing import Sequence, Tuple
+
+SECTION_SEPARATOR = "\n\n"
+
+
+def _join(sections: Sequence[str]) -> str:
+    return SECTION_SEPARATOR.join(section.strip("\n") for section in sections if section and section.strip())
+
+
+@dataclass(frozen=True)
+class PromptLayout:
+    """The parts of a request, from the most shared to the least shared."""
+    system: str
+    knowledge: Tuple[str, ...] = ()
+    schema: str = ""
+    document: Tuple[str, ...] = ()
+    instructions: Tuple[str, ...] = ()
+
+    @property
+    def system_prompt(self) -> str:
+        """The static prefix: system text, knowledge and schema."""
+        return _join((self.system, *self.knowledge, self.schema))
+
+    @property
+    def user_prompt(self) -> str:
+        """The per-file document followed by the per-variant instructions."""
+        return _join((*self.document, *self.instructions))
+
+
+def tagged(tag: str, content: str) -> str:
+    """Wraps per-file content in a tag, so the model can tell where it starts and ends."""
+    return f"<{tag}>\n{content}\n</{tag}>"
+
+# fin.
@@ -0,0 +1,395 @@
+"""
+Quota-aware scheduling of Azure OpenAI calls.
+
+A RateLimitScheduler sits in front of every chat-completions call and:
+- enforces requests-per-minute and tokens-per-minute budgets with token buckets, using an up-front estimate
+  of each request's tokens (corrected with the reported usage once the reply arrives);
+- bounds in-flight calls with an AIMD concurrency limit: +1 slot per window of successful calls, halved on
+  throttling, so sustained throughput settles just under the deployment's quota;
+- retries throttled / timed-out / failed calls, honouring Retry-After and otherwise backing off exponentially
+  with full jitter.
+Streamed calls (stream() / stream_async()) hold their slot until the stream has been read to the end, and correct
+the token budget with the usage of its final chunk. They are retried only while no token has been handed out.
+
+Configuration (environment / .env):
+    AZURE_RPM_LIMIT, AZURE_TPM_LIMIT    Deployment quota (0 = unlimited, the default)
+    LLM_MAX_CONCURRENCY                 Upper bound of the adaptive concurrency limit
+    LLM_MIN_CONCURRENCY                 Lower bound of the adaptive concurrency limit (default 1)
+    LLM_MAX_RETRIES                     Retries per call (default 6)
+    LLM_ESTIMATED_COMPLETION_TOKENS     Completion tokens assumed up front (default 1000)
+    LLM_QUOTA_SHARE                     Fraction of the RPM / TPM quota this process may use (default 1), set by
+                                        the worker pool (see src.pipeline.worker_pool) so workers share the quota
+"""
+import asyncio
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+T = TypeVar("T")
+
+CHARS_PER_TOKEN = 4  # Rough average for English text and XML
+MESSAGE_OVERHEAD_TOKENS = 4
+POLL_INTERVAL = 0.05  # Seconds between attempts to get a slot / budget
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens in a text without a tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_request_tokens(completion_arguments: dict, completion_tokens: int) -> int:
+    """
+    Estimates the tokens a chat-completions request will be charged for: its messages, its tool
+    definitions and the completion tokens assumed up front.
+    """
+    prompt_tokens = sum(
+        estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        for message in completion_arguments.get("messages", [])
+    )
+    if completion_arguments.get("tools"):
+        prompt_tokens += estimate_tokens(json.dumps(completion_arguments["tools"]))
+    return prompt_tokens + completion_tokens * completion_arguments.get("n", 1)
+
+
+class TokenBucket:
+    """A thread-safe token bucket refilled continuously at `capacity` tokens per minute."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.capacity / 60.0)
+        self._updated_at = now
+
+    def try_take(self, amount: float) -> float:
+        """
+        Takes `amount` tokens if available.
+        Requests bigger than the bucket are let through once the bucket is full.
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds to wait before trying again.
+        """
+        if self.capacity <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= amount
+                return 0.0
+            return (needed - self._tokens) * 60.0 / self.capacity
+
+    def give_back(self, amount: float) -> None:
+        """Returns tokens that were over-estimated (or takes more, if `amount` is negative)."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class AIMDConcurrencyLimit:
+    """
+    An additive-increase / multiplicative-decrease bound on in-flight calls.
+    The limit grows by one after `limit` consecutive successes and is halved on throttling,
+    at most once per `decrease_cooldown` seconds so one burst of 429s counts as one signal.
+    """
+
+    def __init__(self, minimum: int, maximum: int, decrease_factor: float = 0.5, decrease_cooldown: float = 5.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def cancel(self) -> None:
+        """Frees a slot without treating the call as a success or a failure."""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def release(self, throttled: bool = False) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if throttled:
+                self.throttle_events += 1
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+
+@dataclass
+class RateLimitSettings:
+    """Data class to hold the quota and retry settings of a deployment."""
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+    min_concurrency: int = 1
+    max_concurrency: int = 8
+    max_retries: int = 6
+    estimated_completion_tokens: int = 1000
+    backoff_base: float = 1.0  # Seconds
+    backoff_max: float = 60.0  # Seconds
+    quota_share: float = 1.0  # Fraction of the quota this process may use, when several processes share it
+
+
+class RateLimitScheduler:
+    """Admits, retries and paces chat-completions calls for one deployment."""
+
+    def __init__(self, settings: RateLimitSettings):
+        self.settings = settings
+        self.requests_bucket = TokenBucket(settings.requests_per_minute * settings.quota_share)
+        self.tokens_bucket = TokenBucket(settings.tokens_per_minute * settings.quota_share)
+        self.concurrency = AIMDConcurrencyLimit(settings.min_concurrency, settings.max_concurrency)
+        self.retries = 0
+
+    def _try_admit(self, estimated_tokens: int) -> float:
+        """
+        Tries to take a concurrency slot and the request / token budget for one call.
+        Returns:
+            float: 0 if admitted, otherwise the seconds to wait before trying again.
+        """
+        if not self.concurrency.try_acquire():
+            return POLL_INTERVAL
+        wait = self.requests_bucket.try_take(1)
+        if wait == 0:
+            wait = self.tokens_bucket.try_take(estimated_tokens)
+            if wait > 0:
+                self.requests_bucket.give_back(1)
+        if wait > 0:
+            self.concurrency.cancel()
+        return wait
+
+    def acquire(self, estimated_tokens: int) -> None:
+        while (wait := self._try_admit(estimated_tokens)) > 0:
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, estimated_tokens: int) -> None:
+        while (wait := self._try_admit(estimated_tokens)) > 0:
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None, throttled: bool = False) -> None:
+        """Frees the call's slot and corrects the token budget with the usage the API reported."""
+        if actual_tokens is not None:
+            self.tokens_bucket.give_back(estimated_tokens - actual_tokens)
+        self.concurrency.release(throttled=throttled)
+
+    def backoff_delay(self, error: Exception, attempt: int) -> float:
+        """Seconds to wait before retrying: the server's Retry-After if given, otherwise jittered exponential backoff."""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.settings.backoff_base)
+        return random.uniform(0, min(self.settings.backoff_max, self.settings.backoff_base * 2 ** attempt))
+
+    def call(self, estimated_tokens: int, create: Callable[[], T]) -> T:
+        """Runs a synchronous chat-completions call under the budgets, retrying transient failures."""
+        for attempt in range(self.settings.max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                response = create()
+            except RETRYABLE_ERRORS as error:
+                self.release(estimated_tokens, throttled=is_throttling(error))
+                if attempt == self.settings.max_retries:
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff_delay(error, attempt))
+                continue
+            except BaseException:
+                self.release(estimated_tokens)
+                raise
+            self.release(estimated_tokens, usage_tokens(response))
+            return response
+
+    def stream(self, estimated_tokens: int, create: Callable[[], Iterable[T]],
+               is_token: Callable[[T], bool]) -> Iterator[T]:
+        """
+        Runs a streaming chat-completions call under the budgets, yielding its chunks. The slot is held until the
+        stream ends, fails or is closed. A failure before the first chunk for which is_token() is true is retried,
+        a later one is raised, since the consumer already has part of the reply.
+        """
+        for attempt in range(self.settings.max_retries + 1):
+            self.acquire(estimated_tokens)
+            started = False
+            actual_tokens = None
+            stream = None
+            try:
+                stream = create()
+                for chunk in stream:
+                    actual_tokens = usage_tokens(chunk) or actual_tokens
+                    started = started or is_token(chunk)
+                    yield chunk
+            except STREAM_RETRYABLE_ERRORS as error:
+                self.release(estimated_tokens, throttled=is_throttling(error))
+                if started or attempt == self.settings.max_retries:
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff_delay(error, attempt))
+                continue
+            except BaseException:
+                # Includes closing the generator early: the slot must be freed either way
+                self.release(estimated_tokens)
+                raise
+            finally:
+                if stream is not None and hasattr(stream, "close"):
+                    stream.close()  # Gives the HTTP connection back
+            self.release(estimated_tokens, actual_tokens)
+            return
+
+    async def stream_async(self, estimated_tokens: int, create: Callable[[], Awaitable[AsyncIterable[T]]],
+                           is_token: Callable[[T], bool]) -> AsyncIterator[T]:
+        """Like stream(), for async streaming calls."""
+        for attempt in range(self.settings.max_retries + 1):
+            await self.acquire_async(estimated_tokens)
+            started = False
+            actual_tokens = None
+            stream = None
+            try:
+                stream = await create()
+                async for chunk in stream:
+                    actual_tokens = usage_tokens(chunk) or actual_tokens
+                    started = started or is_token(chunk)
+                    yield chunk
+            except STREAM_RETRYABLE_ERRORS as error:
+                self.release(estimated_tokens, throttled=is_throttling(error))
+                if started or attempt == self.settings.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff_delay(error, attempt))
+                continue
+            except BaseException:
+                self.release(estimated_tokens)
+                raise
+            finally:
+                if stream is not None and hasattr(stream, "close"):
+                    await stream.close()
+            self.release(estimated_tokens, actual_tokens)
+            return
+
+    async def call_async(self, estimated_tokens: int, create: Callable[[], Awaitable[T]]) -> T:
+        """Runs an async chat-completions call under the budgets, retrying transient failures."""
+        for attempt in range(self.settings.max_retries + 1):
+            await self.acquire_async(estimated_tokens)
+            try:
+                response = await create()
+            except RETRYABLE_ERRORS as error:
+                self.release(estimated_tokens, throttled=is_throttling(error))
+                if attempt == self.settings.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff_delay(error, attempt))
+                continue
+            except BaseException:
+                # Includes cancellation: the slot must be freed either way
+                self.release(estimated_tokens)
+                raise
+            self.release(estimated_tokens, usage_tokens(response))
+            return response
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "throttle_events": self.concurrency.throttle_events,
+            "retries": self.retries,
+        }
+
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# A stream that breaks off raises the HTTP client's errors as they are, not the API's
+STREAM_RETRYABLE_ERRORS = RETRYABLE_ERRORS + (httpx.TransportError,)
+
+
+def is_throttling(error: Exception) -> bool:
+    """429s and timeouts both mean the deployment is saturated."""
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError))
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads the retry-after-ms / Retry-After header of a failed call, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def load_rate_limit_settings() -> RateLimitSettings:
+    load_dotenv()
+    return RateLimitSettings(
+        requests_per_minute=int(os.getenv("AZURE_RPM_LIMIT", RateLimitSettings.requests_per_minute)),
+        tokens_per_minute=int(os.getenv("AZURE_TPM_LIMIT", RateLimitSettings.tokens_per_minute)),
+        min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", RateLimitSettings.min_concurrency)),
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", RateLimitSettings.max_concurrency)),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", RateLimitSettings.max_retries)),
+        estimated_completion_tokens=int(
+            os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", RateLimitSettings.estimated_completion_tokens)),
+        quota_share=float(os.getenv("LLM_QUOTA_SHARE", RateLimitSettings.quota_share)),
+    )
+
+
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_rate_limit_scheduler(name: str = "default", settings: Optional[RateLimitSettings] = None) -> RateLimitScheduler:
+    """
+    Returns the process-wide scheduler of a deployment, creating it on first use.
+    Args:
+        name (str): The deployment (or endpoint) the scheduler guards.
+        settings (Optional[RateLimitSettings]): Settings for a new scheduler. Defaults to the environment's.
+    """
+    scheduler = _schedulers.get(name)
+    if scheduler is not None:
+        return scheduler
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = RateLimitScheduler(settings or load_rate_limit_settings())
+        return _schedulers[name]
+
+# fin.
@@ -1,13 +1,26 @@
+import asyncio
 import json
+import os
 import re
-from typing import Any, Dict, Literal
+from dataclasses import dataclass
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+
+from dotenv import load_dotenv
 
 from pydantic import BaseModel, Field
 
-from src.reports_generators.DNS import dns_post_process, get_dns_content, get_dns_meta
-from src.reports_generators.NonDNS import get_nondns_content, get_nondns_meta, nondns_post_process
-from src.reports_generators.LDAP import get_ldap_content, get_ldap_meta, ldap_post_process
-from src.utils.azure_client_utils import ask_with_schema, get_client_and_deployment_name
+from src.reports_generators.DNS import dns_post_process, get_dns_content, get_dns_content_samples, get_dns_meta
+from src.reports_generators.NonDNS import (
+    get_nondns_content,
+    get_nondns_content_samples,
+    get_nondns_meta,
+    nondns_post_process,
+)
+from src.reports_generators.LDAP import get_ldap_content, get_ldap_content_samples, get_ldap_meta, ldap_post_process
+from src.utils.azure_client_utils import ask_with_schema_async
+from src.utils.prompt_builder import PromptLayout, tagged
+from src.utils.run_journal import get_file_journal
+from src.utils.telemetry import telemetry_context
 from src.utils.utils import describe_LDAP, describe_report_properties
 
 
@@ -33,23 +46,18 @@ Response format:{response_format}"""
     return res
 
 
+LDAP_QUERY_SYSTEM_PROMPT = "You're a helpful assistant that generates LDAP queries."
+
+
 def generate_ldap_request_prompt(
     xml_report_str: str,
     report_description: str  # This is a structured description of the original XML report, including filters and display fields
-) -> str:
+) -> PromptLayout:
     response_format = """{"confidence": "yes" / "maybe" / "no",
 "reasoning": "explain why you think this is an LDAP report or not",
 "ldap_query": Either way, do your best to generate an LDAP query that mimics this report in the best way you can.}"""
     
-    
-    return f"""Here is an XML report format:
-<report>
-{xml_report_str}
-</report>
-
-For your convenience, here is also a description of the report:
-{report_description}
-
+    knowledge = """I will give you an XML report format and a description of it.
 How confident are you that a similar report could, in principle, be generated from an LDAP query?
 
 Note: An LDAP query is a query that can be run against an Active Directory server to retrieve information about objects in the directory, such as users, computers, and groups.
@@ -66,20 +74,29 @@ Example 3: (&
 Example 4: (&
   (objectClass=group)
   (cn=*VPN*)
-)
-
-return your answer in this format:
-{response_format}
-"""
-
-def generate_ldap_query(
+)"""
+
+    # Static parts first, so they form a prefix shared by every file (see src.utils.prompt_builder)
+    return PromptLayout(
+        system=LDAP_QUERY_SYSTEM_PROMPT,
+        knowledge=(knowledge,),
+        schema=f"return your answer in this format:\n{response_format}",
+        document=(
+            f"Here is an XML report format:\n{tagged('report', xml_report_str)}",
+            f"For your convenience, here is also a description of the report:\n{report_description}",
+        ),
+    )
+
+async def generate_ldap_query(
     # client, deployment_name: str,
     xml_report_str: str, # This is the XML report string
     original_quest_report_description: str # This is a structured description of the original XML report, including filters and display fields
     ) -> str:
-    system_prompt = "You're a helpful assistant that generates LDAP queries."
-    prompt = generate_ldap_request_prompt(xml_report_str, original_quest_report_description)
-    parsed_json = ask_with_schema(system_prompt=system_prompt, prompt=prompt, schema=LDAPQueryAnsweringFormat)
+    layout = generate_ldap_request_prompt(xml_report_str, original_quest_report_description)
+    with telemetry_context(stage="ldap_query"):
+        parsed_json = await ask_with_schema_async(system_prompt=layout.system_prompt,
+                                                  prompt=layout.user_prompt,
+                                                  schema=LDAPQueryAnsweringFormat)
     
     # print(f"Confidence: {parsed_json['confidence']}"
     #       f"\nReasoning: {parsed_json['reasoning']}")
@@ -89,20 +106,21 @@ def generate_ldap_query(
 
 
 
-def generate_ldap_report(
+async def generate_ldap_report(
     quest_report_str: str,
     report_description: str, # This is the free text extracted from the report
     desired_report_description: str, # This is a description of the desired report, including filters and display fields
     temperature: float,
 ) -> str:
-    ldap_query = generate_ldap_query(xml_report_str=quest_report_str,
-                                     original_quest_report_description=report_description)
-    report_content = get_ldap_content(quest_report_str=quest_report_str,
-                                      report_description=report_description,
-                                      ldap_query=ldap_query,
-                                      description_of_an_ldap_report=desired_report_description,
-                                      temperature=temperature)
-    metadata = get_ldap_meta(quest_report_str=quest_report_str,
+    # Each step depends on the previous one: query -> content -> metadata
+    ldap_query = await generate_ldap_query(xml_report_str=quest_report_str,
+                                           original_quest_report_description=report_description)
+    report_content = await get_ldap_content(quest_report_str=quest_report_str,
+                                            report_description=report_description,
+                                            ldap_query=ldap_query,
+                                            description_of_an_ldap_report=desired_report_description,
+                                            temperature=temperature)
+    metadata = await get_ldap_meta(quest_report_str=quest_report_str,
                                    report_description=report_description,
                                    ldap_query=ldap_query,
                                    temperature=temperature,
@@ -114,20 +132,20 @@ def generate_ldap_report(
     return result
 
 
-def generate_dns_report(
+async def generate_dns_report(
     quest_report_str: str,
     report_description: str, # This is the free text extracted from the report
     desired_report_description: str, # This is a description of the desired report, including filters and display fields
     temperature: float,
 ) -> str:
-    report_content = get_dns_content(quest_report_str,
-                                     report_description,
-                                     desired_report_description,
-                                     temperature)
-    metadata = get_dns_meta(quest_report_str,
-                            report_description,
-                            temperature,
-                            report_content)
+    report_content = await get_dns_content(quest_report_str,
+                                           report_description,
+                                           desired_report_description,
+                                           temperature)
+    metadata = await get_dns_meta(quest_report_str,
+                                  report_description,
+                                  temperature,
+                                  report_content)
     result = {"Content": report_content,
               "MetaData": metadata,
               "SecurityReportSettings": None,
@@ -135,17 +153,17 @@ def generate_dns_report(
     return result
 
 
-def generate_nondns_report(
+async def generate_nondns_report(
     quest_report_str: str,
     report_description: str, # This is the free text extracted from the report
     desired_report_description: str, # This is a description of the desired report, including filters and display fields
     temperature: float,
 ) -> str:
-    report_content = get_nondns_content(quest_report_str,
-                                        report_description,
-                                        desired_report_description,
-                                        temperature)
-    metadata = get_nondns_meta(quest_report_str,
+    report_content = await get_nondns_content(quest_report_str,
+                                              report_description,
+                                              desired_report_description,
+                                              temperature)
+    metadata = await get_nondns_meta(quest_report_str,
                                      report_description,
                                      temperature,
                                      report_content)
@@ -156,6 +174,107 @@ def generate_nondns_report(
     return result
 
 
+# One report variant is generated per temperature
+TEMPERATURES_BY_LIKELIHOOD = {
+    "yes": [0, 0.2, 0.4],
+    "maybe": [0.1, 0.3],
+    "no": [],
+}
+
+
+SAMPLING_MODES = ("temperatures", "samples")
+
+
+@dataclass(frozen=True)
+class SamplingPlan:
+    """Data class to hold how many variants one request should sample, and at which temperature."""
+    samples: int
+    temperature: float
+
+
+# In "samples" mode, all variants of a report type come from one content request with n=samples
+SAMPLING_PLANS_BY_LIKELIHOOD = {
+    "yes": SamplingPlan(samples=3, temperature=0.4),
+    "maybe": SamplingPlan(samples=2, temperature=0.3),
+    "no": SamplingPlan(samples=0, temperature=0.0),
+}
+
+
+def parse_sampling_plan(value: str) -> SamplingPlan:
+    """Parses a plan written as "<samples>@<temperature>", e.g. "3@0.4"."""
+    samples, _, temperature = value.strip().partition("@")
+    if not temperature:
+        raise ValueError(f"Invalid sampling plan: {value}. Expected <samples>@<temperature>, e.g. 3@0.4")
+    return SamplingPlan(samples=int(samples), temperature=float(temperature))
+
+
+def load_sampling_settings() -> Tuple[str, Dict[str, SamplingPlan]]:
+    """
+    Reads how report variants are generated:
+        REPORT_SAMPLING_MODE            "temperatures" (default): one request per temperature in
+                                        TEMPERATURES_BY_LIKELIHOOD; "samples": one multi-sample request per type
+        REPORT_SAMPLES_YES / _MAYBE     Overrides the plan of a likelihood in "samples" mode, e.g. "3@0.4"
+    Returns:
+        Tuple[str, Dict[str, SamplingPlan]]: (the mode, the plan of each likelihood)
+    """
+    load_dotenv()
+    mode = os.getenv("REPORT_SAMPLING_MODE", "temperatures").strip().lower()
+    if mode not in SAMPLING_MODES:
+        raise ValueError(f"Invalid REPORT_SAMPLING_MODE: {mode}. Valid modes are: {', '.join(SAMPLING_MODES)}")
+    plans = dict(SAMPLING_PLANS_BY_LIKELIHOOD)
+    for likelihood in ("yes", "maybe"):
+        override = os.getenv(f"REPORT_SAMPLES_{likelihood.upper()}", "").strip()
+        if override:
+            plans[likelihood] = parse_sampling_plan(override)
+    return mode, plans
+
+
+async def generate_report_samples(
+    report_type: Literal["LDAP", "DNS", "NonDNS"],
+    quest_report_str: str,
+    report_description: str, # This is the free text extracted from the report
+    desired_report_description: str, # This is a description of the desired report, including filters and display fields
+    plan: SamplingPlan,
+) -> List[dict]:
+    """
+    Generates the variants of a report type from a single content request that samples plan.samples candidates.
+    The prompt is paid for once instead of once per variant; each candidate then gets its own metadata.
+    """
+    if report_type == "LDAP":
+        # The query does not depend on the variant, so all candidates share one
+        ldap_query = await generate_ldap_query(xml_report_str=quest_report_str,
+                                               original_quest_report_description=report_description)
+        contents = await get_ldap_content_samples(quest_report_str, report_description, ldap_query,
+                                                  desired_report_description, plan.temperature, plan.samples)
+        metadata = await asyncio.gather(*(
+            get_ldap_meta(quest_report_str, report_description, ldap_query, plan.temperature, content)
+            for content in contents))
+    elif report_type == "DNS":
+        contents = await get_dns_content_samples(quest_report_str, report_description,
+                                                 desired_report_description, plan.temperature, plan.samples)
+        metadata = await asyncio.gather(*(
+            get_dns_meta(quest_report_str, report_description, plan.temperature, content) for content in contents))
+    else:
+        contents = await get_nondns_content_samples(quest_report_str, report_description,
+                                                    desired_report_description, plan.temperature, plan.samples)
+        metadata = await asyncio.gather(*(
+            get_nondns_meta(quest_report_str, report_description, plan.temperature, content) for content in contents))
+
+    return [{"Content": content,
+             "MetaData": meta,
+             "SecurityReportSettings": None,
+             "CustomLogic": None}
+            for content, meta in zip(contents, metadata)]
+
+
+def post_process_report(report_type: Literal["LDAP", "DNS", "NonDNS"], report: dict) -> dict:
+    if report_type == "LDAP":
+        return ldap_post_process(report)
+    elif report_type == "DNS":
+        return dns_post_process(report)
+    return nondns_post_process(report)
+
+
 def describe_desired_report_properties(report_type: str) -> str:
     if report_type in ["DNS", "NonDNS"]:
         return describe_report_properties(
@@ -164,51 +283,181 @@ def describe_desired_report_properties(report_type: str) -> str:
     return describe_LDAP()
 
 
-def get_reports(
-    client, deployment_name: str,
-    report_type: Literal["LDAP", "DNS", "NonDNS"],
-    likelihood: Literal["yes", "maybe", "no"],
-    xml_report_str: str,  # This is the XML report string
-    extracted_data: str,  # This is a free text extracted from the report
-) -> list:
-    
-    temperatures = {
-        "yes": [0, 0.2, 0.4],
-        "maybe": [0.1, 0.3],
-        "no": [],
-    }[likelihood]
+VariantUnit = Union[float, SamplingPlan]  # A temperature, or in "samples" mode the plan of one multi-sample request
 
-    desired_report_description = describe_desired_report_properties(report_type)
 
-    results = []
+def variant_units(likelihood: Literal["yes", "maybe", "no"]) -> List[VariantUnit]:
+    """
+    The independent requests that generate the variants of a likelihood: one per temperature, or in "samples" mode
+    a single multi-sample request.
+    """
+    sampling_mode, plans = load_sampling_settings()
+    if sampling_mode == "samples":
+        plan = plans[likelihood]
+        return [plan] if plan.samples > 0 else []
+    return list(TEMPERATURES_BY_LIKELIHOOD[likelihood])
+
 
-    for temperature in temperatures:
-        if report_type == "LDAP":
-            report = generate_ldap_report(
+async def generate_variant_unit(
+    report_type: Literal["LDAP", "DNS", "NonDNS"],
+    unit: VariantUnit,
+    xml_report_str: str,  # This is the XML report string
+    extracted_data: str,  # This is a free text extracted from the report
+    desired_report_description: str,
+    post_process: bool = True,  # False leaves post_process_report() to the caller
+) -> List[dict]:
+    """
+    Generates the variants of one unit of variant_units(): one report per temperature, plan.samples per plan.
+    Inside journal_file(), a unit recorded by an earlier attempt of the run is reused (see src.utils.run_journal).
+    """
+    journal = get_file_journal()
+    reports = journal.variant(report_type, unit_key(unit)) if journal is not None else None
+    if reports is None:
+        reports = await _generate_variant_unit(report_type, unit, xml_report_str, extracted_data,
+                                               desired_report_description)
+        if journal is not None:
+            journal.record_variant(report_type, unit_key(unit), reports)
+    if not post_process:
+        return reports
+    return [post_process_report(report_type, report) for report in reports]
+
+
+def unit_key(unit: VariantUnit) -> str:
+    """Names a variant unit in the run journal, e.g. "temperature=0.2" or "samples=3@0.4"."""
+    if isinstance(unit, SamplingPlan):
+        return f"samples={unit.samples}@{unit.temperature}"
+    return f"temperature={unit}"
+
+
+async def _generate_variant_unit(
+    report_type: Literal["LDAP", "DNS", "NonDNS"],
+    unit: VariantUnit,
+    xml_report_str: str,
+    extracted_data: str,
+    desired_report_description: str,
+) -> List[dict]:
+    with telemetry_context(report_type=report_type):
+        if isinstance(unit, SamplingPlan):
+            reports = await generate_report_samples(
+                report_type, xml_report_str, extracted_data, desired_report_description, unit)
+        elif report_type == "LDAP":
+            reports = [await generate_ldap_report(
                 xml_report_str, # This is the XML report string
                 extracted_data, # This is a free text extracted from the report
                 desired_report_description,
-                temperature)
-            post_processed = ldap_post_process(report)
+                unit)]
         elif report_type == "DNS":
-            report = generate_dns_report(
+            reports = [await generate_dns_report(
                 xml_report_str, # This is the XML report string
                 extracted_data, # This is a free text extracted from the report
                 desired_report_description,
-                temperature)
-            post_processed = dns_post_process(report)
+                unit)]
         else:
             # meaning report_type == "NonDNS":
-            report = generate_nondns_report(
+            reports = [await generate_nondns_report(
                 xml_report_str, # This is the XML report string
                 extracted_data, # This is a free text extracted from the report
                 desired_report_description,
-                temperature)
-            post_processed = nondns_post_process(report)
-        
-        results.append(post_processed)
+                unit)]
+    return reports
+
+
+async def get_reports(
+    report_type: Literal["LDAP", "DNS", "NonDNS"],
+    likelihood: Literal["yes", "maybe", "no"],
+    xml_report_str: str,  # This is the XML report string
+    extracted_data: str,  # This is a free text extracted from the report
+    post_process: bool = True,  # False leaves post_process_report() to the caller
+) -> list:
+    
+    desired_report_description = describe_desired_report_properties(report_type)
+
+    # The variants are independent of each other, so they are generated concurrently
+    results = await asyncio.gather(*(
+        generate_variant_unit(report_type, unit, xml_report_str, extracted_data, desired_report_description,
+                              post_process)
+        for unit in variant_units(likelihood)
+    ))
+
+    return [report for reports in results for report in reports]
 
-    return results
+
+class SpeculativeReports:
+    """
+    Report variants generated while the operator is still confirming the likelihoods.
+
+    start() begins generating every variant of the model's conclusions in the background, as soon as they are
+    known. Once the operator has answered, confirm() keeps the variants of the confirmed likelihoods, cancels the
+    others, and starts the ones the operator added (e.g. a type upgraded from "no"). Variants are matched by
+    their unit (see variant_units), so only a changed temperature or plan is thrown away. Speculative calls are
+    tagged with speculative=true in the telemetry.
+    """
+    def __init__(self, quest_report_str: str, extracted_data: str, post_process: bool = True):
+        self.quest_report_str = quest_report_str
+        self.extracted_data = extracted_data
+        self.post_process = post_process
+        self.likelihoods: Optional[Dict[str, str]] = None
+        self._tasks: Dict[Tuple[str, VariantUnit], "asyncio.Task"] = {}
+        self.kept = self.cancelled = self.started_late = 0
+
+    def _start(self, report_type: str, unit: VariantUnit) -> None:
+        if (report_type, unit) not in self._tasks:
+            self._tasks[(report_type, unit)] = asyncio.ensure_future(generate_variant_unit(
+                report_type, unit, self.quest_report_str, self.extracted_data,
+                describe_desired_report_properties(report_type), self.post_process))
+
+    def start(self, conclusions: Dict[str, str]) -> None:
+        """Starts generating the variants of the model's conclusions. Must be called from the event loop."""
+        with telemetry_context(speculative=True):
+            for report_type, likelihood in conclusions.items():
+                for unit in variant_units(likelihood):
+                    self._start(report_type, unit)
+
+    def confirm(self, likelihoods: Dict[str, str]) -> None:
+        """Keeps the variants of the confirmed likelihoods, cancels the others and starts the missing ones."""
+        self.likelihoods = dict(likelihoods)
+        wanted = {(report_type, unit) for report_type, likelihood in likelihoods.items()
+                  for unit in variant_units(likelihood)}
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._tasks.pop(key).cancel()
+                self.cancelled += 1
+        self.kept = len(self._tasks)
+        for report_type, unit in wanted - set(self._tasks):
+            self._start(report_type, unit)
+            self.started_late += 1
+        print(f"Speculative generation: {self.kept} variant requests kept, {self.cancelled} cancelled, "
+              f"{self.started_late} started after the confirmation")
+
+    def cancel(self) -> None:
+        """Cancels every variant, e.g. when the file failed before its likelihoods were confirmed."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def results(self) -> Dict[str, List[dict]]:
+        """
+        The reports of every confirmed type, like generate_reports_from_likely_report_types_async().
+        If a variant fails (or the caller is cancelled), the other variants are cancelled and awaited before the
+        error is raised, so none of them goes on spending tokens.
+        """
+        tasks = dict(self._tasks)
+        try:
+            generated: Dict[str, List[dict]] = {}
+            for report_type, likelihood in self.likelihoods.items():
+                results = await asyncio.gather(*(tasks[(report_type, unit)] for unit in variant_units(likelihood)))
+                generated[report_type] = [report for reports in results for report in reports]
+            return generated
+        except BaseException:
+            self.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+
+def load_speculation_enabled() -> bool:
+    """REPORT_SPECULATION: "1" (default) to generate while the operator confirms the likelihoods, "0" to wait."""
+    load_dotenv()
+    return os.getenv("REPORT_SPECULATION", "1").strip() == "1"
 
 def structurly_describe_report(quest_report_str: str) -> str:
     response_fomat = """{"filters_applied": List[str] list of filters applied to the report, "display_fields_used": List[str] list of display fields used in the report}"""
@@ -222,27 +471,49 @@ Return your answer in this format:
 
     
 
-def generate_reports_from_likely_report_types(
+async def generate_reports_from_likely_report_types_async(
     report_type_to_likelihood: dict,
     quest_report_str: str,
-    extracted_data: str
+    extracted_data: str,
+    post_process: bool = True
 ):
-    """Generates reports based on the likely report types and the quest report string.
+    """Generates reports for all likely report types concurrently.
     Args:
         report_type_to_likelihood (dict): A dictionary mapping report types to their likelihoods.
         quest_report_str (str): The string representation of the quest report.
         extracted_data (str): Additional data extracted from the report as free text.
+        post_process (bool): False to return the reports before post_process_report().
     """
-    client, deployment_name = get_client_and_deployment_name()
-    generated_report: Dict[str, Dict[int, Any]] = {}
-    for report_type in report_type_to_likelihood:
-        generated_report[report_type] = get_reports(
-            client=client,
-            deployment_name=deployment_name,
+    report_types = list(report_type_to_likelihood)
+    reports_per_type = await asyncio.gather(*(
+        get_reports(
             report_type=report_type,
             likelihood=report_type_to_likelihood[report_type],
             xml_report_str=quest_report_str,
-            extracted_data=extracted_data
-            
+            extracted_data=extracted_data,
+            post_process=post_process
         )
+        for report_type in report_types
+    ))
+    generated_report: Dict[str, Dict[int, Any]] = dict(zip(report_types, reports_per_type))
     return generated_report
+
+
+def generate_reports_from_likely_report_types(
+    report_type_to_likelihood: dict,
+    quest_report_str: str,
+    extracted_data: str
+):
+    """Generates reports based on the likely report types and the quest report string.
+    Args:
+        report_type_to_likelihood (dict): A dictionary mapping report types to their likelihoods.
+        quest_report_str (str): The string representation of the quest report.
+        extracted_data (str): Additional data extracted from the report as free text.
+    """
+    return asyncio.run(generate_reports_from_likely_report_types_async(
+        report_type_to_likelihood=report_type_to_likelihood,
+        quest_report_str=quest_report_str,
+        extracted_data=extracted_data
+    ))
+
+# fin.
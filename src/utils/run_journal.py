@@ -0,0 +1,231 @@
+"""
+A crash-safe journal of a run: what each file's stages produced, so that an interrupted run can be resumed.
+
+The journal lives in the run's artifacts directory (run_journal.sqlite) and records, per file:
+    extraction      the extracted data
+    likelihood      the confirmed likelihood of each report type
+    variants        every generated report variant, one row per variant unit (see variant_units), before
+                    post-processing, as soon as the unit is done
+    write           that the reports were saved, and how many
+Every record is a single SQLite transaction in WAL mode with synchronous=FULL, so a crash, a kill or a Ctrl-C
+leaves either the whole record or none of it, and the journal is safe to share between worker processes.
+
+When a run is resumed over the same artifacts directory, each file picks up after its last recorded stage: files
+that were written are skipped, recorded extractions and likelihoods are reused instead of asking the model (or
+the operator) again, and only the variants that are not recorded yet are generated. Variants are recorded from
+generate_variant_unit() for the file set by journal_file(), which follows the code into asyncio tasks and threads
+like telemetry_context().
+
+Configuration (environment / .env):
+    RUN_JOURNAL     "1" (default) to journal runs in their artifacts directory, "0" for no journal
+
+Resume an interrupted run, or see how far it got, from the project root:
+    python cli.py --resume <artifacts dir>
+    python -m src.utils.run_journal status <artifacts dir>
+"""
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+JOURNAL_FILENAME = "run_journal.sqlite"
+JOURNALED_STAGES = ("extraction", "likelihood", "write")
+
+
+class RunJournal:
+    """The stage outputs of the files of one run, stored in SQLite."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")  # A committed record survives a crash of the machine too
+            connection.execute("CREATE TABLE IF NOT EXISTS run (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS stages (
+                    filename TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (filename, stage)
+                )"""
+            )
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS variants (
+                    filename TEXT NOT NULL,
+                    report_type TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    reports TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (filename, report_type, unit)
+                )"""
+            )
+            self._local.connection = connection
+        return connection
+
+    def record_run(self, file_paths: List[str], likelihood_policy: str) -> None:
+        """Records the inputs of the run, which a resume converts again. A later run over the same directory replaces them."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO run (key, value) VALUES ('inputs', ?)",
+            (json.dumps({"file_paths": file_paths, "likelihood_policy": likelihood_policy}),),
+        )
+
+    def run_inputs(self) -> Optional[Tuple[List[str], str]]:
+        """(the file paths, the likelihood policy) of the last run, or None if no run was recorded."""
+        row = self._connection().execute("SELECT value FROM run WHERE key = 'inputs'").fetchone()
+        if row is None:
+            return None
+        inputs = json.loads(row[0])
+        return inputs["file_paths"], inputs["likelihood_policy"]
+
+    def record_stage(self, filename: str, stage: str, output: Any) -> None:
+        """Records the output of one of JOURNALED_STAGES, as JSON."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO stages (filename, stage, output, recorded_at) VALUES (?, ?, ?, ?)",
+            (filename, stage, json.dumps(output), time.time()),
+        )
+
+    def stage_output(self, filename: str, stage: str) -> Optional[Any]:
+        """The recorded output of a stage, or None if the stage has not completed."""
+        row = self._connection().execute(
+            "SELECT output FROM stages WHERE filename = ? AND stage = ?", (filename, stage)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def record_variant(self, filename: str, report_type: str, unit: str, reports: List[dict]) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO variants (filename, report_type, unit, reports, recorded_at) VALUES (?, ?, ?, ?, ?)",
+            (filename, report_type, unit, json.dumps(reports), time.time()),
+        )
+
+    def variant(self, filename: str, report_type: str, unit: str) -> Optional[List[dict]]:
+        """The recorded reports of one variant unit, or None if it was not generated yet."""
+        row = self._connection().execute(
+            "SELECT reports FROM variants WHERE filename = ? AND report_type = ? AND unit = ?",
+            (filename, report_type, unit),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def forget(self, filename: str) -> None:
+        """Deletes everything recorded for a file, e.g. when it is removed from the run."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM stages WHERE filename = ?", (filename,))
+            connection.execute("DELETE FROM variants WHERE filename = ?", (filename,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        """How many files reached each stage, and how many variant units are recorded."""
+        connection = self._connection()
+        inputs = self.run_inputs()
+        counts = dict(connection.execute("SELECT stage, COUNT(*) FROM stages GROUP BY stage").fetchall())
+        return {
+            "files": len(inputs[0]) if inputs is not None else 0,
+            **{stage: counts.get(stage, 0) for stage in JOURNALED_STAGES},
+            "variant_units": connection.execute("SELECT COUNT(*) FROM variants").fetchone()[0],
+        }
+
+
+class FileJournal:
+    """The journal entries of one file."""
+
+    def __init__(self, journal: RunJournal, filename: str):
+        self.journal = journal
+        self.filename = filename
+
+    def record_stage(self, stage: str, output: Any) -> None:
+        self.journal.record_stage(self.filename, stage, output)
+
+    def stage_output(self, stage: str) -> Optional[Any]:
+        return self.journal.stage_output(self.filename, stage)
+
+    def record_variant(self, report_type: str, unit: str, reports: List[dict]) -> None:
+        self.journal.record_variant(self.filename, report_type, unit, reports)
+
+    def variant(self, report_type: str, unit: str) -> Optional[List[dict]]:
+        return self.journal.variant(self.filename, report_type, unit)
+
+
+_journal: Optional[RunJournal] = None
+_journal_configured = False
+_journal_lock = threading.Lock()
+_journal_file: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("run_journal_file", default=None)
+
+
+def load_run_journal_enabled() -> bool:
+    load_dotenv()
+    return os.getenv("RUN_JOURNAL", "1").strip() == "1"
+
+
+def configure_run_journal(path: Optional[str]) -> Optional[RunJournal]:
+    """Sets the journal of this process's run. None disables journaling."""
+    global _journal, _journal_configured
+    with _journal_lock:
+        _journal = RunJournal(path) if path else None
+        _journal_configured = True
+    return _journal
+
+
+def get_run_journal() -> Optional[RunJournal]:
+    """Returns the configured journal, or None when this process's run is not journaled."""
+    return _journal if _journal_configured else None
+
+
+def journal_path_for(artifacts_dir: str) -> str:
+    return os.path.join(artifacts_dir, JOURNAL_FILENAME)
+
+
+@contextmanager
+def journal_file(filename: str) -> Iterator[None]:
+    """Journals the stage outputs and variants produced inside the block as those of the file."""
+    token = _journal_file.set(filename)
+    try:
+        yield
+    finally:
+        _journal_file.reset(token)
+
+
+def get_file_journal(filename: Optional[str] = None) -> Optional[FileJournal]:
+    """The journal of the file (default: the one of the surrounding journal_file()), or None if there is none."""
+    journal = get_run_journal()
+    filename = filename or _journal_file.get()
+    if journal is None or filename is None:
+        return None
+    return FileJournal(journal, filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the journal of a run.")
+    parser.add_argument("command", choices=["status"])
+    parser.add_argument("artifacts_dir", help="The artifacts directory of the run.")
+    args = parser.parse_args()
+
+    path = journal_path_for(args.artifacts_dir)
+    if not os.path.exists(path):
+        parser.error(f"No run journal in {args.artifacts_dir}")
+    print(json.dumps(RunJournal(path).stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
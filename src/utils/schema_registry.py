@@ -0,0 +1,141 @@
+"""
+Compiles the Pydantic reply schemas once per process, and validates the model's replies against them.
+
+model_json_schema() walks the whole model tree on every call, and the content schemas are large, so each schema
+is compiled once: its JSON schema, the tool definition and tool choice of ask_with_schema(), the serialized form
+used in cache keys, and a TypeAdapter that validates replies right after they are parsed.
+
+Validation is lenient by default: a reply that does not match its schema is reported, and used anyway, but never
+cached. In strict mode it raises a SchemaValidationError instead.
+
+Some schemas hold sets of models (e.g. the filter fields of the DNS / NonDNS content), which Pydantic cannot put
+into a Python set since models are not hashable. The items of such sets are still validated; only the
+"set_item_not_hashable" errors are ignored.
+
+Configuration (environment / .env):
+    LLM_SCHEMA_VALIDATION   "warn" (default), "strict" or "off"
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pydantic import TypeAdapter, ValidationError
+
+TOOL_DESCRIPTION = "Get the structured response based on the provided schema."
+VALIDATION_MODES = ("warn", "strict", "off")
+IGNORED_ERROR_TYPES = ("set_item_not_hashable",)
+
+
+class SchemaValidationError(ValueError):
+    """A reply that does not match the schema it was requested with."""
+    def __init__(self, schema_name: str, errors: List[Dict[str, Any]]):
+        self.schema_name = schema_name
+        self.errors = errors
+        super().__init__(f"Reply does not match {schema_name}: {describe_errors(errors)}")
+
+
+@dataclass(frozen=True)
+class CompiledSchema:
+    """Data class to hold everything derived from a reply schema."""
+    name: str
+    json_schema: Dict[str, Any]
+    schema_json: str  # Serialized with sorted keys, for cache keys
+    tool_arguments: Dict[str, Any]  # The tools / tool_choice arguments of a chat-completions request
+    adapter: TypeAdapter
+
+    def validation_errors(self, reply: Any) -> List[Dict[str, Any]]:
+        try:
+            self.adapter.validate_python(reply)
+        except ValidationError as error:
+            return [detail for detail in error.errors(include_url=False) if detail["type"] not in IGNORED_ERROR_TYPES]
+        return []
+
+
+_compiled: Dict[type, CompiledSchema] = {}
+_compiled_lock = threading.Lock()
+_validation_mode: Optional[str] = None
+
+
+def _compile(schema) -> CompiledSchema:
+    json_schema = schema.model_json_schema()
+    return CompiledSchema(
+        name=schema.__name__,
+        json_schema=json_schema,
+        schema_json=json.dumps(json_schema, sort_keys=True),
+        tool_arguments={
+            "tools": [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": schema.__name__,
+                        "description": TOOL_DESCRIPTION,
+                        "parameters": json_schema,
+                    },
+                }
+            ],
+            "tool_choice": {
+                "type": "function",
+                "function": {"name": schema.__name__},
+            },
+        },
+        adapter=TypeAdapter(schema),
+    )
+
+
+def get_compiled_schema(schema) -> CompiledSchema:
+    """Returns the compiled form of a Pydantic model, compiling it on first use."""
+    compiled = _compiled.get(schema)
+    if compiled is not None:
+        return compiled
+    with _compiled_lock:
+        if schema not in _compiled:
+            _compiled[schema] = _compile(schema)
+        return _compiled[schema]
+
+
+def load_validation_mode() -> str:
+    global _validation_mode
+    if _validation_mode is None:
+        load_dotenv()
+        mode = os.getenv("LLM_SCHEMA_VALIDATION", "warn").strip().lower()
+        if mode not in VALIDATION_MODES:
+            raise ValueError(f"Invalid LLM_SCHEMA_VALIDATION: {mode}. Valid modes are: {', '.join(VALIDATION_MODES)}")
+        _validation_mode = mode
+    return _validation_mode
+
+
+def describe_errors(errors: List[Dict[str, Any]], limit: int = 3) -> str:
+    described = [f"{'.'.join(str(part) for part in error['loc']) or '<root>'}: {error['msg']}" for error in errors[:limit]]
+    if len(errors) > limit:
+        described.append(f"and {len(errors) - limit} more")
+    return "; ".join(described)
+
+
+def validate_reply(schema, reply: Any, mode: Optional[str] = None) -> bool:
+    """
+    Validates a parsed reply against the schema it was requested with.
+    Args:
+        schema: The Pydantic model.
+        reply: The parsed tool arguments.
+        mode (Optional[str]): "warn", "strict" or "off". Defaults to LLM_SCHEMA_VALIDATION.
+    Returns:
+        bool: Whether the reply is valid (always True when validation is off).
+    Raises:
+        SchemaValidationError: In strict mode, if the reply is not valid.
+    """
+    mode = mode or load_validation_mode()
+    if mode == "off":
+        return True
+    compiled = get_compiled_schema(schema)
+    errors = compiled.validation_errors(reply)
+    if not errors:
+        return True
+    if mode == "strict":
+        raise SchemaValidationError(compiled.name, errors)
+    print(f"Warning: reply does not match {compiled.name}: {describe_errors(errors)}")
+    return False
+
+# fin.
@@ -0,0 +1,322 @@
+"""
+Per-call telemetry of LLM calls.
+
+Every call made through azure_client_utils emits one JSON line to the telemetry sink with the pipeline stage,
+file, report type, temperature, schema, token usage (including the prompt tokens served from the server-side
+prompt cache), time-to-first-byte (and, for streaming calls, time-to-first-token), total latency, retries and
+whether it was served from the response cache. The stage / file / report type are taken from the surrounding
+telemetry_context(), which follows the code through threads' and asyncio tasks' contexts. Hedged calls (see
+src.utils.hedging) are tagged in `extra`, and the summary adds hedge counts and estimated savings when there are any.
+
+Summarize a telemetry file from the project root:
+    python -m src.utils.telemetry summary <telemetry.jsonl> [--by stage schema] [--prompt-price P --completion-price C]
+where P and C are the deployment's prices per million prompt / completion tokens, to add an estimated cost column.
+"""
+import argparse
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+TELEMETRY_FILENAME = "telemetry.jsonl"
+
+
+@dataclass
+class LLMCallRecord:
+    """Data class to hold the telemetry of a single LLM call."""
+    timestamp: float
+    deployment: str
+    temperature: float
+    stage: Optional[str] = None
+    file: Optional[str] = None
+    report_type: Optional[str] = None
+    schema: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None  # Prompt tokens served from the server-side prompt cache
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    ttfb_ms: Optional[float] = None  # Time until the response headers of the last attempt arrived
+    ttft_ms: Optional[float] = None  # Streaming calls: time until the first content token arrived
+    latency_ms: Optional[float] = None  # Total time, including waiting for quota and retries
+    retries: int = 0
+    cache_hit: bool = False
+    error: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class _CallTiming:
+    """Mutable per-call state, updated by the HTTP hooks of whichever attempt is in flight."""
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.attempts = 0
+        self.request_sent_at: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.hedges = 0  # Duplicate requests sent by request hedging, which are not retries
+        self.extra: Dict[str, Any] = {}  # Fields added by annotate_llm_call()
+
+
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("llm_telemetry_context", default={})
+_current_call: contextvars.ContextVar[Optional[_CallTiming]] = contextvars.ContextVar("llm_current_call", default=None)
+
+
+@contextmanager
+def telemetry_context(**fields) -> Iterator[None]:
+    """
+    Tags every LLM call made inside the block with the given fields (stage, file, report_type...).
+    Nested contexts add to (and override) the outer ones.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_telemetry_context() -> Dict[str, Any]:
+    return dict(_context.get())
+
+
+def on_http_request() -> None:
+    """HTTP request hook: marks the start of an attempt of the current call."""
+    timing = _current_call.get()
+    if timing is not None:
+        timing.attempts += 1
+        timing.request_sent_at = time.perf_counter()
+
+
+def on_http_response() -> None:
+    """HTTP response hook: the response headers have arrived."""
+    timing = _current_call.get()
+    if timing is not None and timing.request_sent_at is not None:
+        timing.ttfb = time.perf_counter() - timing.request_sent_at
+
+
+class TelemetrySink:
+    """Appends records to a JSONL file. Safe to share between threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: LLMCallRecord) -> None:
+        line = json.dumps(asdict(record), ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+
+
+_sink: Optional[TelemetrySink] = None
+_sink_configured = False
+_sink_lock = threading.Lock()
+
+
+def configure_telemetry(path: Optional[str]) -> None:
+    """Sets where telemetry is written. None disables telemetry."""
+    global _sink, _sink_configured
+    with _sink_lock:
+        _sink = TelemetrySink(path) if path else None
+        _sink_configured = True
+
+
+def get_telemetry_sink() -> Optional[TelemetrySink]:
+    """Returns the configured sink, falling back to LLM_TELEMETRY_PATH from the environment."""
+    global _sink, _sink_configured
+    if not _sink_configured:
+        load_dotenv()
+        configure_telemetry(os.getenv("LLM_TELEMETRY_PATH") or None)
+    return _sink
+
+
+class LLMCallRecorder:
+    """Collects the telemetry of one call, see record_llm_call()."""
+
+    def __init__(self, record: LLMCallRecord, timing: _CallTiming):
+        self.record = record
+        self.timing = timing
+
+    def set_usage(self, usage) -> None:
+        if usage is None:
+            return
+        self.record.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.record.cached_tokens = getattr(details, "cached_tokens", None)
+        self.record.completion_tokens = getattr(usage, "completion_tokens", None)
+        self.record.total_tokens = getattr(usage, "total_tokens", None)
+
+    def set_hedge(self, outcome) -> None:
+        """Records the HedgeOutcome of a call (see src.utils.hedging)."""
+        if not outcome.hedged:
+            return
+        self.timing.hedges += 1
+        self.record.extra["hedged"] = True
+        self.record.extra["hedge_won"] = outcome.hedge_won
+        self.record.extra["hedge_delay_ms"] = round(outcome.delay * 1000, 1)
+        if outcome.saved is not None:
+            self.record.extra["hedge_saved_ms"] = round(outcome.saved * 1000, 1)
+
+    def mark_first_token(self) -> None:
+        """Streaming calls: the first content token has arrived."""
+        if self.timing.first_token_at is None:
+            self.timing.first_token_at = time.perf_counter()
+
+    def seconds_to_first_token(self) -> Optional[float]:
+        if self.timing.first_token_at is None:
+            return None
+        return self.timing.first_token_at - self.timing.started_at
+
+
+def annotate_llm_call(**fields) -> None:
+    """Adds fields to the `extra` of the call being recorded, from code that has no access to its recorder."""
+    timing = _current_call.get()
+    if timing is not None:
+        timing.extra.update(fields)
+
+
+@contextmanager
+def record_llm_call(deployment: str, temperature: float, schema=None) -> Iterator[LLMCallRecorder]:
+    """
+    Measures an LLM call made inside the block and writes its record to the sink when the block exits.
+    """
+    context = current_telemetry_context()
+    record = LLMCallRecord(
+        timestamp=time.time(),
+        deployment=deployment,
+        temperature=temperature,
+        stage=context.pop("stage", None),
+        file=context.pop("file", None),
+        report_type=context.pop("report_type", None),
+        schema=schema.__name__ if schema else None,
+        extra=context,
+    )
+    timing = _CallTiming()
+    recorder = LLMCallRecorder(record, timing)
+    token = _current_call.set(timing)
+    try:
+        yield recorder
+    except BaseException as error:
+        record.error = type(error).__name__
+        raise
+    finally:
+        try:
+            _current_call.reset(token)
+        except ValueError:
+            # An abandoned streaming generator may be closed from another context
+            pass
+        record.latency_ms = round((time.perf_counter() - timing.started_at) * 1000, 1)
+        record.ttfb_ms = round(timing.ttfb * 1000, 1) if timing.ttfb is not None else None
+        if timing.first_token_at is not None:
+            record.ttft_ms = round((timing.first_token_at - timing.started_at) * 1000, 1)
+        record.retries = max(0, timing.attempts - 1 - timing.hedges)
+        record.extra.update(timing.extra)
+        sink = get_telemetry_sink()
+        if sink is not None:
+            sink.write(record)
+
+
+def read_records(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, e.g. fraction=0.95 for p95."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(
+    records: List[Dict[str, Any]],
+    by: str,
+    prompt_price: Optional[float] = None,
+    completion_price: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Aggregates records per value of the `by` field (e.g. "stage" or "schema").
+    Args:
+        prompt_price, completion_price (Optional[float]): Prices per million tokens. When given, adds a cost column.
+    Returns:
+        List[Dict[str, Any]]: One row per group, with call counts, cache hits, p50/p95 latency and token totals.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        groups.setdefault(str(record.get(by)), []).append(record)
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        latencies = [record["latency_ms"] for record in group if record.get("latency_ms") is not None]
+        ttfbs = [record["ttfb_ms"] for record in group if record.get("ttfb_ms") is not None]
+        ttfts = [record["ttft_ms"] for record in group if record.get("ttft_ms") is not None]
+        row = {
+            by: key,
+            "calls": len(group),
+            "cache_hits": sum(1 for record in group if record.get("cache_hit")),
+            "errors": sum(1 for record in group if record.get("error")),
+            "retries": sum(record.get("retries") or 0 for record in group),
+            "p50_latency_ms": percentile(latencies, 0.5),
+            "p95_latency_ms": percentile(latencies, 0.95),
+            "p50_ttfb_ms": percentile(ttfbs, 0.5),
+            "prompt_tokens": sum(record.get("prompt_tokens") or 0 for record in group),
+            "cached_tokens": sum(record.get("cached_tokens") or 0 for record in group),
+            "completion_tokens": sum(record.get("completion_tokens") or 0 for record in group),
+        }
+        row["cached_ratio"] = round(row["cached_tokens"] / row["prompt_tokens"], 2) if row["prompt_tokens"] else 0.0
+        if any(record.get("ttft_ms") is not None for record in records):
+            row["p50_ttft_ms"] = percentile(ttfts, 0.5)
+        if any((record.get("extra") or {}).get("hedged") for record in records):
+            hedged = [record["extra"] for record in group if (record.get("extra") or {}).get("hedged")]
+            row["hedges"] = len(hedged)
+            row["hedge_rate"] = round(len(hedged) / len(group), 2)
+            row["hedge_wins"] = sum(1 for extra in hedged if extra.get("hedge_won"))
+            row["hedge_saved_ms"] = round(sum(extra.get("hedge_saved_ms") or 0 for extra in hedged), 1)
+        if prompt_price is not None and completion_price is not None:
+            row["cost"] = round(
+                (row["prompt_tokens"] * prompt_price + row["completion_tokens"] * completion_price) / 1_000_000, 4)
+        rows.append(row)
+    return rows
+
+
+def print_summary(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("No records.")
+        return
+    columns = list(rows[0].keys())
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(str(row[column]).rjust(widths[column]) for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize LLM call telemetry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary_parser = subparsers.add_parser("summary", help="Aggregate latency and tokens per stage / schema.")
+    summary_parser.add_argument("path", help="A telemetry.jsonl file.")
+    summary_parser.add_argument("--by", nargs="+", default=["stage", "schema"])
+    summary_parser.add_argument("--prompt-price", type=float, help="Price per million prompt tokens.")
+    summary_parser.add_argument("--completion-price", type=float, help="Price per million completion tokens.")
+    args = parser.parse_args()
+
+    records = read_records(args.path)
+    for by in args.by:
+        print(f"\n# By {by}")
+        print_summary(summarize(records, by, args.prompt_price, args.completion_price))
+
+
+if __name__ == "__main__":
+    main()
+
+# fin.
@@ -0,0 +1,153 @@
+"""
+Fixtures and mocks shared by the tests: sample XML templates, API errors, and a local stand-in for the Azure OpenAI
+endpoint, so that the LLM stages run offline.
+
+Run from the project root:
+    python -m pytest -q
+"""
+import os
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import openai
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAND_IN_ENVIRONMENT = {
+    "LLM_CACHE_MODE": "bypass",
+    "PIPELINE_PROGRESS_INTERVAL": "0",
+}
+UNKNOWN_EVENT_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def template_xml(event_ids: List[str]) -> str:
+    filters = "".join(
+        f'    <Filter Name="EventClass" Operator="Equals" Value="{event_id}" />\n' for event_id in event_ids
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-16"?>\n'
+        "<ReportTemplate>\n"
+        '    <Scope Name="Domain" Value="corp.example.com" />\n'
+        f"{filters}"
+        '    <DateRange From="LastWeek" />\n'
+        "</ReportTemplate>\n"
+    )
+
+
+@pytest.fixture(autouse=True)
+def in_repo_root(monkeypatch):
+    """The knowledge files are read from paths relative to the project root."""
+    monkeypatch.chdir(REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def event_mapping() -> Dict[str, str]:
+    from src.files_management.files_handler import load_event_id_to_name_mapping
+
+    os.chdir(REPO_ROOT)
+    return load_event_id_to_name_mapping()
+
+
+@pytest.fixture
+def unknown_event_id() -> str:
+    return UNKNOWN_EVENT_ID
+
+
+@pytest.fixture
+def template_content() -> Callable[[List[str]], str]:
+    return template_xml
+
+
+@pytest.fixture
+def known_event_ids(event_mapping) -> List[str]:
+    return list(event_mapping)[:3]
+
+
+@pytest.fixture
+def write_template(tmp_path) -> Callable[..., str]:
+    """Writes a UTF-16 XML template, like the exported ones, and returns its path."""
+    def write(name: str, event_ids: List[str], directory: Optional[str] = None) -> str:
+        path = os.path.join(directory or str(tmp_path / "in"), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-16") as file:
+            file.write(template_xml(event_ids))
+        return path
+    return write
+
+
+@pytest.fixture
+def templates(write_template, known_event_ids) -> List[str]:
+    return [
+        write_template("logons.xml", known_event_ids[:1]),
+        write_template("groups.xml", known_event_ids[1:]),
+        write_template("unknown.xml", [UNKNOWN_EVENT_ID]),
+    ]
+
+
+@pytest.fixture
+def broken_template(tmp_path) -> str:
+    """A file that is not UTF-16, so it fails when it is read."""
+    path = tmp_path / "in" / "broken.xml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"<bad\n")
+    return str(path)
+
+
+@pytest.fixture
+def artifacts_dir(tmp_path) -> str:
+    path = tmp_path / "artifacts"
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def make_api_error() -> Callable[..., Exception]:
+    """Builds the errors the openai client raises for a failed HTTP call."""
+    def make(error_type=openai.RateLimitError, status_code: int = 429, headers: Optional[Dict[str, str]] = None):
+        request = httpx.Request("POST", "https://example.invalid/chat/completions")
+        response = httpx.Response(status_code, headers=headers or {}, request=request)
+        return error_type(f"HTTP {status_code}", response=response, body=None)
+    return make
+
+
+@pytest.fixture
+def run_journal(artifacts_dir):
+    """Journals this test's run in its artifacts directory, and turns journaling off again afterwards."""
+    from src.utils.run_journal import configure_run_journal, journal_path_for
+
+    journal = configure_run_journal(journal_path_for(artifacts_dir))
+    yield journal
+    configure_run_journal(None)
+
+
+@pytest.fixture
+def no_telemetry():
+    """Turns off telemetry again after a test that configures it (e.g. through cli.main)."""
+    from src.utils.telemetry import configure_telemetry
+
+    yield
+    configure_telemetry(None)
+
+
+@pytest.fixture(scope="session")
+def stand_in():
+    """
+    A stand-in server answering every LLM call of the session. The LLM settings are read on first use and kept for
+    the process, so the environment is set before any test makes a call, and left in place until the session ends.
+    """
+    from src.stand_in.server import StandInSettings, start_stand_in_server
+
+    server = start_stand_in_server(StandInSettings(port=0, latency="fixed", latency_ms=1, ms_per_token=0))
+    environment = {"LLM_STAND_IN_URL": server.url, **STAND_IN_ENVIRONMENT}
+    previous = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    yield server
+    server.shutdown()
+    server.server_close()
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+# fin.
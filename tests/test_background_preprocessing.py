@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from src.files_management import files_handler
+from src.files_management.files_handler import extracted_data_path
+from src.pipeline import background_preprocessing
+from src.pipeline.background_preprocessing import BackgroundPreprocessor
+
+
+@pytest.fixture
+def preprocessor(artifacts_dir):
+    preprocessor = BackgroundPreprocessor(artifacts_dir, concurrency=2)
+    yield preprocessor
+    preprocessor.close()
+
+
+@pytest.fixture
+def stuck_extraction(monkeypatch, run_journal):
+    """An extraction that writes its reply and journals it, then hangs until it is cancelled."""
+    started = threading.Event()
+
+    async def extract(processed_file, artifacts_dir):
+        with open(extracted_data_path(processed_file.filename, artifacts_dir), "w", encoding="utf-8") as file:
+            file.write("extracted")
+        run_journal.record_stage(processed_file.filename, "extraction", "extracted")
+        started.set()
+        await asyncio.Event().wait()
+    monkeypatch.setattr(background_preprocessing, "extract_processed_file_async", extract)
+    return started
+
+
+def test_removing_a_file_deletes_what_its_cancelled_work_wrote(preprocessor, stuck_extraction, run_journal,
+                                                               write_template, known_event_ids, artifacts_dir):
+    """🦄 remove() cancels the extraction and deletes the copy, the extracted data and the journal entries."""
+    # Arrange
+    path = write_template("logons.xml", known_event_ids[:1])
+    preprocessor.add(path)
+    assert stuck_extraction.wait(timeout=10)
+
+    # Act
+    preprocessor.remove(path)
+
+    # Assert
+    assert not os.path.exists(os.path.join(artifacts_dir, "logons.xml"))
+    assert not os.path.exists(extracted_data_path("logons.xml", artifacts_dir))
+    assert run_journal.stage_output("logons.xml", "extraction") is None
+    assert preprocessor.status() == {"files": 0, "done": 0, "running": 0}
+
+
+def test_removing_a_file_waits_for_its_copy_to_be_written(preprocessor, write_template, known_event_ids,
+                                                          artifacts_dir, monkeypatch):
+    """🦄 A copy still being written when the file is removed is deleted after it is written, not left behind."""
+    # Arrange
+    copying, release = threading.Event(), threading.Event()
+
+    def slow_copy(file_path, copy_to=None):
+        copying.set()
+        release.wait(timeout=10)
+        return files_handler.copy_and_read_xml_file(file_path, copy_to)
+    monkeypatch.setattr(background_preprocessing, "copy_and_read_xml_file", slow_copy)
+    path = write_template("logons.xml", known_event_ids[:1])
+    preprocessor.add(path)
+    assert copying.wait(timeout=10)
+    threading.Timer(0.2, release.set).start()
+
+    # Act
+    preprocessor.remove(path)
+
+    # Assert
+    assert release.is_set()
+    assert not os.path.exists(os.path.join(artifacts_dir, "logons.xml"))
+
+# fin.
@@ -0,0 +1,118 @@
+import glob
+import json
+import os
+
+import pytest
+
+from src.batch.batch_backends import BatchBackend, LocalBatchBackend
+from src.batch.batch_pipeline import run_batch_pipeline
+from src.utils import likelihood_policies, llm_cache, model_tiers
+from src.utils.llm_cache import LLMCache
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch) -> LocalBatchBackend:
+    """Answers the job files offline with fake schema-valid replies, with the response cache off."""
+    monkeypatch.setattr(llm_cache, "_cache", LLMCache(path=str(tmp_path / "responses.sqlite"), mode="bypass"))
+    return LocalBatchBackend(root=str(tmp_path / "jobs"))
+
+
+@pytest.fixture
+def likelihood_rules(tmp_path, monkeypatch):
+    """Installs the rules of the "rules" policy."""
+    def install(rules):
+        path = tmp_path / "likelihood_rules.json"
+        path.write_text(json.dumps({"rules": rules}), encoding="utf-8")
+        monkeypatch.setattr(likelihood_policies, "_rules", likelihood_policies.load_likelihood_rules(str(path)))
+    return install
+
+
+def reports_of(artifacts_dir: str, report_type: str):
+    return glob.glob(os.path.join(artifacts_dir, "*", f"*_as_{report_type}_*.json"))
+
+
+def submitted_bodies(artifacts_dir: str, stage: str):
+    """The request bodies of a wave, as written into its job files."""
+    bodies = []
+    for path in glob.glob(os.path.join(artifacts_dir, "batch", f"{stage}_attempt*.jsonl")):
+        with open(path, "r", encoding="utf-8") as file:
+            bodies.extend(json.loads(line)["body"] for line in file if line.strip())
+    return bodies
+
+
+def test_a_backend_must_implement_every_method():
+    """🦄 A backend without results() cannot be created, instead of failing halfway through a run."""
+    # Arrange
+    class SubmitOnlyBackend(BatchBackend):
+        def submit(self, requests_path):
+            return "batch"
+
+        def status(self, batch_id):
+            return None
+
+    # Act
+    with pytest.raises(TypeError) as raised:
+        SubmitOnlyBackend()
+
+    # Assert
+    assert "results" in str(raised.value)
+
+
+def test_the_batch_pipeline_converts_files_offline(backend, templates, artifacts_dir):
+    """🦄 Every wave runs through the local backend, and the reports are saved like in the interactive run."""
+    # Arrange
+    file_paths = templates
+
+    # Act
+    summary = run_batch_pipeline(file_paths, artifacts_dir, backend)
+
+    # Assert
+    assert summary.failures == []
+    assert summary.files == len(file_paths)
+    assert summary.reports_saved > 0
+    assert summary.reports_saved == len(glob.glob(os.path.join(artifacts_dir, "*", "*_as_*.json")))
+
+
+def test_each_wave_runs_on_the_tier_of_its_stage(backend, templates, artifacts_dir, monkeypatch):
+    """🦄 A wave is sent to its stage's deployment and temperature; stages without a tier use the backend's."""
+    # Arrange
+    monkeypatch.setattr(model_tiers, "_tiers", {})
+    monkeypatch.setenv("LLM_MODEL_LIKELIHOOD", "gpt-4o-mini")
+    monkeypatch.setenv("LLM_TEMPERATURE_METADATA", "0")
+
+    # Act
+    run_batch_pipeline(templates, artifacts_dir, backend)
+
+    # Assert
+    likelihood, metadata = submitted_bodies(artifacts_dir, "likelihood"), submitted_bodies(artifacts_dir, "metadata")
+    assert {body["model"] for body in likelihood} == {"stand-in-gpt-4o-mini"}
+    assert {body["model"] for body in submitted_bodies(artifacts_dir, "extraction")} == {backend.deployment_name}
+    assert metadata and {body["temperature"] for body in metadata} == {0.0}
+
+
+def test_the_batch_pipeline_applies_the_likelihood_policy(backend, likelihood_rules, templates, artifacts_dir):
+    """🦄 With the rules policy, the rules decide over the model's conclusions of a batch run."""
+    # Arrange
+    likelihood_rules([{"if": {"content_matches": "corp\\.example\\.com"}, "set": {"LDAP": "no", "NonDNS": "yes"}}])
+
+    # Act
+    run_batch_pipeline(templates, artifacts_dir, backend, likelihood_policy="rules")
+
+    # Assert
+    assert reports_of(artifacts_dir, "LDAP") == []
+    assert len(reports_of(artifacts_dir, "NonDNS")) >= len(templates)
+
+
+def test_the_batch_pipeline_cannot_ask_the_operator(backend, templates, artifacts_dir):
+    """🦄 Nobody answers a batch run, so the interactive policy is refused before anything is submitted."""
+    # Arrange
+    file_paths = templates
+
+    # Act
+    with pytest.raises(ValueError):
+        run_batch_pipeline(file_paths, artifacts_dir, backend, likelihood_policy="interactive")
+
+    # Assert
+    assert not os.path.exists(backend.root)
+
+# fin.
@@ -0,0 +1,334 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from src.utils import azure_client_utils, endpoint_pool
+from src.utils.endpoint_pool import BreakerSettings, EndpointConfig, EndpointPool, EndpointUnavailableError
+from src.utils.rate_limiter import RateLimitScheduler, RateLimitSettings
+
+MODEL = "gpt-4o"
+COOLDOWN = 30.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable clock in place of the breaker's time.monotonic."""
+    now = [1000.0]
+    monkeypatch.setattr(endpoint_pool, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def make_pool():
+    """Makes a pool of endpoints named after the given names, all serving MODEL."""
+    def make(*names: str, routing: str = "ewma", **config) -> EndpointPool:
+        configs = [EndpointConfig(name=name, azure_endpoint=f"https://{name}.example.invalid/", api_key="key",
+                                  api_version="2024-06-01", model=MODEL, **config) for name in names]
+        return EndpointPool(configs, routing, BreakerSettings(failure_threshold=2, cooldown=COOLDOWN))
+    return make
+
+
+def eject(pool: EndpointPool, name: str) -> None:
+    """Fails calls on an endpoint until its breaker opens."""
+    endpoint = next(endpoint for endpoint in pool.endpoints if endpoint.name == name)
+    for _ in range(pool.breaker.failure_threshold):
+        endpoint.outstanding += 1
+        pool.release(endpoint, failed=True)
+
+
+def states(pool: EndpointPool) -> dict:
+    return {row["name"]: row["state"] for row in pool.stats()}
+
+
+def test_consecutive_failures_eject_an_endpoint(make_pool, clock):
+    """🦄 After failure_threshold failures in a row the endpoint is ejected, and calls go to the others."""
+    # Arrange
+    pool = make_pool("sweden", "france")
+
+    # Act
+    eject(pool, "sweden")
+
+    # Assert
+    assert states(pool) == {"sweden": "open", "france": "closed"}
+    assert [pool.acquire(MODEL).name for _ in range(3)] == ["france"] * 3
+
+
+def test_a_success_in_between_resets_the_failure_count(make_pool, clock):
+    """🦄 Failures that are not consecutive do not eject the endpoint."""
+    # Arrange
+    pool = make_pool("sweden")
+    endpoint = pool.acquire(MODEL)
+    pool.release(endpoint, failed=True)
+
+    # Act
+    pool.release(pool.acquire(MODEL), latency=0.5)
+    pool.release(pool.acquire(MODEL), failed=True)
+
+    # Assert
+    assert states(pool) == {"sweden": "closed"}
+
+
+def test_after_the_cooldown_a_single_probe_is_let_through(make_pool, clock):
+    """🦄 Once the cooldown is over, one call probes the ejected endpoint; the others keep away while it runs."""
+    # Arrange
+    pool = make_pool("sweden", "france")
+    eject(pool, "sweden")
+    clock[0] += COOLDOWN
+
+    # Act
+    chosen = [pool.acquire(MODEL).name for _ in range(3)]
+
+    # Assert
+    assert chosen.count("sweden") == 1
+    assert states(pool)["sweden"] == "probing"
+
+
+def test_a_successful_probe_closes_the_breaker(make_pool, clock):
+    """🦄 The endpoint is back in the pool once its probe succeeds."""
+    # Arrange
+    pool = make_pool("sweden")
+    eject(pool, "sweden")
+    clock[0] += COOLDOWN
+    probe = pool.acquire(MODEL)
+
+    # Act
+    pool.release(probe, latency=0.5)
+
+    # Assert
+    assert states(pool) == {"sweden": "closed"}
+    assert pool.stats()[0]["ejections"] == 1
+
+
+def test_a_failed_probe_ejects_the_endpoint_for_another_cooldown(make_pool, clock):
+    """🦄 A probe that fails opens the breaker again at once, and the cooldown starts over."""
+    # Arrange
+    pool = make_pool("sweden", "france")
+    eject(pool, "sweden")
+    clock[0] += COOLDOWN
+    probe = next(endpoint for endpoint in (pool.acquire(MODEL), pool.acquire(MODEL)) if endpoint.name == "sweden")
+
+    # Act
+    pool.release(probe, failed=True)
+    clock[0] += COOLDOWN / 2
+
+    # Assert
+    assert states(pool)["sweden"] == "open"
+    assert pool.acquire(MODEL).name == "france"
+    assert pool.stats()[0]["ejections"] == 1
+
+
+def test_with_every_endpoint_ejected_each_is_probed_once(make_pool, clock):
+    """🦄 Without a healthy endpoint, calls probe the endpoints ejected longest ago, never one already probed."""
+    # Arrange
+    pool = make_pool("sweden", "france")
+    eject(pool, "france")
+    clock[0] += 1
+    eject(pool, "sweden")
+
+    # Act
+    first, second, third = (pool.acquire(MODEL) for _ in range(3))
+
+    # Assert
+    assert (first.name, second.name, third) == ("france", "sweden", None)
+    assert states(pool) == {"sweden": "probing", "france": "probing"}
+    assert isinstance(pool.unavailable_error(MODEL), EndpointUnavailableError)
+    assert isinstance(pool.unavailable_error("gpt-4o-mini"), ValueError)
+
+
+def test_ewma_routing_prefers_the_fastest_endpoint_scaled_by_its_load(make_pool, clock):
+    """🦄 The endpoint with the lowest latency gets the calls, until its outstanding calls make it the slower one."""
+    # Arrange
+    pool = make_pool("fast", "slow")
+    fast, slow = pool.endpoints
+    for endpoint, latency in ((fast, 1.0), (slow, 2.5)):
+        endpoint.outstanding += 1
+        pool.release(endpoint, latency=latency)
+
+    # Act
+    chosen = [pool.acquire(MODEL).name for _ in range(4)]
+
+    # Assert
+    # fast scores 1.0 x (outstanding + 1): it beats slow's 2.5 until its third call in flight
+    assert chosen == ["fast", "fast", "slow", "fast"]
+
+
+def test_ewma_routing_tries_endpoints_without_a_latency_yet(make_pool, clock):
+    """🦄 An endpoint that has not answered yet is assumed to be as fast as the fastest one, so it gets tried."""
+    # Arrange
+    pool = make_pool("known", "new")
+    known = pool.endpoints[0]
+    known.outstanding += 1
+    pool.release(known, latency=1.0)
+    known.outstanding += 1  # A call still in flight
+
+    # Act
+    chosen = pool.acquire(MODEL)
+
+    # Assert
+    assert chosen.name == "new"
+
+
+def test_least_outstanding_routing_balances_by_concurrency(make_pool, clock):
+    """🦄 least_outstanding picks the endpoint with the fewest calls in flight, relative to its concurrency."""
+    # Arrange
+    pool = make_pool("sweden", "france", routing="least_outstanding", max_concurrency=2)
+
+    # Act
+    chosen = [pool.acquire(MODEL).name for _ in range(4)]
+
+    # Assert
+    assert sorted(chosen) == ["france", "france", "sweden", "sweden"]
+    assert [row["outstanding"] for row in pool.stats()] == [2, 2]
+
+
+def test_an_excluded_endpoint_is_not_chosen(make_pool, clock):
+    """🦄 Failing over skips the endpoints already tried, and gives None once none is left."""
+    # Arrange
+    pool = make_pool("sweden", "france")
+
+    # Act
+    chosen = pool.acquire(MODEL, exclude=["sweden"])
+    none_left = pool.acquire(MODEL, exclude=["sweden", "france"])
+
+    # Assert
+    assert (chosen.name, none_left) == ("france", None)
+
+
+@pytest.fixture
+def endpoints(monkeypatch, make_pool, make_api_error):
+    """
+    Sends create_completion() and friends to a pool of fake endpoints. Each endpoint answers with the next of its
+    outcomes: an exception is raised, a list is streamed as chunks, anything else is returned.
+    """
+    pool = make_pool("sweden", "france", routing="least_outstanding")
+    outcomes = {"sweden": [], "france": []}
+    requests = []
+
+    def create(endpoint_name, **arguments):
+        requests.append((endpoint_name, arguments["model"]))
+        outcome = outcomes[endpoint_name].pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def client_for(config):
+        completions = SimpleNamespace(create=lambda **arguments: create(config.name, **arguments))
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def async_client_for(config):
+        async def create_async(**arguments):
+            return create(config.name, **arguments)
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create_async)))
+
+    monkeypatch.setattr(azure_client_utils, "get_pool", lambda: pool)
+    monkeypatch.setattr(azure_client_utils, "get_client", client_for)
+    monkeypatch.setattr(azure_client_utils, "get_async_client", async_client_for)
+    monkeypatch.setattr(azure_client_utils, "_scheduler_for", lambda config, deployment_name: RateLimitScheduler(
+        RateLimitSettings(max_retries=0, backoff_base=0.0)))
+    return SimpleNamespace(pool=pool, outcomes=outcomes, requests=requests, make_api_error=make_api_error)
+
+
+def server_error(endpoints) -> Exception:
+    return endpoints.make_api_error(openai.InternalServerError, status_code=500)
+
+
+def chunk(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+def arguments() -> dict:
+    return {"model": MODEL, "messages": [{"role": "user", "content": "Hello"}]}
+
+
+def test_a_failed_call_fails_over_to_the_next_endpoint(endpoints):
+    """🦄 A call that fails on one endpoint is sent to another, and the failure counts against the first one."""
+    # Arrange
+    endpoints.outcomes["sweden"] = [server_error(endpoints)]
+    endpoints.outcomes["france"] = ["reply"]
+
+    # Act
+    response = azure_client_utils.create_completion(**arguments())
+
+    # Assert
+    assert response == "reply"
+    assert [name for name, _ in endpoints.requests] == ["sweden", "france"]
+    assert [row["failures"] for row in endpoints.pool.stats()] == [1, 0]
+    assert [row["outstanding"] for row in endpoints.pool.stats()] == [0, 0]
+
+
+def test_throttling_fails_over_without_counting_against_the_endpoint(endpoints):
+    """🦄 A 429 means the endpoint is busy, not broken: the call moves on, and the breaker is left alone."""
+    # Arrange
+    endpoints.outcomes["sweden"] = [endpoints.make_api_error()]
+    endpoints.outcomes["france"] = ["reply"]
+
+    # Act
+    response = azure_client_utils.create_completion(**arguments())
+
+    # Assert
+    assert response == "reply"
+    assert [row["failures"] for row in endpoints.pool.stats()] == [0, 0]
+
+
+def test_the_last_error_is_raised_once_every_endpoint_failed(endpoints):
+    """🦄 When no endpoint is left to fail over to, the error of the last one is raised."""
+    # Arrange
+    endpoints.outcomes["sweden"] = [server_error(endpoints)]
+    endpoints.outcomes["france"] = [openai.APIConnectionError(request=httpx.Request("POST", "https://x.invalid"))]
+
+    # Act
+    with pytest.raises(openai.APIConnectionError):
+        azure_client_utils.create_completion(**arguments())
+
+    # Assert
+    assert len(endpoints.requests) == 2
+
+
+def test_a_call_with_every_endpoint_being_probed_fails_fast(endpoints, clock):
+    """🦄 Without an endpoint to call, a call fails at once instead of piling onto the probes."""
+    # Arrange
+    for name in ("sweden", "france"):
+        eject(endpoints.pool, name)
+    probes = [endpoints.pool.acquire(MODEL), endpoints.pool.acquire(MODEL)]
+
+    # Act
+    with pytest.raises(EndpointUnavailableError):
+        azure_client_utils.create_completion(**arguments())
+
+    # Assert
+    assert endpoints.requests == []
+    assert len(probes) == 2
+
+
+def test_the_async_call_fails_over_too(endpoints):
+    """🦄 create_completion_async() fails over like the synchronous call."""
+    # Arrange
+    endpoints.outcomes["sweden"] = [server_error(endpoints)]
+    endpoints.outcomes["france"] = ["reply"]
+
+    # Act
+    response = asyncio.run(azure_client_utils.create_completion_async(5.0, **arguments()))
+
+    # Assert
+    assert response == "reply"
+    assert [name for name, _ in endpoints.requests] == ["sweden", "france"]
+
+
+def test_a_stream_fails_over_before_its_first_token(endpoints):
+    """🦄 A stream that breaks off before any content is started again on another endpoint."""
+    # Arrange
+    endpoints.outcomes["sweden"] = [server_error(endpoints)]
+    endpoints.outcomes["france"] = [[chunk("Hel"), chunk("lo")]]
+
+    # Act
+    contents = [piece.choices[0].delta.content for piece in azure_client_utils.stream_completion(**arguments())]
+
+    # Assert
+    assert contents == ["Hel", "lo"]
+    assert [name for name, _ in endpoints.requests] == ["sweden", "france"]
+    assert [row["outstanding"] for row in endpoints.pool.stats()] == [0, 0]
+
+# fin.
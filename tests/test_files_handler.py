@@ -0,0 +1,121 @@
+import os
+
+from src.benchmarks.event_substitution_benchmark import build_synthetic_template, legacy_substitute_event_ids
+from src.files_management.files_handler import (
+    copy_and_read_xml_file,
+    describe_events_found,
+    prepare_xml_file,
+    replace_event_ids_with_names,
+    substitute_event_ids,
+)
+
+
+def test_substitution_matches_the_legacy_replace_loop(event_mapping):
+    """🦄 The single-pass substitution gives the same content as one str.replace per mapping row."""
+    # Arrange
+    template = build_synthetic_template(event_mapping, size_mb=0.25, seed=7)
+
+    # Act
+    content, _ = substitute_event_ids(template, event_mapping)
+
+    # Assert
+    assert content == legacy_substitute_event_ids(template, event_mapping)
+
+
+def test_substitution_matches_the_legacy_replace_loop_on_edge_cases(event_mapping, known_event_ids, unknown_event_id):
+    """🦄 Different IDs sharing a quote, unquoted IDs, upper case and unknown IDs are handled like str.replace."""
+    # Arrange
+    first, second, third = known_event_ids
+    template = (
+        f'<A Value="{first}"{second}" />\n'
+        f"<B Value='{first}' Text=\"{second} is not quoted\" />\n"
+        f'<C Value="{third.upper()}" Other="{unknown_event_id}" />\n'
+        f'<D Value=""{third}"" />\n'
+    )
+
+    # Act
+    content, _ = substitute_event_ids(template, event_mapping)
+
+    # Assert
+    assert content == legacy_substitute_event_ids(template, event_mapping)
+
+
+def test_substitution_replaces_an_id_repeated_around_a_shared_quote(event_mapping, known_event_ids):
+    """🦄 '"id"id"' has both IDs replaced, where the legacy loop left the second one (a deliberate difference)."""
+    # Arrange
+    first = known_event_ids[0]
+    template = f'<A Value="{first}"{first}" />'
+
+    # Act
+    content, events_index = substitute_event_ids(template, event_mapping)
+
+    # Assert
+    assert content == f'<A Value="{event_mapping[first]}"{event_mapping[first]}" />'
+    assert legacy_substitute_event_ids(template, event_mapping) == f'<A Value="{event_mapping[first]}"{first}" />'
+    assert events_index[first].count == 2
+
+
+def test_substitution_indexes_the_offsets_of_known_ids(event_mapping, known_event_ids, unknown_event_id,
+                                                       template_content):
+    """🦄 Every known ID is indexed at its offsets in the original content; unknown IDs are not indexed."""
+    # Arrange
+    first, second, _ = known_event_ids
+    template = template_content([first, second, first, unknown_event_id])
+
+    # Act
+    _, events_index = substitute_event_ids(template, event_mapping)
+
+    # Assert
+    assert set(events_index) == {first, second}
+    assert events_index[first].count == 2
+    assert events_index[second].event_name == event_mapping[second]
+    assert all(template[offset:offset + len(event_id)] == event_id
+               for event_id, occurrences in events_index.items() for offset in occurrences.offsets)
+
+
+def test_events_found_are_only_the_events_in_the_content(event_mapping, known_event_ids, unknown_event_id,
+                                                         template_content):
+    """🦄 replace_event_ids_with_names reports the names of the events that occur, not the whole mapping."""
+    # Arrange
+    template = template_content(known_event_ids[:2] + [unknown_event_id])
+
+    # Act
+    content, events_found, _ = replace_event_ids_with_names(template)
+
+    # Assert
+    assert events_found == {event_mapping[event_id] for event_id in known_event_ids[:2]}
+    assert unknown_event_id in content
+
+
+def test_describe_events_found_lists_the_most_frequent_first(event_mapping, known_event_ids, template_content):
+    """🦄 The events described in prompts are ordered by their number of occurrences."""
+    # Arrange
+    first, second, _ = known_event_ids
+    _, events_index = substitute_event_ids(template_content([first, second, second]), event_mapping)
+
+    # Act
+    description = describe_events_found(events_index)
+
+    # Assert
+    assert description.splitlines() == [
+        f"- {event_mapping[second]} (2 occurrences)",
+        f"- {event_mapping[first]} (1 occurrence)",
+    ]
+
+
+def test_prepare_xml_file_copies_and_substitutes(write_template, template_content, known_event_ids, event_mapping,
+                                                 artifacts_dir):
+    """🦄 A template is copied into the artifacts directory and its event IDs are replaced with names."""
+    # Arrange
+    path = write_template("logons.xml", known_event_ids[:1])
+
+    # Act
+    processed_file = prepare_xml_file(path, artifacts_dir)
+
+    # Assert
+    copy = os.path.join(artifacts_dir, "logons.xml")
+    assert copy_and_read_xml_file(copy) == ("logons.xml", template_content(known_event_ids[:1]))
+    assert event_mapping[known_event_ids[0]] in processed_file.content_with_event_names
+    assert processed_file.extracted_data == ""
+
+# fin.
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from src.pipeline.worker_pool import WorkerPoolSettings, worker_environment
+from src.utils.hedging import HedgePolicy, HedgeSettings, run_hedged, run_hedged_sync
+
+KIND = "stand-in/LikelyReportTypes"
+HEDGE_DELAY = 0.05  # Seconds: LLM_HEDGE_MIN_DELAY of the test policies, above their recorded latencies
+SLOW = 5.0  # Seconds an attempt takes when it is the one the hedge should beat
+
+caller_context = contextvars.ContextVar("caller_context", default=None)
+
+
+@pytest.fixture
+def make_policy():
+    """Makes an enabled hedge policy that already has enough fast latencies of KIND to hedge slow calls."""
+    def make(max_per_run: int = 20) -> HedgePolicy:
+        policy = HedgePolicy(HedgeSettings(enabled=True, min_samples=3, min_delay=HEDGE_DELAY, max_per_run=max_per_run))
+        for _ in range(3):
+            policy.record_latency(KIND, 0.01)
+        return policy
+    return make
+
+
+@pytest.fixture
+def attempts():
+    """Async attempts of a call, each following the next planned (seconds, error or None), noting the cancelled."""
+    class Attempts:
+        def __init__(self):
+            self.plans = []
+            self.started = []
+            self.cancelled = []
+            self.contexts = []
+
+        async def __call__(self):
+            index = len(self.started)
+            self.started.append(index)
+            self.contexts.append(caller_context.get())
+            seconds, error = self.plans[index]
+            try:
+                await asyncio.sleep(seconds)
+            except asyncio.CancelledError:
+                self.cancelled.append(index)
+                raise
+            if error is not None:
+                raise error
+            return f"reply {index}"
+    return Attempts()
+
+
+def test_a_disabled_policy_never_hedges(make_policy, attempts):
+    """🦄 With hedging off, the call is made once, however slow it is compared with the recent ones."""
+    # Arrange
+    policy = make_policy()
+    policy.settings.enabled = False
+    attempts.plans = [(0.2, None)]
+
+    # Act
+    result, outcome = asyncio.run(run_hedged(KIND, attempts, policy))
+
+    # Assert
+    assert result == "reply 0"
+    assert attempts.started == [0]
+    assert not outcome.hedged
+
+
+def test_a_call_is_not_hedged_without_enough_history(attempts):
+    """🦄 Until min_samples latencies of a kind are known, its calls are not hedged, but their latency is recorded."""
+    # Arrange
+    policy = HedgePolicy(HedgeSettings(enabled=True, min_samples=3, min_delay=HEDGE_DELAY))
+    attempts.plans = [(0.2, None)]
+
+    # Act
+    result, outcome = asyncio.run(run_hedged(KIND, attempts, policy))
+
+    # Assert
+    assert (result, outcome.hedged) == ("reply 0", False)
+    assert policy.hedge_delay(KIND) is None
+    assert policy.stats()["hedges"] == 0
+
+
+def test_a_slow_call_is_hedged_and_the_loser_cancelled(make_policy, attempts):
+    """🦄 A call slower than the recent ones gets a duplicate; the faster reply is used and the call cancelled."""
+    # Arrange
+    policy = make_policy()
+    attempts.plans = [(SLOW, None), (0.0, None)]
+
+    # Act
+    result, outcome = asyncio.run(run_hedged(KIND, attempts, policy))
+
+    # Assert
+    assert result == "reply 1"
+    assert (outcome.hedged, outcome.hedge_won, outcome.delay) == (True, True, HEDGE_DELAY)
+    assert attempts.cancelled == [0]
+    assert policy.stats()["hedges"] == policy.stats()["hedge_wins"] == 1
+
+
+def test_the_hedge_covers_a_failing_call(make_policy, attempts):
+    """🦄 When one attempt fails, the other one's reply is used; only when both fail is the error raised."""
+    # Arrange
+    policy = make_policy()
+    # The call fails after the hedge was sent, then both the call and its hedge fail
+    attempts.plans = [(HEDGE_DELAY * 2, TimeoutError()), (HEDGE_DELAY * 2, None),
+                      (HEDGE_DELAY * 2, TimeoutError()), (0.0, TimeoutError())]
+
+    # Act
+    result, outcome = asyncio.run(run_hedged(KIND, attempts, policy))
+    with pytest.raises(TimeoutError):
+        asyncio.run(run_hedged(KIND, attempts, policy))
+
+    # Assert
+    assert (result, outcome.hedge_won) == ("reply 1", True)
+    assert attempts.cancelled == []
+
+
+def test_the_budget_caps_the_hedges_per_run(make_policy, attempts):
+    """🦄 Once max_per_run hedges are spent, slow calls are waited for instead of duplicated."""
+    # Arrange
+    policy = make_policy(max_per_run=1)
+    attempts.plans = [(SLOW, None), (0.0, None), (0.2, None)]
+
+    async def two_slow_calls():
+        return [await run_hedged(KIND, attempts, policy), await run_hedged(KIND, attempts, policy)]
+
+    # Act
+    (_, first), (second_result, second) = asyncio.run(two_slow_calls())
+
+    # Assert
+    assert first.hedged and not second.hedged
+    assert second_result == "reply 2"
+    assert policy.stats()["hedges"] == 1
+
+
+def test_a_sync_call_without_hedging_stays_synchronous(make_policy, attempts):
+    """🦄 A synchronous call that is not hedged is made as it is, in the caller's thread."""
+    # Arrange
+    policy = make_policy()
+    policy.settings.enabled = False
+    threads = []
+
+    def call():
+        threads.append(threading.current_thread())
+        return "sync reply"
+
+    # Act
+    result, outcome = run_hedged_sync(KIND, call, attempts, policy)
+
+    # Assert
+    assert (result, outcome.hedged) == ("sync reply", False)
+    assert threads == [threading.current_thread()]
+    assert attempts.started == []
+
+
+def test_a_hedged_sync_call_cancels_the_loser(make_policy, attempts):
+    """🦄 Hedged synchronous calls race on the hedging loop, so the slow attempt is cancelled, not left running."""
+    # Arrange
+    policy = make_policy()
+    attempts.plans = [(SLOW, None), (0.0, None)]
+    token = caller_context.set("file.xml")
+
+    # Act
+    try:
+        result, outcome = run_hedged_sync(KIND, lambda: pytest.fail("the sync call is not hedged"), attempts, policy)
+    finally:
+        caller_context.reset(token)
+
+    # Assert
+    assert (result, outcome.hedge_won) == ("reply 1", True)
+    assert attempts.cancelled == [0]
+    assert attempts.contexts == ["file.xml", "file.xml"]
+
+
+def test_workers_share_the_hedge_budget(monkeypatch):
+    """🦄 Each worker may hedge its share of the run's budget, rounded down."""
+    # Arrange
+    monkeypatch.setenv("LLM_HEDGE", "1")
+    monkeypatch.setenv("LLM_HEDGE_MAX_PER_RUN", "20")
+
+    # Act
+    environment = worker_environment(WorkerPoolSettings(workers=3))
+
+    # Assert
+    assert environment["LLM_HEDGE_MAX_PER_RUN"] == "6"
+
+
+def test_a_budget_smaller_than_the_workers_is_reported(monkeypatch, capsys):
+    """🦄 A share that rounds down to no hedge at all turns hedging off, and says so instead of doing it silently."""
+    # Arrange
+    monkeypatch.setenv("LLM_HEDGE", "1")
+    monkeypatch.setenv("LLM_HEDGE_MAX_PER_RUN", "3")
+
+    # Act
+    environment = worker_environment(WorkerPoolSettings(workers=4))
+
+    # Assert
+    assert environment["LLM_HEDGE_MAX_PER_RUN"] == "0"
+    assert "hedging is off" in capsys.readouterr().out
+
+# fin.
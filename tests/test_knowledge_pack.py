@@ -0,0 +1,96 @@
+import os
+import shutil
+
+import pytest
+
+from src.knowledge import knowledge_pack
+from src.knowledge.knowledge_pack import (
+    PACK_FILENAME,
+    KnowledgePackError,
+    compile_knowledge_pack,
+    compute_sources_hash,
+    get_knowledge_base,
+    load_knowledge_pack,
+    read_pack_hash,
+)
+
+
+@pytest.fixture
+def write_knowledge(tmp_path):
+    """Writes a knowledge directory whose event mapping holds the given rows, saved with a BOM like the real one."""
+    def write(name: str, event_names_by_id: dict) -> str:
+        directory = tmp_path / name
+        directory.mkdir()
+        rows = "".join(f"{event_id},{event_name}\n" for event_id, event_name in event_names_by_id.items())
+        (directory / "events_ids_names_mapping.csv").write_text(
+            "EventClassIDs,EventClassNames\n" + rows, encoding="utf-8-sig")
+        return str(directory)
+    return write
+
+
+@pytest.fixture
+def fresh_knowledge_bases(monkeypatch):
+    """Starts without any knowledge base loaded in this process."""
+    monkeypatch.setattr(knowledge_pack, "_knowledge_bases", {})
+
+
+def test_a_compiled_pack_loads_the_event_mapping(write_knowledge):
+    """🦄 The pack holds the event ID -> name mapping, under the hash of its sources."""
+    # Arrange
+    knowledge_dir = write_knowledge("knowledge", {"id-1": "Logon", "id-2": "Logoff"})
+
+    # Act
+    pack_hash = compile_knowledge_pack(knowledge_dir)
+
+    # Assert
+    knowledge_base = load_knowledge_pack(os.path.join(knowledge_dir, PACK_FILENAME))
+    assert knowledge_base.event_names_by_id == {"id-1": "Logon", "id-2": "Logoff"}
+    assert knowledge_base.pack_hash == pack_hash == compute_sources_hash(knowledge_dir)
+
+
+def test_a_changed_source_makes_the_pack_stale(write_knowledge):
+    """🦄 Editing a source CSV changes the sources' hash, so the pack is compiled again on next use."""
+    # Arrange
+    knowledge_dir = write_knowledge("knowledge", {"id-1": "Logon"})
+    compile_knowledge_pack(knowledge_dir)
+
+    # Act
+    with open(os.path.join(knowledge_dir, "events_ids_names_mapping.csv"), "a", encoding="utf-8") as file:
+        file.write("id-2,Logoff\n")
+
+    # Assert
+    assert read_pack_hash(os.path.join(knowledge_dir, PACK_FILENAME)) != compute_sources_hash(knowledge_dir)
+
+
+def test_each_knowledge_directory_gets_its_own_knowledge_base(fresh_knowledge_bases, write_knowledge):
+    """🦄 A second directory is loaded on its own instead of getting the first directory's knowledge."""
+    # Arrange
+    first_dir = write_knowledge("first", {"id-1": "Logon"})
+    second_dir = write_knowledge("second", {"id-1": "Password reset"})
+    first = get_knowledge_base(first_dir)
+
+    # Act
+    second = get_knowledge_base(second_dir)
+
+    # Assert
+    assert first.event_names_by_id == {"id-1": "Logon"}
+    assert second.event_names_by_id == {"id-1": "Password reset"}
+    assert get_knowledge_base(os.path.join(first_dir, ".")) is first
+
+
+def test_a_duplicate_source_fails_a_strict_compile(write_knowledge):
+    """🦄 A stray copy of a source is reported, and refused in strict mode."""
+    # Arrange
+    knowledge_dir = write_knowledge("knowledge", {"id-1": "Logon"})
+    shutil.copyfile(os.path.join(knowledge_dir, "events_ids_names_mapping.csv"),
+                    os.path.join(knowledge_dir, "events_ids_names_mapping-laptop.csv"))
+
+    # Act
+    with pytest.raises(KnowledgePackError) as raised:
+        compile_knowledge_pack(knowledge_dir, strict=True)
+
+    # Assert
+    assert "events_ids_names_mapping-laptop.csv" in str(raised.value)
+    assert read_pack_hash(os.path.join(knowledge_dir, PACK_FILENAME)) is None
+
+# fin.
@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+
+import pytest
+
+from src.utils import likelihood_policies
+from src.utils.likelihood_policies import (
+    DROPPED_DIRNAME,
+    REVIEW_QUEUE_FILENAME,
+    apply_rules,
+    defer_to_review,
+    load_likelihood_rules,
+    pending_reviews,
+)
+from src.utils.telemetry import telemetry_context
+
+
+@pytest.fixture
+def rules_file(tmp_path):
+    """Writes a rules file and loads it."""
+    def write(rules):
+        path = tmp_path / "likelihood_rules.json"
+        path.write_text(json.dumps({"rules": rules}), encoding="utf-8")
+        return load_likelihood_rules(str(path))
+    return write
+
+
+@pytest.fixture
+def review_dir(tmp_path):
+    """An artifacts directory of a deferred run: saved report variants and the review queue of their files."""
+    artifacts_dir = tmp_path / "artifacts"
+
+    def queue(filename, conclusions):
+        folder = artifacts_dir / filename.replace(".xml", "")
+        folder.mkdir(parents=True, exist_ok=True)
+        for report_type in conclusions:
+            (folder / f"{filename}_as_{report_type}_1.json").write_text("{}", encoding="utf-8")
+        entry = {
+            "file": filename,
+            "model": {report_type: {"conclusion": conclusion, "reasoning": f"{report_type} reasoning"}
+                      for report_type, conclusion in conclusions.items()},
+            "generated": {report_type: "maybe" for report_type in conclusions},
+        }
+        with open(artifacts_dir / REVIEW_QUEUE_FILENAME, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+    queue.path = str(artifacts_dir)
+    return queue
+
+
+def run_review(monkeypatch, artifacts_dir, *options):
+    monkeypatch.setattr(sys, "argv", ["likelihood_policies", "review", artifacts_dir, *options])
+    likelihood_policies.main()
+
+
+def dropped(artifacts_dir):
+    return sorted(name for _, _, names in os.walk(os.path.join(artifacts_dir, DROPPED_DIRNAME)) for name in names)
+
+
+def test_rules_correct_the_conclusions_in_order(rules_file):
+    """🦄 "set" replaces a likelihood and "at_least" only raises it, for the rules whose conditions all hold."""
+    # Arrange
+    rules = rules_file([
+        {"if": {"event_matches": "(?i)change"}, "set": {"NonDNS": "yes"}},
+        {"if": {"content_matches": "dnsZone"}, "at_least": {"DNS": "maybe", "LDAP": "maybe"}},
+        {"if": {"model": {"LDAP": "maybe"}, "extracted_matches": "(?i)history"}, "set": {"LDAP": "no"}},
+    ])
+    conclusions = {"LDAP": "yes", "DNS": "no", "NonDNS": "no"}
+
+    # Act
+    likelihoods = apply_rules(conclusions, "<dnsZone />", "no past data", {"Password change"}, rules=rules)
+
+    # Assert
+    assert likelihoods == {"LDAP": "yes", "DNS": "maybe", "NonDNS": "yes"}
+    assert conclusions == {"LDAP": "yes", "DNS": "no", "NonDNS": "no"}
+
+
+def test_rules_with_an_unknown_condition_are_refused(rules_file):
+    """🦄 A misspelled condition fails the loading, instead of making the rule apply to everything."""
+    # Act
+    with pytest.raises(ValueError) as raised:
+        rules_file([{"name": "typo", "if": {"contents_match": "dnsZone"}, "set": {"DNS": "yes"}}])
+
+    # Assert
+    assert "contents_match" in str(raised.value)
+
+
+def test_deferred_generates_at_the_floor_and_queues_the_file(tmp_path, monkeypatch):
+    """🦄 Every type is raised to the floor, and the file is queued with what the model said and what was made."""
+    # Arrange
+    queue_path = tmp_path / REVIEW_QUEUE_FILENAME
+    monkeypatch.setenv("LIKELIHOOD_REVIEW_QUEUE", str(queue_path))
+    monkeypatch.setenv("LIKELIHOOD_DEFERRED_FLOOR", "maybe")
+    parsed_completion = {"LDAP": {"conclusion": "yes", "reasoning": "logons"},
+                         "DNS": {"conclusion": "no", "reasoning": "no zones"}}
+
+    # Act
+    with telemetry_context(file="logons.xml"):
+        generated = defer_to_review(parsed_completion, {"LDAP": "yes", "DNS": "no"})
+
+    # Assert
+    assert generated == {"LDAP": "yes", "DNS": "maybe"}
+    entry = json.loads(queue_path.read_text(encoding="utf-8"))
+    assert (entry["file"], entry["model"], entry["generated"]) == ("logons.xml", parsed_completion, generated)
+
+
+def test_review_drops_the_types_rated_no(review_dir, monkeypatch):
+    """🦄 --drop-rated no moves the variants the model rated "no" to dropped/ and decides every pending file."""
+    # Arrange
+    review_dir("logons.xml", {"LDAP": "yes", "DNS": "no"})
+    review_dir("groups.xml", {"LDAP": "no", "DNS": "yes"})
+
+    # Act
+    run_review(monkeypatch, review_dir.path, "--drop-rated", "no")
+
+    # Assert
+    assert dropped(review_dir.path) == ["groups.xml_as_LDAP_1.json", "logons.xml_as_DNS_1.json"]
+    assert os.path.exists(os.path.join(review_dir.path, "logons", "logons.xml_as_LDAP_1.json"))
+    assert pending_reviews(review_dir.path) == []
+
+
+def test_review_drops_the_listed_pairs_and_approves_the_rest(review_dir, monkeypatch):
+    """🦄 --drop f:T drops only that pair; files queued after the review wait for the next one."""
+    # Arrange
+    review_dir("logons.xml", {"LDAP": "yes", "DNS": "no"})
+
+    # Act
+    run_review(monkeypatch, review_dir.path, "--drop", "logons.xml:LDAP")
+    review_dir("groups.xml", {"DNS": "yes"})
+
+    # Assert
+    assert dropped(review_dir.path) == ["logons.xml_as_LDAP_1.json"]
+    assert [entry["file"] for entry in pending_reviews(review_dir.path)] == ["groups.xml"]
+
+
+def test_review_approve_all_keeps_everything(review_dir, monkeypatch):
+    """🦄 --approve-all decides the pending files without moving any report."""
+    # Arrange
+    review_dir("logons.xml", {"LDAP": "yes", "DNS": "no"})
+
+    # Act
+    run_review(monkeypatch, review_dir.path, "--approve-all")
+
+    # Assert
+    assert dropped(review_dir.path) == []
+    assert pending_reviews(review_dir.path) == []
+
+
+def test_review_without_options_asks_for_the_pairs_to_drop(review_dir, monkeypatch, capsys):
+    """🦄 The pending files are listed with the model's reasoning, and one line of input decides them all."""
+    # Arrange
+    review_dir("logons.xml", {"LDAP": "yes", "DNS": "no"})
+    monkeypatch.setattr("builtins.input", lambda: "logons.xml:DNS")
+
+    # Act
+    run_review(monkeypatch, review_dir.path)
+
+    # Assert
+    assert "DNS: model says no, 1 variants. DNS reasoning" in capsys.readouterr().out
+    assert dropped(review_dir.path) == ["logons.xml_as_DNS_1.json"]
+    assert pending_reviews(review_dir.path) == []
+
+# fin.
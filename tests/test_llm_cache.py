@@ -0,0 +1,159 @@
+import pytest
+
+from src.utils import llm_cache
+from src.utils.llm_cache import LLMCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable clock in place of time.time, so entries get predictable creation and access times."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    """Makes caches sharing one SQLite file, e.g. to read what a cache in another mode has written."""
+    def make(**kwargs) -> LLMCache:
+        return LLMCache(path=str(tmp_path / "responses.sqlite"), **kwargs)
+    return make
+
+
+def test_use_mode_reads_what_it_writes(make_cache):
+    """🦄 In use mode a stored reply is returned for its key, and the lookups are counted."""
+    # Arrange
+    cache = make_cache(mode="use")
+    key = LLMCache.make_key("gpt", "system", "prompt", None, 0)
+
+    # Act
+    missed = cache.get(key)
+    cache.put(key, '{"answer": 42}')
+    hit = cache.get(key)
+
+    # Assert
+    assert (missed, hit) == (None, '{"answer": 42}')
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"], stats["entries"]) == (1, 1, 1, 1)
+
+
+def test_refresh_mode_writes_without_reading(make_cache):
+    """🦄 Refresh mode ignores cached replies but stores new ones for later runs."""
+    # Arrange
+    key = LLMCache.make_key("gpt", "system", "prompt", None, 0)
+    make_cache(mode="use").put(key, "old")
+    refreshing = make_cache(mode="refresh")
+
+    # Act
+    cached = refreshing.get(key)
+    refreshing.put(key, "new")
+
+    # Assert
+    assert cached is None
+    assert make_cache(mode="use").get(key) == "new"
+
+
+def test_bypass_mode_neither_reads_nor_writes(make_cache):
+    """🦄 Bypass mode leaves the cache untouched, and no call takes part in caching."""
+    # Arrange
+    key = LLMCache.make_key("gpt", "system", "prompt", None, 0)
+    make_cache(mode="use").put(key, "cached")
+    bypassing = make_cache(mode="bypass")
+
+    # Act
+    bypassing.put(key, "not stored")
+
+    # Assert
+    assert not bypassing.should_cache(0)
+    assert bypassing.get(key) is None
+    assert make_cache(mode="use").get(key) == "cached"
+
+
+def test_only_deterministic_calls_are_cached_by_default(make_cache):
+    """🦄 Calls with a temperature above 0 are cached only when all temperatures are enabled."""
+    # Arrange
+    default = make_cache()
+    all_temperatures = make_cache(cache_all_temperatures=True)
+
+    # Act
+    decisions = (default.should_cache(0), default.should_cache(0.7), all_temperatures.should_cache(0.7))
+
+    # Assert
+    assert decisions == (True, False, True)
+
+
+def test_keys_differ_in_everything_that_determines_a_reply():
+    """🦄 Changing the deployment, a prompt, the schema, the temperature or an extra argument changes the key."""
+    # Arrange
+    arguments = ("gpt", "system", "prompt", '{"type": "object"}', 0)
+
+    # Act
+    keys = {
+        LLMCache.make_key(*arguments),
+        LLMCache.make_key("other", *arguments[1:]),
+        LLMCache.make_key("gpt", "other", *arguments[2:]),
+        LLMCache.make_key("gpt", "system", "other", *arguments[3:]),
+        LLMCache.make_key("gpt", "system", "prompt", None, 0),
+        LLMCache.make_key(*arguments[:4], 0.5),
+        LLMCache.make_key(*arguments, samples=3),
+    }
+
+    # Assert
+    assert len(keys) == 7
+    assert LLMCache.make_key(*arguments) == LLMCache.make_key("gpt", "system", "prompt", '{"type": "object"}', 0.0)
+
+
+def test_expired_entries_are_misses_and_are_evicted(make_cache, clock):
+    """🦄 An entry older than the age limit is no longer returned, and the next eviction removes it."""
+    # Arrange
+    cache = make_cache(max_age_seconds=60)
+    cache.put("old", "reply")
+    clock[0] += 30
+    cache.put("recent", "reply")
+    clock[0] += 31
+
+    # Act
+    expired = cache.get("old")
+    removed = cache.evict()
+
+    # Assert
+    assert expired is None
+    assert removed == 1
+    assert cache.get("recent") == "reply"
+    assert cache.stats()["entries"] == 1
+
+
+def test_eviction_removes_the_least_recently_used_entries_first(make_cache, clock):
+    """🦄 Over the size limit, the entries read longest ago go first until the cache fits again."""
+    # Arrange
+    cache = make_cache(max_bytes=10)
+    for key in ("a", "b", "c"):
+        cache.put(key, "1234")
+        clock[0] += 1
+    cache.get("a")
+
+    # Act
+    removed = cache.evict()
+
+    # Assert
+    assert removed == 1
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("1234", "1234")
+    assert cache.stats()["size_bytes"] == 8
+
+
+def test_eviction_runs_every_so_many_writes(make_cache, monkeypatch):
+    """🦄 Writes check the size limit periodically, so the cache does not grow without bound."""
+    # Arrange
+    monkeypatch.setattr(llm_cache, "EVICTION_CHECK_INTERVAL", 3)
+    cache = make_cache(max_bytes=8)
+
+    # Act
+    for key in ("a", "b", "c"):
+        cache.put(key, "1234")
+
+    # Assert
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 1
+
+# fin.
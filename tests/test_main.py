@@ -0,0 +1,81 @@
+import asyncio
+from typing import List
+
+import pytest
+
+import main
+from src.pipeline.background_preprocessing import BackgroundPreprocessor
+
+
+@pytest.fixture
+def selections(monkeypatch):
+    """Answers the file dialogs with the given paths, then cancels; the selection is confirmed as it is."""
+    answers: List[str] = []
+    monkeypatch.setattr(main, "select_xml_file", lambda: answers.pop(0) if answers else None)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    return answers
+
+
+@pytest.fixture
+def preprocessor():
+    """Records the files it is asked to pre-process, instead of pre-processing them."""
+    class RecordingPreprocessor:
+        def __init__(self):
+            self.added = []
+
+        def add(self, file_path):
+            self.added.append(file_path)
+    return RecordingPreprocessor()
+
+
+def test_a_second_file_of_the_same_name_is_rejected_when_selected(selections, preprocessor, capsys):
+    """🦄 A file named like one already selected is refused in the dialog loop, before any pre-processing starts."""
+    # Arrange
+    selections.extend(["/exports/a/logons.xml", "/exports/b/logons.xml", "/exports/a/groups.xml"])
+
+    # Act
+    file_paths = main.collect_xml_file_paths(preprocessor)
+
+    # Assert
+    assert file_paths == ["/exports/a/logons.xml", "/exports/a/groups.xml"]
+    assert preprocessor.added == file_paths
+    assert "A file named logons.xml is already selected" in capsys.readouterr().out
+
+
+def test_adding_more_files_rejects_the_same_name_too(selections, preprocessor):
+    """🦄 Files added after the first selection are checked against it, by path and by name."""
+    # Arrange
+    selections.extend(["/exports/a/logons.xml", "/exports/b/logons.xml", "/exports/b/groups.xml"])
+
+    # Act
+    file_paths = main.add_more_files(["/exports/a/logons.xml"], preprocessor)
+
+    # Assert
+    assert file_paths == ["/exports/a/logons.xml", "/exports/b/groups.xml"]
+    assert preprocessor.added == ["/exports/b/groups.xml"]
+
+
+def test_the_preprocessor_refuses_a_second_file_of_the_same_name(artifacts_dir, monkeypatch):
+    """🦄 What is pre-processed is named after the file name, so a second file of that name is refused."""
+    # Arrange
+    preprocessor = BackgroundPreprocessor(artifacts_dir)
+
+    async def start_nothing(file_path):
+        return asyncio.ensure_future(asyncio.sleep(0))
+
+    monkeypatch.setattr(preprocessor, "_start", start_nothing)
+    preprocessor.add("/exports/a/logons.xml")
+
+    # Act
+    try:
+        with pytest.raises(ValueError):
+            preprocessor.add("/exports/b/logons.xml")
+        preprocessor.add("/exports/a/logons.xml")
+        status = preprocessor.status()
+    finally:
+        preprocessor.close()
+
+    # Assert
+    assert status["files"] == 1
+
+# fin.
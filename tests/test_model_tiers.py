@@ -0,0 +1,88 @@
+import pytest
+
+from src.utils import model_tiers
+from src.utils.azure_client_utils import resolve_stage_tier
+from src.utils.model_tiers import StageTier, get_stage_tier
+from src.utils.telemetry import telemetry_context
+
+
+@pytest.fixture
+def stage_environment(monkeypatch):
+    """Sets the LLM_* variables of the stages, and makes the tiers be read from the environment again."""
+    monkeypatch.setattr(model_tiers, "_tiers", {})
+    for stage in model_tiers.STAGES:
+        for variable in ("MODEL", "TEMPERATURE", "ESCALATE"):
+            monkeypatch.delenv(f"LLM_{variable}_{stage.upper()}", raising=False)
+
+    def set_environment(**variables):
+        for name, value in variables.items():
+            monkeypatch.setenv(name, value)
+    return set_environment
+
+
+def test_a_stage_without_settings_uses_the_default_deployment(stage_environment):
+    """🦄 Stages, and calls outside any stage, run on the default deployment with the temperature they ask for."""
+    # Arrange
+    stage_environment(LLM_MODEL_LIKELIHOOD="gpt-4o-mini")
+
+    # Act
+    content, outside = get_stage_tier("gpt-4o", "content"), get_stage_tier("gpt-4o")
+
+    # Assert
+    assert content == outside == StageTier(deployment_name="gpt-4o")
+    assert content.temperature_for(0.7) == 0.7
+
+
+def test_a_stage_gets_its_deployment_temperature_and_escalation(stage_environment):
+    """🦄 LLM_MODEL_, LLM_TEMPERATURE_ and LLM_ESCALATE_<STAGE> make up the stage's tier."""
+    # Arrange
+    stage_environment(LLM_MODEL_LIKELIHOOD="gpt-4o-mini", LLM_TEMPERATURE_LIKELIHOOD="0",
+                      LLM_ESCALATE_LIKELIHOOD="gpt-4o")
+
+    # Act
+    tier = get_stage_tier("gpt-4o", "likelihood")
+
+    # Assert
+    assert tier == StageTier(deployment_name="gpt-4o-mini", temperature=0.0, escalate_to="gpt-4o")
+    assert tier.temperature_for(0.25) == 0.0
+
+
+def test_the_stage_is_taken_from_the_telemetry_context(stage_environment):
+    """🦄 Without an explicit stage, a call gets the tier of the stage it is made in."""
+    # Arrange
+    stage_environment(LLM_MODEL_METADATA="gpt-4o-mini")
+
+    # Act
+    with telemetry_context(stage="metadata", file="logons.xml"):
+        tier = get_stage_tier("gpt-4o")
+
+    # Assert
+    assert tier.deployment_name == "gpt-4o-mini"
+
+
+def test_tiers_are_kept_per_default_deployment(stage_environment):
+    """🦄 Stages without settings of their own follow the default deployment they are asked for."""
+    # Arrange
+    stage_environment(LLM_MODEL_LIKELIHOOD="gpt-4o-mini")
+
+    # Act
+    live, batch = get_stage_tier("gpt-4o", "content"), get_stage_tier("gpt-4o-batch", "content")
+
+    # Assert
+    assert (live.deployment_name, batch.deployment_name) == ("gpt-4o", "gpt-4o-batch")
+    assert get_stage_tier("gpt-4o-batch", "likelihood").deployment_name == "gpt-4o-mini"
+
+
+def test_stand_in_calls_never_share_a_real_deployment(stage_environment):
+    """🦄 Against the stand-in, a stage's deployment is renamed, so fake replies are never cached as real ones."""
+    # Arrange
+    stage_environment(LLM_MODEL_LIKELIHOOD="gpt-4o-mini", LLM_ESCALATE_LIKELIHOOD="gpt-4o")
+
+    # Act
+    tier = resolve_stage_tier("stand-in", "likelihood")
+
+    # Assert
+    assert (tier.deployment_name, tier.escalate_to) == ("stand-in-gpt-4o-mini", "stand-in-gpt-4o")
+    assert resolve_stage_tier("stand-in", "content").deployment_name == "stand-in"
+
+# fin.
@@ -0,0 +1,441 @@
+import asyncio
+import email.utils
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from src.utils.rate_limiter import (
+    AIMDConcurrencyLimit,
+    RateLimitScheduler,
+    RateLimitSettings,
+    TokenBucket,
+    is_throttling,
+    retry_after_seconds,
+)
+
+
+@pytest.fixture
+def scheduler() -> RateLimitScheduler:
+    """A scheduler that retries without sleeping."""
+    return RateLimitScheduler(RateLimitSettings(max_retries=2, backoff_base=0.0, max_concurrency=2))
+
+
+@pytest.fixture
+def calls():
+    """Runs the given outcomes one per call: an exception is raised, anything else is returned."""
+    class Calls:
+        def __init__(self):
+            self.outcomes = []
+            self.count = 0
+
+        def __call__(self):
+            outcome = self.outcomes[self.count]
+            self.count += 1
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+    return Calls()
+
+
+@pytest.fixture
+def make_stream():
+    """Builds a closable stream of chunks that may break off with an error after some of them."""
+    class Stream:
+        def __init__(self, chunks, error=None):
+            self.chunks = chunks
+            self.error = error
+            self.closed = False
+
+        def __iter__(self):
+            yield from self.chunks
+            if self.error is not None:
+                raise self.error
+
+        def close(self):
+            self.closed = True
+    return Stream
+
+
+def chunk(content=None, total_tokens=None):
+    return SimpleNamespace(content=content, usage=SimpleNamespace(total_tokens=total_tokens) if total_tokens else None)
+
+
+def is_token(item) -> bool:
+    return item.content is not None
+
+
+def test_token_bucket_takes_what_it_has():
+    """🦄 Tokens are taken while the bucket has them."""
+    # Arrange
+    bucket = TokenBucket(capacity=600)
+
+    # Act
+    waits = [bucket.try_take(200) for _ in range(3)]
+
+    # Assert
+    assert waits == [0.0, 0.0, 0.0]
+    assert bucket._tokens == pytest.approx(0, abs=1)
+
+
+def test_token_bucket_says_how_long_to_wait():
+    """🦄 An empty bucket returns the time it takes to refill what is needed, at capacity per minute."""
+    # Arrange
+    bucket = TokenBucket(capacity=60)
+    bucket.try_take(60)
+
+    # Act
+    wait = bucket.try_take(30)
+
+    # Assert
+    assert wait == pytest.approx(30.0, abs=0.1)
+
+
+def test_token_bucket_lets_a_request_bigger_than_itself_through_once_full():
+    """🦄 A request bigger than the bucket passes when the bucket is full, and leaves it in debt."""
+    # Arrange
+    bucket = TokenBucket(capacity=100)
+
+    # Act
+    first_wait = bucket.try_take(250)
+    second_wait = bucket.try_take(1)
+
+    # Assert
+    assert first_wait == 0.0
+    assert bucket._tokens == pytest.approx(-150, abs=1)
+    assert second_wait > 60.0
+
+
+def test_token_bucket_give_back_never_overfills():
+    """🦄 Over-estimated tokens are returned, up to the capacity."""
+    # Arrange
+    bucket = TokenBucket(capacity=100)
+    bucket.try_take(40)
+
+    # Act
+    bucket.give_back(500)
+
+    # Assert
+    assert bucket._tokens == 100
+
+
+def test_token_bucket_without_capacity_is_unlimited():
+    """🦄 A bucket of capacity 0 (no quota configured) never makes a call wait."""
+    # Arrange
+    bucket = TokenBucket(capacity=0)
+
+    # Act
+    waits = [bucket.try_take(10 ** 6) for _ in range(3)]
+
+    # Assert
+    assert waits == [0.0, 0.0, 0.0]
+
+
+def test_aimd_admits_up_to_the_limit():
+    """🦄 Slots are given until the limit is reached, and cancel frees one without changing the limit."""
+    # Arrange
+    limit = AIMDConcurrencyLimit(minimum=1, maximum=2)
+
+    # Act
+    admitted = [limit.try_acquire() for _ in range(3)]
+    limit.cancel()
+
+    # Assert
+    assert admitted == [True, True, False]
+    assert limit.try_acquire()
+    assert limit.limit == 2
+
+
+def test_aimd_halves_once_per_burst_of_throttling():
+    """🦄 Throttling halves the limit, but a second 429 within the cooldown does not halve it again."""
+    # Arrange
+    limit = AIMDConcurrencyLimit(minimum=1, maximum=8, decrease_cooldown=60.0)
+    limit.try_acquire()
+    limit.try_acquire()
+
+    # Act
+    limit.release(throttled=True)
+    limit.release(throttled=True)
+
+    # Assert
+    assert limit.limit == 4
+    assert limit.throttle_events == 2
+    assert limit.in_flight == 0
+
+
+def test_aimd_never_goes_below_the_minimum():
+    """🦄 Repeated throttling stops at the minimum."""
+    # Arrange
+    limit = AIMDConcurrencyLimit(minimum=3, maximum=8, decrease_cooldown=0.0)
+
+    # Act
+    for _ in range(5):
+        limit.try_acquire()
+        limit.release(throttled=True)
+
+    # Assert
+    assert limit.limit == 3
+
+
+def test_aimd_grows_additively_after_successes():
+    """🦄 Each success adds 1/limit, so the limit grows by about one per `limit` successes, up to the maximum."""
+    # Arrange
+    limit = AIMDConcurrencyLimit(minimum=1, maximum=8, decrease_cooldown=0.0)
+    limit.try_acquire()
+    limit.release(throttled=True)
+
+    # Act
+    for _ in range(4):
+        limit.try_acquire()
+        limit.release()
+
+    # Assert
+    assert 4.9 < limit.limit < 5.0
+
+
+def test_retry_after_ms_takes_precedence(make_api_error):
+    """🦄 Azure's retry-after-ms header is read in milliseconds, before Retry-After."""
+    # Arrange
+    error = make_api_error(headers={"retry-after-ms": "1500", "retry-after": "9"})
+
+    # Act
+    seconds = retry_after_seconds(error)
+
+    # Assert
+    assert seconds == 1.5
+
+
+def test_retry_after_in_seconds(make_api_error):
+    """🦄 A numeric Retry-After is a number of seconds."""
+    # Arrange
+    error = make_api_error(headers={"retry-after": "7"})
+
+    # Act
+    seconds = retry_after_seconds(error)
+
+    # Assert
+    assert seconds == 7.0
+
+
+def test_retry_after_as_an_http_date(make_api_error):
+    """🦄 A Retry-After date is turned into the seconds left until then."""
+    # Arrange
+    error = make_api_error(headers={"retry-after": email.utils.formatdate(time.time() + 30, usegmt=True)})
+
+    # Act
+    seconds = retry_after_seconds(error)
+
+    # Assert
+    assert 28.0 <= seconds <= 30.0
+
+
+@pytest.mark.parametrize("headers", [{}, {"retry-after": "soon"}, {"retry-after-ms": "later"}])
+def test_retry_after_missing_or_unreadable(make_api_error, headers):
+    """🦄 No Retry-After, or one that cannot be read, gives None."""
+    # Arrange
+    error = make_api_error(headers=headers)
+
+    # Act
+    seconds = retry_after_seconds(error)
+
+    # Assert
+    assert seconds is None
+
+
+def test_retry_after_of_an_error_without_response():
+    """🦄 Errors that never got a response (e.g. connection errors) have no Retry-After."""
+    # Arrange
+    error = openai.APIConnectionError(request=httpx.Request("POST", "https://example.invalid"))
+
+    # Act
+    seconds = retry_after_seconds(error)
+
+    # Assert
+    assert seconds is None
+
+
+def test_throttling_errors(make_api_error):
+    """🦄 429s and timeouts count as throttling; server errors do not."""
+    # Arrange
+    errors = [
+        make_api_error(),
+        openai.APITimeoutError(request=httpx.Request("POST", "https://example.invalid")),
+        make_api_error(openai.InternalServerError, status_code=500),
+    ]
+
+    # Act
+    throttling = [is_throttling(error) for error in errors]
+
+    # Assert
+    assert throttling == [True, True, False]
+
+
+def test_backoff_waits_for_retry_after_plus_jitter(make_api_error):
+    """🦄 The backoff honours Retry-After, with up to backoff_base of jitter on top."""
+    # Arrange
+    scheduler = RateLimitScheduler(RateLimitSettings(backoff_base=1.0))
+    error = make_api_error(headers={"retry-after": "2"})
+
+    # Act
+    delays = [scheduler.backoff_delay(error, attempt=5) for _ in range(50)]
+
+    # Assert
+    assert all(2.0 <= delay <= 3.0 for delay in delays)
+
+
+def test_backoff_is_exponential_and_capped(make_api_error):
+    """🦄 Without Retry-After the backoff is full jitter up to base * 2^attempt, capped at backoff_max."""
+    # Arrange
+    scheduler = RateLimitScheduler(RateLimitSettings(backoff_base=1.0, backoff_max=5.0))
+    error = make_api_error()
+
+    # Act
+    early = [scheduler.backoff_delay(error, attempt=1) for _ in range(50)]
+    late = [scheduler.backoff_delay(error, attempt=10) for _ in range(50)]
+
+    # Assert
+    assert all(0.0 <= delay <= 2.0 for delay in early)
+    assert all(0.0 <= delay <= 5.0 for delay in late)
+
+
+def test_call_retries_transient_failures(scheduler, calls, make_api_error):
+    """🦄 A throttled call is retried, and the throttling is fed to the concurrency limit."""
+    # Arrange
+    calls.outcomes = [make_api_error(), "reply"]
+
+    # Act
+    response = scheduler.call(100, calls)
+
+    # Assert
+    assert response == "reply"
+    assert calls.count == 2
+    # Halved from 2 to 1 by the 429, then back to 2 by the success
+    assert scheduler.stats() == {"concurrency_limit": 2.0, "in_flight": 0, "throttle_events": 1, "retries": 1}
+
+
+def test_call_gives_up_after_max_retries(scheduler, calls, make_api_error):
+    """🦄 The last failure is raised once the retries are used up, and no slot is left taken."""
+    # Arrange
+    calls.outcomes = [make_api_error(openai.InternalServerError, status_code=500)] * 3
+
+    # Act
+    with pytest.raises(openai.InternalServerError):
+        scheduler.call(100, calls)
+
+    # Assert
+    assert calls.count == 3
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_call_does_not_retry_other_errors(scheduler, calls, make_api_error):
+    """🦄 A bad request is raised at once."""
+    # Arrange
+    calls.outcomes = [make_api_error(openai.BadRequestError, status_code=400), "reply"]
+
+    # Act
+    with pytest.raises(openai.BadRequestError):
+        scheduler.call(100, calls)
+
+    # Assert
+    assert calls.count == 1
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_call_corrects_the_token_budget_with_the_usage(calls):
+    """🦄 The estimated tokens are replaced by the tokens the API reported."""
+    # Arrange
+    scheduler = RateLimitScheduler(RateLimitSettings(tokens_per_minute=1000))
+    calls.outcomes = [chunk(total_tokens=100)]
+
+    # Act
+    scheduler.call(500, calls)
+
+    # Assert
+    assert scheduler.tokens_bucket._tokens == pytest.approx(900, abs=1)
+
+
+def test_call_async_retries_transient_failures(scheduler, calls, make_api_error):
+    """🦄 The async call retries like the synchronous one."""
+    # Arrange
+    calls.outcomes = [make_api_error(), "reply"]
+
+    async def create():
+        return calls()
+
+    # Act
+    response = asyncio.run(scheduler.call_async(100, create))
+
+    # Assert
+    assert response == "reply"
+    assert scheduler.retries == 1
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_stream_retries_a_failure_before_the_first_token(scheduler, calls, make_stream):
+    """🦄 A stream that breaks off before any token is started again."""
+    # Arrange
+    first = make_stream([chunk()], error=httpx.ReadError("connection reset"))
+    second = make_stream([chunk(), chunk("Hello"), chunk(total_tokens=20)])
+    calls.outcomes = [first, second]
+
+    # Act
+    contents = [item.content for item in scheduler.stream(100, calls, is_token)]
+
+    # Assert
+    assert contents == [None, None, "Hello", None]
+    assert scheduler.retries == 1
+    assert first.closed and second.closed
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_stream_raises_a_failure_after_the_first_token(scheduler, calls, make_stream):
+    """🦄 Once the consumer has part of the reply, a failure is raised instead of starting over."""
+    # Arrange
+    calls.outcomes = [make_stream([chunk("Hel")], error=httpx.ReadError("connection reset")),
+                      make_stream([chunk("Hello")])]
+    received = []
+
+    # Act
+    with pytest.raises(httpx.ReadError):
+        for item in scheduler.stream(100, calls, is_token):
+            received.append(item.content)
+
+    # Assert
+    assert received == ["Hel"]
+    assert calls.count == 1
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_stream_holds_its_slot_until_closed(scheduler, calls, make_stream):
+    """🦄 The concurrency slot is taken while the stream is read, and freed when the consumer stops early."""
+    # Arrange
+    stream = make_stream([chunk("a"), chunk("b")])
+    calls.outcomes = [stream]
+    chunks = scheduler.stream(100, calls, is_token)
+
+    # Act
+    next(chunks)
+    in_flight_while_reading = scheduler.concurrency.in_flight
+    chunks.close()
+
+    # Assert
+    assert in_flight_while_reading == 1
+    assert scheduler.concurrency.in_flight == 0
+    assert stream.closed
+
+
+def test_stream_corrects_the_token_budget_with_the_final_usage(calls, make_stream):
+    """🦄 The usage of the last chunk replaces the estimate once the stream ends."""
+    # Arrange
+    scheduler = RateLimitScheduler(RateLimitSettings(tokens_per_minute=1000))
+    calls.outcomes = [make_stream([chunk("a"), chunk(total_tokens=50)])]
+
+    # Act
+    list(scheduler.stream(300, calls, is_token))
+
+    # Assert
+    assert scheduler.tokens_bucket._tokens == pytest.approx(950, abs=1)
+
+# fin.
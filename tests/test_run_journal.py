@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import cli
+from src.pipeline.staged_pipeline import PipelineSettings, run_staged_pipeline
+from src.utils.run_journal import RunJournal, get_file_journal, journal_file, journal_path_for
+
+
+@pytest.fixture
+def journal(tmp_path) -> RunJournal:
+    return RunJournal(str(tmp_path / "journal" / "run_journal.sqlite"))
+
+
+@pytest.fixture
+def settings() -> PipelineSettings:
+    return PipelineSettings(progress_interval=0)
+
+
+@pytest.fixture
+def llm_requests(stand_in):
+    """How many chat-completions requests the stand-in server has received so far."""
+    return lambda: stand_in.stats.snapshot().get("requests", 0)
+
+
+@pytest.fixture
+def interrupted_before_writing(run_journal):
+    """Forgets that the files were written, as if the run had been killed just before saving their reports."""
+    def interrupt() -> None:
+        with sqlite3.connect(run_journal.path) as connection:
+            connection.execute("DELETE FROM stages WHERE stage = 'write'")
+    return interrupt
+
+
+def test_a_stage_is_unknown_until_recorded(journal):
+    """🦄 A stage that did not complete has no output; a recorded one is read back as it was recorded."""
+    # Arrange
+    likelihoods = {"LDAP": "yes", "DNS": "no", "NonDNS": "maybe"}
+
+    # Act
+    before = journal.stage_output("logons.xml", "likelihood")
+    journal.record_stage("logons.xml", "likelihood", likelihoods)
+
+    # Assert
+    assert before is None
+    assert journal.stage_output("logons.xml", "likelihood") == likelihoods
+
+
+def test_the_inputs_of_the_last_run_are_kept(journal):
+    """🦄 A later run over the same directory replaces the recorded inputs."""
+    # Arrange
+    journal.record_run(["/in/a.xml"], "auto")
+
+    # Act
+    journal.record_run(["/in/a.xml", "/in/b.xml"], "rules")
+
+    # Assert
+    assert journal.run_inputs() == (["/in/a.xml", "/in/b.xml"], "rules")
+
+
+def test_variants_are_recorded_per_unit(journal):
+    """🦄 Each variant unit of a report type is recorded on its own."""
+    # Arrange
+    reports = [{"Content": {"Title": "Logons"}}]
+
+    # Act
+    journal.record_variant("logons.xml", "DNS", "temperature=0.2", reports)
+
+    # Assert
+    assert journal.variant("logons.xml", "DNS", "temperature=0.2") == reports
+    assert journal.variant("logons.xml", "DNS", "temperature=0.8") is None
+
+
+def test_forget_deletes_only_that_file(journal):
+    """🦄 Forgetting a file removes its stages and variants, and keeps the other files'."""
+    # Arrange
+    for filename in ("logons.xml", "groups.xml"):
+        journal.record_stage(filename, "extraction", "extracted")
+        journal.record_variant(filename, "DNS", "temperature=0.2", [{}])
+
+    # Act
+    journal.forget("logons.xml")
+
+    # Assert
+    assert journal.stage_output("logons.xml", "extraction") is None
+    assert journal.variant("logons.xml", "DNS", "temperature=0.2") is None
+    assert journal.stage_output("groups.xml", "extraction") == "extracted"
+    assert journal.stats()["variant_units"] == 1
+
+
+def test_records_of_other_threads_are_visible(journal):
+    """🦄 Each thread has its own connection, and sees what the others committed."""
+    # Arrange
+    writer = threading.Thread(target=journal.record_stage, args=("logons.xml", "write", {"reports_saved": 3}))
+
+    # Act
+    writer.start()
+    writer.join()
+
+    # Assert
+    assert journal.stage_output("logons.xml", "write") == {"reports_saved": 3}
+
+
+def test_the_file_journal_follows_journal_file(run_journal):
+    """🦄 Inside journal_file(), records go to that file; outside it there is no file to record for."""
+    # Arrange
+    outside = get_file_journal()
+
+    # Act
+    with journal_file("logons.xml"):
+        get_file_journal().record_stage("extraction", "extracted")
+
+    # Assert
+    assert outside is None
+    assert run_journal.stage_output("logons.xml", "extraction") == "extracted"
+
+
+def test_a_resumed_run_skips_the_written_files(run_journal, templates, artifacts_dir, settings, llm_requests):
+    """🦄 Files written by an earlier attempt are not converted again, and keep their outcome."""
+    # Arrange
+    first = run_staged_pipeline(templates, artifacts_dir, settings)
+    requests_before = llm_requests()
+
+    # Act
+    resumed = run_staged_pipeline(templates, artifacts_dir, settings)
+
+    # Assert
+    assert llm_requests() == requests_before
+    assert [(result.likelihoods, result.reports_saved) for result in resumed] == \
+           [(result.likelihoods, result.reports_saved) for result in first]
+    assert run_journal.stats()["write"] == len(templates)
+
+
+def test_a_resumed_run_reuses_every_recorded_stage(interrupted_before_writing, templates, artifacts_dir, settings,
+                                                   llm_requests):
+    """🦄 A run killed before saving reuses the recorded extraction, likelihoods and variants, and only saves."""
+    # Arrange
+    first = run_staged_pipeline(templates, artifacts_dir, settings)
+    interrupted_before_writing()
+    for result in first:
+        for report in os.listdir(os.path.join(artifacts_dir, result.subdir_name)):
+            os.remove(os.path.join(artifacts_dir, result.subdir_name, report))
+    requests_before = llm_requests()
+
+    # Act
+    resumed = run_staged_pipeline(templates, artifacts_dir, settings)
+
+    # Assert
+    assert llm_requests() == requests_before
+    assert [result.reports_saved for result in resumed] == [result.reports_saved for result in first]
+    assert all(len(os.listdir(os.path.join(artifacts_dir, result.subdir_name))) == result.reports_saved
+               for result in resumed)
+
+
+def test_cli_resume_converts_the_same_files_again(run_journal, no_telemetry, templates, artifacts_dir, llm_requests):
+    """🦄 --resume takes the inputs from the journal, and finds nothing left to do after a complete run."""
+    # Arrange
+    cli.main(["--staged", "--output-dir", artifacts_dir, *templates])
+    requests_before = llm_requests()
+
+    # Act
+    exit_code = cli.main(["--staged", "--resume", artifacts_dir])
+
+    # Assert
+    assert exit_code == cli.EXIT_OK
+    assert llm_requests() == requests_before
+    with open(os.path.join(artifacts_dir, cli.RESULTS_FILENAME), "r", encoding="utf-8") as results_file:
+        outcomes = [json.loads(line) for line in results_file]
+    assert sorted(outcome["file_path"] for outcome in outcomes) == sorted(map(os.path.abspath, templates * 2))
+
+
+def test_cli_resume_without_a_journal_is_a_usage_error(tmp_path, capsys):
+    """🦄 A directory without a run journal has no run to resume."""
+    # Arrange
+    output_dir = str(tmp_path)
+
+    # Act
+    exit_code = cli.main(["--resume", output_dir])
+
+    # Assert
+    assert exit_code == cli.EXIT_USAGE
+    assert not os.path.exists(journal_path_for(output_dir))
+    assert f"No run to resume in {output_dir}" in capsys.readouterr().err
+
+# fin.
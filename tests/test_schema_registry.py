@@ -0,0 +1,130 @@
+from typing import List, Set
+
+import pytest
+from pydantic import BaseModel
+
+from src.utils import schema_registry
+from src.utils.schema_registry import SchemaValidationError, get_compiled_schema, validate_reply
+
+
+class FilterField(BaseModel):
+    name: str
+
+
+class Reply(BaseModel):
+    title: str
+    count: int
+    tags: List[str] = []
+    filter_fields: Set[FilterField] = set()  # Like the content schemas: a set of models, which are not hashable
+
+
+@pytest.fixture
+def valid_reply() -> dict:
+    return {"title": "Logons", "count": 2, "tags": ["security"],
+            "filter_fields": [{"name": "User"}, {"name": "Computer"}]}
+
+
+@pytest.fixture
+def invalid_reply(valid_reply) -> dict:
+    return {**valid_reply, "count": "two", "filter_fields": [{"label": "User"}]}
+
+
+@pytest.fixture
+def validation_mode_from_environment(monkeypatch):
+    """Makes the next validate_reply() without a mode read LLM_SCHEMA_VALIDATION again."""
+    monkeypatch.setattr(schema_registry, "_validation_mode", None)
+    return monkeypatch
+
+
+@pytest.mark.parametrize("mode", ["warn", "strict", "off"])
+def test_a_valid_reply_is_valid_in_every_mode(valid_reply, mode):
+    """🦄 A reply matching the schema passes, including a set of models, which Pydantic cannot hash."""
+    # Arrange
+    reply = valid_reply
+
+    # Act
+    valid = validate_reply(Reply, reply, mode)
+
+    # Assert
+    assert valid
+
+
+def test_an_invalid_reply_is_reported_in_warn_mode(invalid_reply, capsys):
+    """🦄 In warn mode an invalid reply is reported and flagged, but nothing is raised."""
+    # Arrange
+    reply = invalid_reply
+
+    # Act
+    valid = validate_reply(Reply, reply, "warn")
+
+    # Assert
+    assert not valid
+    assert "Warning: reply does not match Reply: count:" in capsys.readouterr().out
+
+
+def test_an_invalid_reply_raises_in_strict_mode(invalid_reply):
+    """🦄 In strict mode an invalid reply raises, with every error, and the items of sets are still validated."""
+    # Arrange
+    reply = invalid_reply
+
+    # Act
+    with pytest.raises(SchemaValidationError) as raised:
+        validate_reply(Reply, reply, "strict")
+
+    # Assert
+    assert raised.value.schema_name == "Reply"
+    assert [error["loc"] for error in raised.value.errors] == [("count",), ("filter_fields", 0, "name")]
+
+
+def test_an_invalid_reply_passes_when_validation_is_off(invalid_reply):
+    """🦄 With validation off, every reply is used as it is."""
+    # Arrange
+    reply = invalid_reply
+
+    # Act
+    valid = validate_reply(Reply, reply, "off")
+
+    # Assert
+    assert valid
+
+
+def test_the_mode_defaults_to_the_environment(validation_mode_from_environment, invalid_reply):
+    """🦄 Without a mode, LLM_SCHEMA_VALIDATION decides."""
+    # Arrange
+    validation_mode_from_environment.setenv("LLM_SCHEMA_VALIDATION", "Strict")
+
+    # Act
+    with pytest.raises(SchemaValidationError):
+        validate_reply(Reply, invalid_reply)
+
+    # Assert
+    assert schema_registry._validation_mode == "strict"
+
+
+def test_an_unknown_mode_in_the_environment_is_rejected(validation_mode_from_environment, valid_reply):
+    """🦄 A typo in LLM_SCHEMA_VALIDATION fails loudly instead of silently turning validation off."""
+    # Arrange
+    validation_mode_from_environment.setenv("LLM_SCHEMA_VALIDATION", "lenient")
+
+    # Act
+    with pytest.raises(ValueError) as raised:
+        validate_reply(Reply, valid_reply)
+
+    # Assert
+    assert "Invalid LLM_SCHEMA_VALIDATION: lenient" in str(raised.value)
+
+
+def test_schemas_are_compiled_once():
+    """🦄 The compiled schema is reused, and forces a tool call named after the model."""
+    # Arrange
+    first = get_compiled_schema(Reply)
+
+    # Act
+    second = get_compiled_schema(Reply)
+
+    # Assert
+    assert second is first
+    assert first.tool_arguments["tool_choice"] == {"type": "function", "function": {"name": "Reply"}}
+    assert first.tool_arguments["tools"][0]["function"]["parameters"] == Reply.model_json_schema()
+
+# fin.
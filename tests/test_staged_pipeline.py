@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from src.pipeline.staged_pipeline import (
+    PipelineSettings,
+    StageProgress,
+    run_staged_pipeline,
+    run_staged_pipeline_async,
+)
+
+
+@pytest.fixture
+def settings() -> PipelineSettings:
+    return PipelineSettings(queue_size=2, progress_interval=0)
+
+
+@pytest.fixture
+def many_templates(write_template, known_event_ids):
+    return [write_template(f"template_{index:02}.xml", known_event_ids[index % 3:]) for index in range(8)]
+
+
+def test_a_failing_file_does_not_stop_the_others(stand_in, templates, broken_template, artifacts_dir, settings):
+    """🦄 A file that fails is recorded with its stage and error, while the other files are converted."""
+    # Arrange
+    file_paths = [templates[0], broken_template, *templates[1:]]
+    finished = []
+
+    # Act
+    results = run_staged_pipeline(file_paths, artifacts_dir, settings, on_result=finished.append)
+
+    # Assert
+    assert [result.file_path for result in results] == file_paths
+    assert sorted(result.filename for result in finished) == sorted(os.path.basename(path) for path in file_paths)
+    assert results[1].error.startswith("read: UnicodeDecodeError")
+    assert all(result.ok and result.reports_saved > 0 for result in results if result is not results[1])
+    assert all(os.listdir(os.path.join(artifacts_dir, result.subdir_name)) for result in results if result.ok)
+
+
+def test_the_pipeline_leaves_no_task_or_call_behind(stand_in, many_templates, broken_template, artifacts_dir,
+                                                    settings):
+    """🦄 Once the run returns, every stage worker has stopped and no LLM call is in flight."""
+    # Arrange
+    async def run():
+        results = await run_staged_pipeline_async([*many_templates, broken_template], artifacts_dir, settings)
+        return results, asyncio.all_tasks() - {asyncio.current_task()}
+
+    # Act
+    results, tasks_left = asyncio.run(run())
+
+    # Assert
+    assert len(results) == len(many_templates) + 1
+    assert tasks_left == set()
+    assert stand_in.stats.snapshot()["in_flight"] == 0
+
+
+def test_a_cancelled_run_stops_every_stage(stand_in, many_templates, artifacts_dir, settings):
+    """🦄 Cancelling the run (e.g. Ctrl-C) cancels the files in every stage, and nothing is left running."""
+    # Arrange
+    async def run():
+        first_result = asyncio.Event()
+        pipeline = asyncio.create_task(run_staged_pipeline_async(
+            many_templates, artifacts_dir, settings, on_result=lambda result: first_result.set()))
+        await first_result.wait()
+        pipeline.cancel()
+        try:
+            await pipeline
+        except asyncio.CancelledError:
+            pass
+        # A gather ends with its first cancelled child; the others were cancelled too, and end on the next turns
+        stopping = asyncio.all_tasks() - {asyncio.current_task()}
+        _, still_running = await asyncio.wait(stopping, timeout=5) if stopping else (set(), set())
+        return pipeline, still_running
+
+    # Act
+    pipeline, still_running = asyncio.run(run())
+
+    # Assert
+    assert pipeline.cancelled()
+    assert still_running == set()
+
+
+def test_no_progress_line_is_printed_while_the_operator_answers(stand_in, templates, artifacts_dir, monkeypatch):
+    """🦄 The progress line holds back while an interactive likelihood question waits for its answer."""
+    # Arrange
+    settings = PipelineSettings(queue_size=2, progress_interval=0.02)
+    progress_lines = []
+    lines_while_answering = []
+    original_describe = StageProgress.describe
+    monkeypatch.setattr(StageProgress, "describe",
+                        lambda progress, total: progress_lines.append(1) or original_describe(progress, total))
+
+    def answer(prompt=""):
+        time.sleep(0.01)
+        before = len(progress_lines)
+        time.sleep(0.1)  # Five progress intervals
+        lines_while_answering.append(len(progress_lines) - before)
+        return ""
+
+    monkeypatch.setattr("builtins.input", answer)
+
+    # Act
+    results = run_staged_pipeline(templates, artifacts_dir, settings, likelihood_policy="interactive")
+
+    # Assert
+    assert all(result.ok for result in results)
+    assert lines_while_answering and set(lines_while_answering) == {0}
+    assert progress_lines
+
+# fin.
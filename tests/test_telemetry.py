@@ -0,0 +1,114 @@
+import pytest
+
+from src.utils.hedging import HedgeOutcome
+from src.utils.telemetry import (
+    configure_telemetry,
+    on_http_request,
+    on_http_response,
+    percentile,
+    read_records,
+    record_llm_call,
+    summarize,
+    telemetry_context,
+)
+
+
+@pytest.fixture
+def telemetry_path(tmp_path, no_telemetry) -> str:
+    """Writes the telemetry of the test's calls to a file of its own."""
+    path = str(tmp_path / "telemetry.jsonl")
+    configure_telemetry(path)
+    return path
+
+
+def test_a_call_is_written_with_its_context(telemetry_path):
+    """🦄 The stage, file and report type come from the surrounding contexts; other fields go to `extra`."""
+    # Arrange
+    with telemetry_context(stage="likelihood", file="logons.xml", worker=1):
+        with telemetry_context(report_type="LDAP"):
+
+            # Act
+            with record_llm_call("gpt", 0.0) as recorder:
+                on_http_request()
+                on_http_response()
+
+    # Assert
+    [record] = read_records(telemetry_path)
+    assert (record["stage"], record["file"], record["report_type"]) == ("likelihood", "logons.xml", "LDAP")
+    assert record["extra"] == {"worker": 1}
+    assert record["ttfb_ms"] is not None and record["latency_ms"] >= record["ttfb_ms"]
+    assert recorder.record.retries == 0
+
+
+def test_every_attempt_after_the_first_is_a_retry(telemetry_path):
+    """🦄 Each HTTP request of a call after the first one counts as a retry."""
+    # Act
+    with record_llm_call("gpt", 0.0):
+        for _ in range(3):
+            on_http_request()
+
+    # Assert
+    assert read_records(telemetry_path)[0]["retries"] == 2
+
+
+def test_a_hedged_request_is_not_a_retry(telemetry_path):
+    """🦄 The duplicate request sent by hedging is recorded as a hedge, not as a retry."""
+    # Act
+    with record_llm_call("gpt", 0.0) as recorder:
+        on_http_request()
+        on_http_request()
+        recorder.set_hedge(HedgeOutcome(hedged=True, hedge_won=True, delay=0.5, saved=1.25))
+
+    # Assert
+    [record] = read_records(telemetry_path)
+    assert record["retries"] == 0
+    assert record["extra"] == {"hedged": True, "hedge_won": True, "hedge_delay_ms": 500.0, "hedge_saved_ms": 1250.0}
+
+
+def test_a_failed_call_is_written_with_its_error(telemetry_path):
+    """🦄 A call that raises is still written, with the type of the error."""
+    # Act
+    with pytest.raises(TimeoutError):
+        with record_llm_call("gpt", 0.0):
+            raise TimeoutError()
+
+    # Assert
+    assert read_records(telemetry_path)[0]["error"] == "TimeoutError"
+
+
+def test_percentiles_are_nearest_rank():
+    """🦄 A percentile is one of the values: the smallest that has at least that fraction of values at or below."""
+    # Arrange
+    values = [float(value) for value in range(20, 0, -1)]
+
+    # Act
+    p50, p95, p100 = (percentile(values, fraction) for fraction in (0.5, 0.95, 1.0))
+
+    # Assert
+    assert (p50, p95, p100) == (10.0, 19.0, 20.0)
+    assert percentile([7.0], 0.5) == 7.0
+    assert percentile([], 0.5) is None
+
+
+def test_summary_adds_up_retries_and_latencies_per_group():
+    """🦄 The summary has one row per stage, with its calls, retries, errors, latency percentiles and cost."""
+    # Arrange
+    records = [
+        {"stage": "extraction", "latency_ms": 100.0, "retries": 2, "prompt_tokens": 1000, "cached_tokens": 500,
+         "completion_tokens": 100},
+        {"stage": "extraction", "latency_ms": 300.0, "retries": 0, "error": "APITimeoutError"},
+        {"stage": "likelihood", "latency_ms": 50.0, "cache_hit": True},
+    ]
+
+    # Act
+    extraction, likelihood = summarize(records, "stage", prompt_price=2.0, completion_price=10.0)
+
+    # Assert
+    assert (extraction["calls"], extraction["retries"], extraction["errors"]) == (2, 2, 1)
+    assert (extraction["p50_latency_ms"], extraction["p95_latency_ms"]) == (100.0, 300.0)
+    assert extraction["cached_ratio"] == 0.5
+    assert extraction["cost"] == 0.003
+    assert (likelihood["stage"], likelihood["cache_hits"], likelihood["retries"]) == ("likelihood", 1, 0)
+    assert "hedges" not in extraction
+
+# fin.
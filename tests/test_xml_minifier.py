@@ -0,0 +1,128 @@
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from src.files_management.xml_minifier import (
+    measure_minification,
+    minify_for_prompts,
+    minify_xml,
+    parse_attribute_rules,
+)
+
+
+def normalized_tree(xml_content: str):
+    """The elements, attributes and whitespace-normalized text of an XML document, in document order."""
+    root = ElementTree.fromstring(xml_content.encode("utf-16"))
+    return [(element.tag, element.attrib, " ".join((element.text or "").split()),
+             " ".join((element.tail or "").split())) for element in root.iter()]
+
+
+def test_minified_template_parses_to_the_same_tree(template_content, known_event_ids):
+    """🦄 Minifying drops formatting only: the template has the same elements, attributes and text."""
+    # Arrange
+    template = template_content(known_event_ids)
+
+    # Act
+    minified = minify_xml(template)
+
+    # Assert
+    assert normalized_tree(minified) == normalized_tree(template)
+    assert len(minified) < len(template)
+    assert "\n" not in minified and "<?xml" not in minified
+
+
+def test_comments_are_dropped_and_whitespace_collapsed():
+    """🦄 Comments, indentation and the space before '/>' go, runs of whitespace in text become one space."""
+    # Arrange
+    template = ('<Report>\n  <!-- exported by the tool -->\n'
+                '  <Title  Lang="en" >Weekly\n   logons</Title>\n  <Empty  />\n</Report>')
+
+    # Act
+    minified = minify_xml(template)
+
+    # Assert
+    assert minified == '<Report><Title Lang="en">Weekly logons</Title><Empty/></Report>'
+
+
+def test_attribute_values_and_cdata_are_kept_as_they_are():
+    """🦄 Whitespace, '>' and comment markers inside attribute values and CDATA sections are not touched."""
+    # Arrange
+    template = ('<Filter Value="a  >  b" Text=\'x\n y\'>\n'
+                '  <![CDATA[  keep <!-- this -->\n  as is  ]]>\n'
+                '</Filter>')
+
+    # Act
+    minified = minify_xml(template)
+
+    # Assert
+    assert minified == ('<Filter Value="a  >  b" Text=\'x\n y\'>'
+                        '<![CDATA[  keep <!-- this -->\n  as is  ]]></Filter>')
+
+
+def test_export_artefacts_are_removed():
+    """🦄 Byte-order marks, NULs and zero-width spaces left by UTF-16 exports are dropped."""
+    # Arrange
+    template = '\ufeff<Report>\x00<Title>Lo\u200bgons</Title></Report>'
+
+    # Act
+    minified = minify_xml(template)
+
+    # Assert
+    assert minified == "<Report><Title>Logons</Title></Report>"
+
+
+@pytest.mark.parametrize("rules, expected", [
+    (["Description"], '<Filter Name="EventClass" Operator="Equals"/><Filter Operator="Contains"/>'),
+    (["Operator=Equals"], '<Filter Name="EventClass" Description="x"/><Filter Description=\'y\' Operator="Contains"/>'),
+    (["Description", "Operator=Equals"], '<Filter Name="EventClass"/><Filter Operator="Contains"/>'),
+])
+def test_attributes_are_stripped_by_name_or_by_value(rules, expected):
+    """🦄 "name" strips the attribute everywhere, "name=value" only where it has that value."""
+    # Arrange
+    template = ('<Filter Name="EventClass" Operator="Equals" Description="x" />'
+                '<Filter Description=\'y\' Operator="Contains" />')
+
+    # Act
+    minified = minify_xml(template, rules)
+
+    # Assert
+    assert minified == expected
+
+
+def test_attribute_rules_are_parsed():
+    """🦄 Blank entries are skipped, and "name=" strips the attribute only where its value is empty."""
+    # Act
+    rules = parse_attribute_rules([" Description ", "", "Operator=Equals", "Note="])
+
+    # Assert
+    assert rules == (("Description", None), ("Operator", "Equals"), ("Note", ""))
+
+
+def test_minification_can_be_turned_off(monkeypatch, template_content, known_event_ids):
+    """🦄 With XML_MINIFY=0 the template goes into prompts as it is, and nothing is saved."""
+    # Arrange
+    monkeypatch.setenv("XML_MINIFY", "0")
+    template = template_content(known_event_ids)
+
+    # Act
+    content, stats = minify_for_prompts(template)
+
+    # Assert
+    assert content == template
+    assert stats.saved_tokens == 0 and stats.saved_ratio == 0.0
+
+
+def test_savings_are_measured_in_estimated_tokens(template_content, known_event_ids):
+    """🦄 The savings compare the estimated tokens of the original and minified templates."""
+    # Arrange
+    template = template_content(known_event_ids)
+
+    # Act
+    stats = measure_minification(template, minify_xml(template))
+
+    # Assert
+    assert stats.original_chars == len(template)
+    assert 0 < stats.minified_tokens < stats.original_tokens
+    assert stats.describe().endswith("saved per prompt)")
+
+# fin.